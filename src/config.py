@@ -45,6 +45,12 @@ class Config():
     # Total number of actors split evenly between each thread/process.
     ACTORS = 60
 
+    # If True, self-play processes send each game to the monitor as soon as
+    # it is over, and start a new game in its place. This keeps the amount of
+    # active games (and the size of evaluation batches) constant at ACTORS // 3,
+    # instead of shrinking until the last game of the batch is over.
+    CONTINUOUS_SELF_PLAY = False
+
     # How many games to generate per training run.
     # Default is to run training every time all processes
     # has completed a game.
@@ -62,6 +68,33 @@ class Config():
     # How many processes that should run evaluation games.
     EVAL_PROCESSES = 1
 
+    # Network evaluations are run when every self-play process has sent a request,
+    # when EVAL_MAX_BATCH positions are queued, or when the oldest queued
+    # request has waited EVAL_MAX_DELAY seconds, whichever comes first.
+    # Batches sent to the network never hold more than EVAL_MAX_BATCH positions.
+    EVAL_MAX_BATCH = 64
+
+    EVAL_MAX_DELAY = 0.01
+
+    # How network evaluation requests are sent between self-play processes
+    # and the monitor. Options:
+    # 'pipe' = states and results are pickled and sent through the pipe.
+    # 'shared_memory' = states and results are written to preallocated shared
+    # memory for each process, only a small message is sent through the pipe.
+    EVAL_TRANSPORT = "pipe"
+
+    # How Othello boards are represented. Options:
+    # 'array' = a NumPy array of pieces, and a list of occupied squares.
+    # 'bitboard' = a bit mask of the pieces of each player. Legal moves, flips,
+    # and terminal tests are a few bit shifts (see controller/bitboard.py).
+    OTHELLO_ENGINE = "array"
+
+    # How Connect Four boards are represented. Options:
+    # 'array' = a NumPy array of discs, searched for four in a row with convolutions.
+    # 'bitboard' = a bit mask of the discs of each player. Wins are found when a disc
+    # is dropped, by checking only the lines through it (see controller/bitboard.py).
+    CONNECT_FOUR_ENGINE = "array"
+
     # |***********************************|
     # |      NEURAL NETWORK OPTIONS       |
     # |***********************************|
@@ -78,6 +111,31 @@ class Config():
     # Amount of games stored, at one time, in replay storage.
     MAX_GAME_STORAGE = 1000 # Is 1 million in AlphaZero, scale accordingly.
 
+    # Where the positions of the games in replay storage are kept. Options:
+    # 'memory' = encoded positions are kept in memory, and lost on exit.
+    # 'segments' = encoded positions are written to segment files on disk
+    # (resources/<game>/replays/segments/) and read through memory maps,
+    # so the buffer is not limited by memory, and is resumed with '-l'.
+    REPLAY_STORE = "memory"
+
+    # Amount of positions in each replay segment file.
+    REPLAY_SEGMENT_SIZE = 100000
+
+    # Games saved with '-s' are written to compressed chunk files by a background
+    # thread, up to REPLAY_WRITE_BATCH games at a time. A new chunk file is started
+    # when the current one exceeds REPLAY_CHUNK_SIZE bytes, and chunk files
+    # are synced to disk at most every REPLAY_FSYNC_INTERVAL seconds.
+    REPLAY_WRITE_BATCH = 32
+
+    REPLAY_CHUNK_SIZE = 16 * 1024 * 1024
+
+    REPLAY_FSYNC_INTERVAL = 30
+
+    # Amount of processes that unpickle and encode saved games when loading
+    # them with '-l'. Games are loaded in the background, so self-play
+    # and training start while the replay buffer is filling.
+    REPLAY_LOAD_WORKERS = 4
+
     # Amount to increase game buffer with, for each training epoch.
     MAX_GAME_GROWTH = 0
 
@@ -87,6 +145,10 @@ class Config():
     # How many macro networks to save and evaluate against.
     MAX_MACRO_STORAGE = 5
 
+    # Max number of network evaluations cached in the monitor process,
+    # keyed by network generation and position. 0 disables the cache.
+    EVAL_CACHE_SIZE = 100000
+
     # Batch size for neural network input.
     BATCH_SIZE = 512
 
@@ -139,9 +201,50 @@ class Config():
     # Number of simulations per action taken.
     MCTS_ITERATIONS = 200
 
+    # Max time, in seconds, to spend searching per move (0 = no limit).
+    # MCTS_ITERATIONS is still the max amount of simulations.
+    MCTS_TIME_BUDGET = 0
+
+    # Stop searching when the most visited action can no longer be
+    # overtaken by another in the remaining simulations.
+    MCTS_EARLY_STOP = False
+
+    # Playout cap randomization. Only a random fraction of moves (FULL_SEARCH_PROB)
+    # run the full MCTS_ITERATIONS and are used as training targets, the rest run
+    # FAST_SEARCH_ITERATIONS simulations, and are only played.
+    PLAYOUT_CAP_RANDOMIZATION = False
+
+    FULL_SEARCH_PROB = 0.25
+
+    FAST_SEARCH_ITERATIONS = 40
+
     # Number of simulations for MCTS basic.
     MCTS_BASIC_ITERATIONS = 200
 
+    # How the MCTS search tree is stored. Options:
+    # 'nodes' = one Node object (with a dict of children) per tree node.
+    # 'arrays' = preallocated NumPy arrays (ArrayTree), nodes are integer ids.
+    MCTS_TREE = "nodes"
+
+    # Reuse the subtree of the chosen action as the root
+    # of the next search, when both players are MCTS.
+    MCTS_REUSE_TREE = True
+
+    # Number of leaves selected in each tree per network evaluation during self-play.
+    # Above 1, virtual loss is used to spread the selections out, and
+    # MCTS_ITERATIONS / MCTS_LEAVES_PER_ROUND evaluation rounds are run per move.
+    MCTS_LEAVES_PER_ROUND = 1
+
+    # Loss counted on the path of a leaf while it waits for evaluation.
+    VIRTUAL_LOSS = 1
+
+    # Keep a table of evaluated positions (by Zobrist hash) in MCTS, so positions
+    # reached by different move orders are not evaluated by the network again.
+    MCTS_TRANSPOSITIONS = False
+
+    # Max number of positions stored in the transposition table.
+    TRANSPOSITION_TABLE_SIZE = 50000
+
     # Base exploration constant. This basically defines how much the visit
     # count for a node in MCTS should count towards it's UCB score. Lowering
     # this number means that when the visit count of a node increases, it's
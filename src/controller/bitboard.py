@@ -0,0 +1,112 @@
+"""
+bitboard: Helpers for games that store their boards as bit masks, one for the
+white and one for the black pieces. Square (y, x) of a board with 'size' columns
+is bit y * size + x, so boards of up to 64 squares fit in one uint64.
+"""
+import numpy as np
+from numba import jit
+from model.state import State
+
+# (dy, dx) of the eight neighbouring squares.
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+@jit(nopython=True)
+def shift(bits, amount, mask):
+    """
+    Move all bits 'amount' squares (negative amounts shift down), keeping
+    only those that land in 'mask', so pieces do not wrap around the board edges.
+    """
+    if amount > 0:
+        return (bits << np.uint64(amount)) & mask
+    return (bits >> np.uint64(-amount)) & mask
+
+@jit(nopython=True)
+def popcount(bits):
+    bits = bits - ((bits >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bits = (bits & np.uint64(0x3333333333333333)) + ((bits >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bits = (bits + (bits >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return int((bits * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@jit(nopython=True)
+def bit_indices(bits):
+    """
+    Returns the indices of the set bits, in increasing order.
+    """
+    indices = np.empty(popcount(bits), dtype=np.int64)
+    i = 0
+    index = 0
+    while bits:
+        if bits & np.uint64(1):
+            indices[i] = index
+            i += 1
+        bits >>= np.uint64(1)
+        index += 1
+    return indices
+
+def shift_tables(rows, cols, directions=DIRECTIONS):
+    """
+    Returns, for each (dy, dx) in 'directions', the amount to shift a mask by
+    to move its pieces one square in that direction, and the mask of squares that
+    pieces can be moved to in that direction without leaving the board.
+    """
+    amounts = np.array([dy * cols + dx for dy, dx in directions], dtype=np.int64)
+    masks = np.zeros(len(directions), dtype=np.uint64)
+    for d, (dy, dx) in enumerate(directions):
+        mask = 0
+        for y in range(rows):
+            for x in range(cols):
+                if 0 <= y - dy < rows and 0 <= x - dx < cols:
+                    mask |= 1 << (y * cols + x)
+        masks[d] = mask
+    return amounts, masks
+
+def square_bits(squares):
+    return np.uint64(1) << np.arange(squares, dtype=np.uint64)
+
+def input_planes(state, bits):
+    """
+    Returns the pieces of the player to move, and of the other player,
+    as two planes of the board, for the neural network.
+    'bits' is the bit of each square (see square_bits).
+    """
+    own, opp = state.own_pieces()
+    return np.array([(own & bits) != 0, (opp & bits) != 0], dtype="float32").reshape(2, state.rows, state.cols)
+
+class BitboardState(State):
+    """
+    State with the pieces of each player as a bit mask. 'board' (with 1 for white
+    and -1 for black pieces) and 'pieces' are built from the masks when used,
+    for the parts of the program that expect them (GUI, minimax, hashing).
+    """
+    def __init__(self, white, black, player, rows, cols):
+        self.white = white
+        self.black = black
+        self.player = player
+        self.rows = rows
+        self.cols = cols
+        self.repetitions = []
+        self.repetition_count = 0
+        self.no_progress_count = 0
+        self.hash_key = None
+        self.cached_board = None
+        # 1 if white has won, -1 if black has, 0 if neither, None if not known yet.
+        # Set by games that detect wins when moves are made.
+        self.winner = None
+
+    @property
+    def board(self):
+        if self.cached_board is None:
+            bits = square_bits(self.rows * self.cols)
+            board = ((self.white & bits) != 0).astype("b") - ((self.black & bits) != 0).astype("b")
+            self.cached_board = board.reshape(self.rows, self.cols)
+        return self.cached_board
+
+    @property
+    def pieces(self):
+        return [divmod(i, self.cols) for i in bit_indices(self.white | self.black).tolist()]
+
+    def own_pieces(self):
+        """
+        Returns the masks of the pieces of the player to move, and of the other player.
+        """
+        return (self.white, self.black) if self.player else (self.black, self.white)
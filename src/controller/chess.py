@@ -3,20 +3,10 @@ from numba import jit
 from controller.game import Game
 from model.state import State, Action
 
-@jit(nopython=True)
-def is_checked(opp_actions, y, x):
-    for (y1, x1, y2, x2) in opp_actions:
-        if (y2, x2) == (y, x):
-            return True
-    return False
-
-@jit(nopython=True)
-def pieces_checking(actions, king_y, king_x):
-    coords = []
-    for (y1, x1, y2, x2) in actions:
-        if (y2, x2) == (king_y, king_x):
-            coords.append((y1, x1))
-    return coords
+# Directions of sliding pieces. Rooks (and queens) move along the first four,
+# bishops (and queens) along the last four.
+RAY_DIRECTIONS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)])
+KNIGHT_JUMPS = np.array([(-1, -2), (-2, -1), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2)])
 
 @jit(nopython=True)
 def in_bounds(y, x, size):
@@ -200,8 +190,7 @@ def actions_pawn(pos, board, player, size):
     y, x = pos
     # Check for moves.
     if (((player < 0 and y == 1) or (player > 0 and y == size - 2)) and
-            not players_piece(board[y - (player * 2), x], player) and
-            not players_piece(board[y - player, x], player)):
+            board[y - (player * 2), x] == 0 and board[y - player, x] == 0):
         # Handle case where pawn can move two squares (at initial position).
         actions.append((y, x, y - (player * 2), x))
     y_dest = y - player
@@ -239,41 +228,6 @@ def actions_for_piece(pid, pos, board, player, size):
         return actions_pawn(pos, board, player, size)
     return None
 
-@jit(nopython=True)
-def simulate_move(pieces, board, source, dest):
-    copy_b = np.copy(board)
-    copy_b[dest] = copy_b[source]
-    copy_b[source] = 0
-    copy_p = [pos for pos in pieces]
-    from_id = -1
-    to_id = -1
-    for i, pos in enumerate(copy_p):
-        if pos == source:
-            from_id = i
-        elif pos == dest:
-            to_id = i
-    copy_p[from_id] = dest
-    if to_id != -1:
-        copy_p.pop(to_id)
-    return copy_b, copy_p
-
-@jit(nopython=True)
-def filter_actions(pieces, board, player, size, actions):
-    illegal_actions = []
-    # Remove actions that would lead to a check.
-    for i, (y1, x1, y2, x2) in enumerate(actions):
-        copy_b, copy_p = simulate_move(pieces, board, (y1, x1), (y2, x2))
-        king_y, king_x = find_piece(copy_p, copy_b, player * 2)
-        new_actions = calculate_actions(copy_p, copy_b, -player, size)
-        if len(pieces_checking(new_actions, king_y, king_x)) > 0:
-            illegal_actions.append(i)
-    removed = 0
-    for index in illegal_actions:
-        actions.pop(index-removed)
-        removed += 1
-
-    return actions
-
 @jit(nopython=True)
 def calculate_actions(pieces, board, player, size):
     action_coords = []
@@ -285,36 +239,161 @@ def calculate_actions(pieces, board, player, size):
                 action_coords.extend(actions)
     return action_coords
 
+@jit(nopython=True)
+def slides_along(pid, d):
+    """
+    Whether pieces of type 'pid' move along direction 'd' of RAY_DIRECTIONS.
+    """
+    return pid == 1 or (pid == 3 and d < 4) or (pid == 5 and d >= 4)
+
+@jit(nopython=True)
+def attack_map(pieces, board, player, size, ignore_y, ignore_x):
+    """
+    Returns a map of the squares attacked by the pieces of 'player'.
+    Square (ignore_y, ignore_x) is seen as empty, so the squares behind the king
+    of the other player, on the ray of a sliding piece, are also attacked.
+    """
+    attacked = np.zeros((size, size), dtype=np.bool_)
+    for (y, x) in pieces:
+        if not players_piece(board[y, x], player):
+            continue
+        pid = abs(board[y, x])
+        if pid == 6:
+            for x_dest in (x - 1, x + 1):
+                if in_bounds(y - player, x_dest, size):
+                    attacked[y - player, x_dest] = True
+        elif pid == 4:
+            for dy, dx in KNIGHT_JUMPS:
+                if in_bounds(y + dy, x + dx, size):
+                    attacked[y + dy, x + dx] = True
+        elif pid == 2:
+            for dy, dx in RAY_DIRECTIONS:
+                if in_bounds(y + dy, x + dx, size):
+                    attacked[y + dy, x + dx] = True
+        else:
+            for d in range(len(RAY_DIRECTIONS)):
+                if not slides_along(pid, d):
+                    continue
+                dy, dx = RAY_DIRECTIONS[d]
+                y_dest, x_dest = y + dy, x + dx
+                while in_bounds(y_dest, x_dest, size):
+                    attacked[y_dest, x_dest] = True
+                    if board[y_dest, x_dest] != 0 and (y_dest, x_dest) != (ignore_y, ignore_x):
+                        break
+                    y_dest += dy
+                    x_dest += dx
+    return attacked
+
+@jit(nopython=True)
+def pins_and_checks(board, player, size, king_y, king_x):
+    """
+    Looks along the rays, and knight jumps, from the king of 'player'. Returns
+    a map of the direction (index into RAY_DIRECTIONS) each piece of 'player' is
+    pinned to its king along (-1 if it is not pinned), a map of the squares
+    that stop a check (the checking piece, and the squares between it and
+    the king), and the amount of pieces checking the king.
+    """
+    pinned = np.full((size, size), -1, dtype=np.int64)
+    stops = np.zeros((size, size), dtype=np.bool_)
+    checks = 0
+    for d in range(len(RAY_DIRECTIONS)):
+        dy, dx = RAY_DIRECTIONS[d]
+        y, x = king_y + dy, king_x + dx
+        own_y, own_x = -1, -1
+        while in_bounds(y, x, size):
+            if board[y, x] != 0:
+                if players_piece(board[y, x], player):
+                    if own_y != -1:
+                        break # Two pieces in between, neither is pinned.
+                    own_y, own_x = y, x
+                else:
+                    if slides_along(abs(board[y, x]), d):
+                        if own_y != -1:
+                            pinned[own_y, own_x] = d
+                        else:
+                            checks += 1
+                            y_stop, x_stop = king_y + dy, king_x + dx
+                            while (y_stop, x_stop) != (y, x):
+                                stops[y_stop, x_stop] = True
+                                y_stop += dy
+                                x_stop += dx
+                            stops[y, x] = True
+                    break
+            y += dy
+            x += dx
+    for dy, dx in KNIGHT_JUMPS:
+        y, x = king_y + dy, king_x + dx
+        if in_bounds(y, x, size) and board[y, x] == -player * 4:
+            checks += 1
+            stops[y, x] = True
+    # Pawns of the other player attack the king from the row in front of it.
+    for x in (king_x - 1, king_x + 1):
+        if in_bounds(king_y - player, x, size) and board[king_y - player, x] == -player * 6:
+            checks += 1
+            stops[king_y - player, x] = True
+    return pinned, stops, checks
+
 @jit(nopython=True)
 def actions_fast(pieces, board, player, size):
-    actions = calculate_actions(pieces, board, player, size)
-    filtered = filter_actions(pieces, board, player, size, actions)
-    return filtered
+    """
+    Returns the legal actions of 'player', in one pass over its pieces.
+    The king can not move to squares attacked by the other player (see attack_map),
+    or castle out of, or through, check. When in check, other pieces can only move
+    to capture the checking piece, or block it, and pinned pieces can only
+    move along the ray they are pinned along (see pins_and_checks).
+    """
+    king_y, king_x = find_piece(pieces, board, player * 2)
+    if king_y == -1:
+        return calculate_actions(pieces, board, player, size)
+    danger = attack_map(pieces, board, -player, size, king_y, king_x)
+    pinned, stops, checks = pins_and_checks(board, player, size, king_y, king_x)
+    action_coords = []
+    for (y, x) in pieces:
+        if not players_piece(board[y, x], player):
+            continue
+        pid_abs = abs(board[y, x])
+        if pid_abs == 2:
+            for (y1, x1, y2, x2) in actions_king((y, x), board, player, size):
+                if danger[y2, x2]:
+                    continue
+                if abs(x2 - x1) == 2 and (checks or danger[y2, (x1 + x2) // 2]):
+                    continue # Castling.
+                action_coords.append((y1, x1, y2, x2))
+        elif checks < 2:
+            actions = actions_for_piece(pid_abs, (y, x), board, player, size)
+            if actions is None:
+                continue
+            for (y1, x1, y2, x2) in actions:
+                if checks and not stops[y2, x2]:
+                    continue
+                d = pinned[y1, x1]
+                if d != -1:
+                    dy, dx = RAY_DIRECTIONS[d]
+                    if (y2 - king_y) * dx != (x2 - king_x) * dy:
+                        continue
+                action_coords.append((y1, x1, y2, x2))
+    return action_coords
 
 @jit(nopython=True)
-def terminal_test_fast(pieces, board, player, size):
-    return utility_with_remy(pieces, board, player, size) != 0
+def in_check(pieces, board, player, size):
+    king_y, king_x = find_piece(pieces, board, player * 2)
+    if king_y == -1:
+        return False
+    return pins_and_checks(board, player, size, king_y, king_x)[2] > 0
 
 @jit(nopython=True)
-def utility_with_remy(pieces, board, player, size):
-    # Check the same, but vice versa.
-    actions_player = actions_fast(pieces, board, player, size)
-    opp_actions = actions_fast(pieces, board, -player, size)
-    king_y, king_x = find_piece(pieces, board, 2*player)
-    checking = pieces_checking(opp_actions, king_y, king_x)
-    if len(actions_player) == 0:
-        return -1 if len(checking) > 0 else 42 # I am so sorry.
+def utility_with_remy(num_actions, pieces, board, player, size):
+    """
+    'num_actions' is the amount of legal actions of 'player', who is to move.
+    """
+    if num_actions == 0:
+        return -1 if in_check(pieces, board, player, size) else 42 # I am so sorry.
 
     # See whether given player is checking the opponent,
     # and whether the opponent can prevent checkmate.
-    king_y, king_x = find_piece(pieces, board, -2*player)
-    checking = pieces_checking(actions_player, king_y, king_x)
-    return 1 if len(checking) > 0 and len(opp_actions) == 0 else 0
-
-@jit(nopython=True)
-def utility_fast(pieces, board, player, size):
-    val = utility_with_remy(pieces, board, player, size)
-    return 0 if val == 42 else val
+    if in_check(pieces, board, -player, size) and len(actions_fast(pieces, board, -player, size)) == 0:
+        return 1
+    return 0
 
 class Chess(Game):
     PIDS = {"Q": 1, "KI": 2, "R": 3, "KN": 4, "B": 5, "P": 6}
@@ -353,11 +432,34 @@ class Chess(Game):
 
         return State(board, True, pieces)
 
+    def state_from_fen(self, fen):
+        """
+        Returns the state of the position in Forsyth-Edwards Notation, such as
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'. Only the pieces
+        and the player to move are used. Castling is allowed whenever the king
+        and rook are on their starting squares, and en passant is not supported.
+        """
+        letters = {"q": self.PIDS["Q"], "k": self.PIDS["KI"], "r": self.PIDS["R"],
+                   "n": self.PIDS["KN"], "b": self.PIDS["B"], "p": self.PIDS["P"]}
+        placement, to_move = fen.split()[:2]
+        board = np.zeros((self.size, self.size), dtype="b")
+        pieces = []
+        for y, row in enumerate(placement.split("/")):
+            x = 0
+            for letter in row:
+                if letter.isdigit():
+                    x += int(letter)
+                    continue
+                board[y, x] = letters[letter.lower()] if letter.isupper() else -letters[letter]
+                pieces.append((y, x))
+                x += 1
+        return State(board, to_move == "w", pieces)
+
     def player(self, state):
         super.__doc__
         return state.player
 
-    def actions(self, state):
+    def find_actions(self, state):
         super.__doc__
         player_num = 1 if self.player(state) else -1
         actions = actions_fast(state.pieces, state.board, player_num, self.size)
@@ -409,6 +511,9 @@ class Chess(Game):
         new_state.no_progress_count = state.no_progress_count
         y_s, x_s = action.source
         y_d, x_d = action.dest
+        if copy_board[y_d, x_d] != 0:
+            # Remove the captured piece, so its square is not in 'pieces' twice.
+            copy_pieces.remove((y_d, x_d))
         copy_board[y_d, x_d] = copy_board[y_s, x_s]
         copy_board[y_s, x_s] = 0
         new_state.change_piece(y_s, x_s, y_d, x_d)
@@ -439,17 +544,27 @@ class Chess(Game):
             new_state.repetition_count = 0
         return new_state
 
-    def terminal_test(self, state):
+    def find_terminal(self, state):
         super.__doc__
         if state.repetition_count >= 13 or state.no_progress_count >= 30:
             return True
-        player = 1 if self.player(state) else -1
-        return terminal_test_fast(state.pieces, state.board, player, self.size)
+        return self.utility_to_move(state) != 0
 
-    def utility(self, state, player):
+    def find_utility(self, state, player):
         super.__doc__
-        player_num = 1 if player else -1
-        return utility_fast(state.pieces, state.board, player_num, self.size)
+        val = self.utility_to_move(state)
+        val = 0 if val == 42 else val
+        return val if player == state.player else -val
+
+    def utility_to_move(self, state):
+        """
+        Returns utility_with_remy for the player to move,
+        using the actions cached on the state.
+        """
+        actions = self.actions(state)
+        num_actions = 0 if actions == [None] else len(actions)
+        player = 1 if self.player(state) else -1
+        return utility_with_remy(num_actions, state.pieces, state.board, player, self.size)
 
     def structure_data(self, state):
         super.__doc__
@@ -3,15 +3,67 @@
 connect_four: We all know it.
 -----------------------------
 """
-from controller.game import Game
+from controller.game import Game, ZOBRIST_PIECE_OFFSET
+from controller.bitboard import BitboardState, shift, bit_indices, shift_tables, square_bits, input_planes
 from model.state import State, Action
 from scipy.signal import convolve2d
+from numba import jit
 import numpy as np
+from config import Config
+
+@jit(nopython=True)
+def bitboard_drops(white, black, up_amount, up_mask, bottom_row, full):
+    """
+    Returns the mask of squares a disc can be dropped on: empty
+    squares on the bottom row, or directly above another disc.
+    """
+    occupied = white | black
+    return ~occupied & full & (shift(occupied, up_amount, up_mask) | bottom_row)
+
+@jit(nopython=True)
+def connects_four(own, move, amounts, masks):
+    """
+    Whether the disc on 'move' is part of four (or more) in a row of 'own' discs.
+    Only the four lines through 'move' are checked. Directions 'd'
+    and '7 - d' of bitboard.DIRECTIONS are opposite.
+    """
+    for d in range(4):
+        count = 1
+        for direction in (d, 7 - d):
+            square = shift(move, amounts[direction], masks[direction])
+            while square & own:
+                count += 1
+                square = shift(square, amounts[direction], masks[direction])
+        if count >= 4:
+            return True
+    return False
+
+@jit(nopython=True)
+def has_four(own, amounts, masks):
+    """
+    Whether there is four in a row anywhere in 'own', found by AND-ing
+    the mask with itself shifted one, two, and three squares in each direction.
+    """
+    for d in range(4):
+        line = own
+        for _ in range(3):
+            line = shift(line, amounts[d], masks[d]) & own
+        if line:
+            return True
+    return False
 
 class Connect_Four(Game):
     __observers = []
 
     def __init__(self, size, rand_seed=None):
+        # With Config.CONNECT_FOUR_ENGINE = 'bitboard', states are BitboardStates,
+        # and wins are detected when discs are dropped, by the functions above.
+        self.bitboard = Config.CONNECT_FOUR_ENGINE == "bitboard"
+        if self.bitboard:
+            self.shift_amounts, self.shift_masks = shift_tables(size, size)
+            self.full_mask = np.uint64((1 << (size * size)) - 1)
+            self.square_bits = square_bits(size * size)
+            self.bottom_row = np.uint64(((1 << size) - 1) << (size * (size - 1)))
         Game.__init__(self, size)
         self.terminal_kernels = [
             np.array([[1, 1, 1, 1]]),
@@ -23,14 +75,24 @@ class Connect_Four(Game):
 
     def start_state(self):
         super.__doc__
+        if self.bitboard:
+            state = BitboardState(np.uint64(0), np.uint64(0), True, self.size, self.size)
+            state.winner = 0
+            return state
         return State(np.zeros((self.size, self.size), dtype='b'), True)
 
     def player(self, state):
         super.__doc__
         return state.player
 
-    def actions(self, state):
+    def find_actions(self, state):
         super.__doc__
+        if self.bitboard:
+            # Shifting by (-1, 0) moves discs one row up.
+            drops = bitboard_drops(state.white, state.black, self.shift_amounts[1], self.shift_masks[1],
+                                   self.bottom_row, self.full_mask)
+            # Compiled functions return masks as Python ints, they are passed on as uint64.
+            return [Action(None, divmod(i, self.size)) for i in bit_indices(np.uint64(drops)).tolist()]
         board = state.board
         action_list = []
         for x in range(0, self.size):
@@ -43,12 +105,49 @@ class Connect_Four(Game):
     def result(self, state, action):
         super.__doc__
         y, x = action.dest
-        copy_arr = np.copy(state.board)
-        copy_arr[y][x] = 1 if state.player else -1
-        return State(copy_arr, not state.player)
+        piece = 1 if state.player else -1
+        if self.bitboard:
+            new_state = self.bitboard_result(state, y, x)
+        else:
+            copy_arr = np.copy(state.board)
+            copy_arr[y][x] = piece
+            new_state = State(copy_arr, not state.player)
+        if state.hash_key is not None:
+            # Update hash incrementally, with the new piece and the change of turn.
+            table, player_key = self.zobrist_keys()
+            new_state.hash_key = state.hash_key ^ int(table[y * self.size + x, piece + ZOBRIST_PIECE_OFFSET] ^ player_key)
+        return new_state
+
+    def bitboard_result(self, state, y, x):
+        own, opp = state.own_pieces()
+        move = self.square_bits[y * self.size + x]
+        own = own | move
+        white, black = (own, opp) if state.player else (opp, own)
+        new_state = BitboardState(white, black, not state.player, self.size, self.size)
+        if connects_four(own, move, self.shift_amounts, self.shift_masks):
+            new_state.winner = 1 if state.player else -1
+        elif state.winner == 0:
+            new_state.winner = 0
+        return new_state
+
+    def bitboard_winner(self, state):
+        """
+        Returns the winner of the given state, looking for four in a row
+        on the whole board, if it was not found when the last disc was dropped.
+        """
+        if state.winner is None:
+            if has_four(state.white, self.shift_amounts, self.shift_masks):
+                state.winner = 1
+            elif has_four(state.black, self.shift_amounts, self.shift_masks):
+                state.winner = -1
+            else:
+                state.winner = 0
+        return state.winner
 
-    def terminal_test(self, state):
+    def find_terminal(self, state):
         super.__doc__
+        if self.bitboard:
+            return bool(self.bitboard_winner(state)) or (state.white | state.black) == self.full_mask
         if (state.board == 0).sum() == 0:
             return True
         for kernel in self.terminal_kernels:
@@ -57,8 +156,11 @@ class Connect_Four(Game):
                 return True
         return False
 
-    def utility(self, state, player):
+    def find_utility(self, state, player):
         super.__doc__
+        if self.bitboard:
+            winner = self.bitboard_winner(state)
+            return winner if player else -winner
         for kernel in self.terminal_kernels:
             conv = convolve2d(state.board, kernel, mode="valid")
             if (conv == 4).sum() > 0:
@@ -69,6 +171,8 @@ class Connect_Four(Game):
 
     def structure_data(self, state):
         super.__doc__
+        if self.bitboard:
+            return input_planes(state, self.square_bits)
         pos_pieces = np.where(state.board == 1, state.board, np.zeros((self.size, self.size), dtype='b'))
         neg_pieces = -np.where(state.board == -1, state.board, np.zeros((self.size, self.size), dtype='b'))
 
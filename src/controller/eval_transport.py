@@ -0,0 +1,138 @@
+"""
+-----------------------------------------------------------------------
+eval_transport: Shared memory transport for network evaluation requests
+between self-play processes and the monitor process.
+-----------------------------------------------------------------------
+"""
+import os
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+class EvaluationSlabs:
+    """
+    Preallocated shared memory for one self-play process. Holds an input slab,
+    that the process writes structured states into, and output slabs,
+    that the monitor writes policies and values into.
+    Created by the main process, and attached to by name in the self-play process.
+    """
+    def __init__(self, capacity, input_shape, policy_shape, names=None):
+        self.capacity = capacity
+        self.input_shape = input_shape
+        self.policy_shape = policy_shape
+        shapes = [(capacity,) + input_shape, (capacity,) + policy_shape, (capacity,)]
+        create = names is None
+        self.memory = []
+        for i, shape in enumerate(shapes):
+            size = int(np.prod(shape)) * 4
+            if create:
+                memory = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                memory = shared_memory.SharedMemory(name=names[i])
+                if os.name == "posix":
+                    # The main process owns the memory, so the self-play process should
+                    # not unlink it when it exits. Attaching registers it with the resource
+                    # tracker (on POSIX only), under its name with a leading slash.
+                    resource_tracker.unregister("/" + memory.name, "shared_memory")
+            self.memory.append(memory)
+        self.inputs, self.policies, self.values = [
+            np.ndarray(shape, dtype="float32", buffer=memory.buf)
+            for shape, memory in zip(shapes, self.memory)
+        ]
+
+    @staticmethod
+    def for_game(game, capacity):
+        input_shape = game.structure_data(game.start_state()).shape
+        policy_shape = game.map_visits({}).shape
+        return EvaluationSlabs(capacity, input_shape, policy_shape)
+
+    def names(self):
+        return [memory.name for memory in self.memory]
+
+    def __getstate__(self):
+        # Only the names are sent to the self-play process, which attaches to them.
+        return (self.capacity, self.input_shape, self.policy_shape, self.names())
+
+    def __setstate__(self, data):
+        self.__init__(*data)
+
+    def unlink(self):
+        """
+        Free the shared memory, once all processes are done with it.
+        Called by the main process when exiting.
+        """
+        for memory in self.memory:
+            memory.unlink()
+
+class SharedRequest:
+    """
+    Sent over the pipe instead of the data to evaluate. The data is in
+    the first rows of the input slab, one row per network id.
+    """
+    def __init__(self, network_ids):
+        self.network_ids = network_ids
+
+class SharedResult:
+    """
+    Sent over the pipe instead of the evaluation result. The policies and
+    values are in the first 'count' rows of the output slabs.
+    """
+    def __init__(self, count):
+        self.count = count
+
+class SharedConnection:
+    """
+    Wraps one end of the pipe between a self-play process and the monitor,
+    moving evaluation requests and results through EvaluationSlabs instead of
+    pickling them. Other messages, and requests too large for the slabs,
+    go through the pipe as usual. Can be used with 'multiprocessing.connection.wait'.
+    """
+    def __init__(self, connection, slabs):
+        self.connection = connection
+        self.slabs = slabs
+        self.pending = False # Monitor side: an evaluation result is expected next.
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def poll(self, timeout=0):
+        return self.connection.poll(timeout)
+
+    def close(self):
+        self.connection.close()
+
+    def send(self, data):
+        if self.pending:
+            # Monitor side, sending the result of an evaluation request.
+            self.pending = False
+            policies, values = data
+            count = len(values)
+            if count > self.slabs.capacity:
+                self.connection.send(data)
+                return
+            self.slabs.policies[:count] = policies
+            self.slabs.values[:count] = values
+            self.connection.send(SharedResult(count))
+            return
+        if isinstance(data, tuple) and data[0] == "evaluate" and len(data[1]) <= self.slabs.capacity:
+            # Self-play side, write states into the input slab.
+            network_ids = []
+            for i, (network_id, eval_data) in enumerate(data[1]):
+                self.slabs.inputs[i] = eval_data
+                network_ids.append(network_id)
+            self.connection.send(("evaluate", SharedRequest(network_ids)))
+            return
+        self.connection.send(data)
+
+    def recv(self):
+        data = self.connection.recv()
+        if isinstance(data, SharedResult):
+            # Self-play side. The arrays are views of the output slabs,
+            # and are only valid until the next request is sent.
+            return self.slabs.policies[:data.count], self.slabs.values[:data.count]
+        if isinstance(data, tuple) and data[0] == "evaluate":
+            # Monitor side.
+            self.pending = True
+            if isinstance(data[1], SharedRequest):
+                inputs = self.slabs.inputs
+                return "evaluate", [(n_id, inputs[i]) for i, n_id in enumerate(data[1].network_ids)]
+        return data
@@ -4,16 +4,80 @@ game: Super class for game. Implements actions, evaluations, terminal tests, etc
 ---------------------------------------------------------------------------------
 """
 from abc import ABC, abstractmethod
+import numpy as np
+from numba import jit
 from config import Config
 
+# Piece values on boards range from -6 to 6 (Chess), and are offset by this,
+# to index the Zobrist table.
+ZOBRIST_PIECE_OFFSET = 6
+
+@jit(nopython=True)
+def zobrist_hash(board, player, table, player_key):
+    """
+    Zobrist hash of a board: XOR of the random keys for
+    every (square, piece) pair on the board, and a key for the player to move.
+    """
+    flat = board.ravel()
+    hash_key = player_key if player else np.uint64(0)
+    for i in range(flat.shape[0]):
+        if flat[i] != 0:
+            hash_key ^= table[i, flat[i] + ZOBRIST_PIECE_OFFSET]
+    return hash_key
+
+@jit(nopython=True)
+def zobrist_update(old_board, new_board, table, player_key):
+    """
+    XOR of the keys of the (square, piece) pairs that differ between two boards, and
+    the key for the player to move. XORed with the hash of 'old_board', this gives the
+    hash of 'new_board', if the player to move changed between them.
+    """
+    old, new = old_board.ravel(), new_board.ravel()
+    delta = player_key
+    for i in range(old.shape[0]):
+        if old[i] != new[i]:
+            if old[i] != 0:
+                delta ^= table[i, old[i] + ZOBRIST_PIECE_OFFSET]
+            if new[i] != 0:
+                delta ^= table[i, new[i] + ZOBRIST_PIECE_OFFSET]
+    return delta
+
+def value_target(val_type, z_val, q_val, training_step=None):
+    """
+    Returns the value to train the network on, for a state where the game
+    ended with 'z_val' and MCTS predicted 'q_val' (both from the view of the player
+    to move), according to 'val_type' (see Config.TARGET_VAL).
+    Works on single values and on arrays of values.
+    """
+    if val_type == "q":
+        # Use 'q' value instead of 'z'. This is MCTS's predicted value for the state.
+        return q_val
+    if val_type == "avg":
+        # Use average of 'q' and 'z' value.
+        return (z_val + q_val) / 2
+    if val_type == "mixed" and training_step is not None:
+        # Use linear fall-off of 'z' and 'q' value.
+        # This means that 'q' is weighed higher, the larger the current epoch,
+        # and 'z' is weighed lower.
+        if training_step < Config.Q_LINEAR_FALLOFF:
+            ratio = training_step / Config.Q_LINEAR_FALLOFF
+            return z_val * (1 - ratio) + q_val * ratio
+        return q_val
+    # Use 'z' value. Traditional terminal value of game
+    # (1 = white wins, -1 = black wins, 0 = draw).
+    return z_val
+
 class Game(ABC):
     __observers = []
     action_type = "single"
+    zobrist_tables = {} # Shared between all games of the same type and size.
+    training_targets = None # Games saved before moves were flagged use all moves.
 
     def __init__(self, size, history=None, q_value_history=None, val_type=None):
         self.size = size
         self.history = history or [self.start_state()]
         self.visit_counts = []
+        self.training_targets = [] # Whether each move is used as a training target.
         self.num_actions = 0 # Overriden in subclasses.
         self.__observers = []
         self.q_value_history = q_value_history or []
@@ -34,10 +98,33 @@ class Game(ABC):
         """
         pass
 
-    @abstractmethod
     def actions(self, state):
         """
         Return list of legal moves for the given state.
+        Found by find_actions the first time they are requested.
+        """
+        if state.legal_actions is None:
+            state.legal_actions = self.find_actions(state)
+        return state.legal_actions
+
+    def packed_actions(self, state):
+        """
+        Returns the legal moves for the given state in the form map_actions takes,
+        for the search. Games with cheaper forms than lists of Actions override this.
+        """
+        return self.actions(state)
+
+    def action(self, move):
+        """
+        Returns the Action for a key of the mapping returned by map_actions.
+        Games whose mappings are keyed by packed moves override this.
+        """
+        return move
+
+    @abstractmethod
+    def find_actions(self, state):
+        """
+        Return list of legal moves for the given state, or [None] if the player to move has to pass.
         """
         pass
 
@@ -48,15 +135,34 @@ class Game(ABC):
         """
         pass
 
-    @abstractmethod
     def terminal_test(self, state):
         """
         Return True if the given state is a terminal state, meaning that the game is over, False otherwise.
+        Found by find_terminal the first time it is requested.
         """
-        pass
+        if state.terminal is None:
+            state.terminal = self.find_terminal(state)
+        return state.terminal
 
     @abstractmethod
+    def find_terminal(self, state):
+        """
+        Return True if the given state is a terminal state, False otherwise.
+        """
+        pass
+
     def utility(self, state, player):
+        """
+        If the given player has lost, return -1, for draw return 0, for win return 1.
+        Found by find_utility the first time it is requested. As games are
+        zero-sum, it is stored for white, and negated for black.
+        """
+        if state.white_utility is None:
+            state.white_utility = self.find_utility(state, True)
+        return state.white_utility if player else -state.white_utility
+
+    @abstractmethod
+    def find_utility(self, state, player):
         """
         If the given player has lost, return -1, for draw return 0, for win return 1
         """
@@ -86,6 +192,49 @@ class Game(ABC):
         """
         pass
 
+    def zobrist_keys(self):
+        """
+        Returns the table of random keys for (square, piece) pairs,
+        and the key for white to move, used for hashing states.
+        """
+        key = (type(self).__name__, self.size)
+        keys = Game.zobrist_tables.get(key)
+        if keys is None:
+            rand = np.random.RandomState(self.size)
+            table = rand.randint(1, 2**63, (self.size * self.size, 2 * ZOBRIST_PIECE_OFFSET + 1),
+                                 dtype="int64").astype("uint64")
+            keys = (table, np.uint64(rand.randint(1, 2**63, dtype="int64")))
+            Game.zobrist_tables[key] = keys
+        return keys
+
+    def state_hash(self, state):
+        """
+        Returns the Zobrist hash of the given state, calculating it
+        the first time it is requested. Games may set 'hash_key' on states
+        incrementally in 'result' instead.
+        """
+        if state.hash_key is None:
+            table, player_key = self.zobrist_keys()
+            state.hash_key = int(zobrist_hash(state.board, state.player, table, player_key))
+        return state.hash_key
+
+    def update_hash(self, state, new_state):
+        """
+        Sets the hash of 'new_state', reached by one move from 'state', from
+        the hash of 'state', if it is known, by only hashing the squares that changed.
+        """
+        if state.hash_key is not None:
+            table, player_key = self.zobrist_keys()
+            new_state.hash_key = state.hash_key ^ int(zobrist_update(state.board, new_state.board, table, player_key))
+
+    def transposition_key(self, state):
+        """
+        Returns the key of the given state in MCTS transposition tables: its hash,
+        and the counters of repeated and no progress moves, which decide whether
+        some states are terminal (see Chess.find_terminal).
+        """
+        return self.state_hash(state), state.repetition_count, state.no_progress_count
+
     def clone(self):
         """
         Clones the game and returns it
@@ -93,6 +242,8 @@ class Game(ABC):
         game_clone = self.__class__(self.size)
         game_clone.history = [s for s in self.history]
         game_clone.visit_counts = [v for v in self.visit_counts]
+        if self.training_targets is not None:
+            game_clone.training_targets = [t for t in self.training_targets]
         game_clone.q_value_history = [q for q in self.q_value_history]
         game_clone.terminal_value = self.terminal_value
         game_clone.val_type = self.val_type
@@ -104,45 +255,51 @@ class Game(ABC):
         probability distribution for actions at that state.
         The value depends on the arguments given.
         """
-        player = self.history[state_index].player
-        term_val = self.terminal_value
-        z_val = term_val if player or term_val == 0 else -term_val
-        if self.val_type == "z":
-            # Use 'z' value. Traditional terminal value of game
-            # (1 = white wins, -1 = black wins, 0 = draw).
-            target_val = z_val
-        if self.val_type == "q":
-            # Use 'q' value instead of 'z'. This is MCTS's predicted value for the state.
-            target_val = self.q_value_history[state_index]
-        elif self.val_type == "avg":
-            # Use average of 'q' and 'z' value.
-            target_val = (z_val + self.q_value_history[state_index]) / 2
-        elif self.val_type == "mixed" and training_step is not None:
-            # Use linear fall-off of 'z' and 'q' value.
-            # This means that 'q' is weighed higher, the larger the current epoch,
-            # and 'z' is weighed lower.
-            if training_step < Config.Q_LINEAR_FALLOFF:
-                ratio = training_step / Config.Q_LINEAR_FALLOFF
-                z_val *= (1 - ratio)
-                q_val = self.q_value_history[state_index] * ratio
-                target_val = z_val + q_val
-            else:
-                target_val = self.q_value_history[state_index]
+        q_val = self.q_value_history[state_index] if self.val_type != "z" else None
+        target_val = value_target(self.val_type, self.z_value(state_index), q_val, training_step)
         return (target_val, self.visit_counts[state_index])
 
-    def store_search_statistics(self, node):
+    def z_value(self, state_index):
+        """
+        Returns the outcome of the game, from the view of
+        the player to move in the state at the given index.
+        """
+        term_val = self.terminal_value
+        return term_val if self.history[state_index].player or term_val == 0 else -term_val
+
+    def store_search_statistics(self, node, training_target=True):
         """
         Stores the visit counts for the children nodes of the given node
         """
-        if node.children == {}:
+        self.store_visit_counts({a: child.visits for a, child in node.children.items()},
+                                node.q_value, training_target)
+
+    def store_visit_counts(self, visits, q_value, training_target=True):
+        """
+        Stores the given mapping of actions to visit counts,
+        normalized to probabilities, as well as the q-value of the node
+        the visits were counted from.
+        'training_target' marks whether the move should be trained on.
+        """
+        self.training_targets.append(training_target)
+        if visits == {}:
             self.visit_counts.append({None: 1})
             self.q_value_history.append(0)
         else:
-            sum_visits = sum(child.visits for child in node.children.values())
+            sum_visits = sum(visits.values())
             self.visit_counts.append({
-                a: node.children[a].visits / sum_visits for a in node.children
+                a: visits[a] / sum_visits for a in visits
             })
-            self.q_value_history.append(-node.q_value)
+            self.q_value_history.append(-q_value)
+
+    def training_indices(self):
+        """
+        Returns the indices of the states in the history
+        whose moves should be used as training targets.
+        """
+        if self.training_targets is None:
+            return list(range(len(self.history)))
+        return [i for i, target in enumerate(self.training_targets) if target]
 
     def store_value_statistics(self, node):
         """
@@ -159,4 +316,5 @@ class Game(ABC):
         """
         self.history = [self.start_state()]
         self.visit_counts = []
+        self.training_targets = []
         self.q_value_history = []
@@ -8,83 +8,6 @@ from numba import jit
 from controller.game import Game
 from model.state import State, Action
 
-#i needed this quick, but there might be a library method for this, just could not find it
-#this method helps construct a stop value for the range used in jump calculations, it makes any negative integer into -1
-#which should let the range run to 0 inclusive, which is what we want, because the stop value is exclusive
-@jit(nopython=True)
-def convert_to_positive_int(x):
-    if x < 0:
-        return -1
-    else:
-        return x
-
-# checks the squares north or south of a players piece, and acts accordingly
-@jit(nopython=True)    
-def check_North_Or_South_From_Player_Piece(size, i, j, direction, player, board): #perhaps just pass along the board????
-    actionsList = []
-    if board[i + direction][j] == 0: #check for NORTH/SOUTH square being empty
-        if (j - 1) >= 0 and (j + 1) < size: #check for whether insta-capture is possible or if we are too close to edge of the board
-            actionsList.extend(check_for_capture_and_suicide_west_or_east_of_given_piece(size, i, j, (i+direction), j, player, board))
-        else:  #if there is no chance for insta capture, create action to empty square
-            actionsList.append((i, j, i+direction, j))
-    else: # if the north/south square contains a piece (either 1, 2, -1, -2), check for jumps
-        for x in range(i + (2*direction), (convert_to_positive_int(size * direction)), 2*direction): #Jump-loop
-            if x >= 0 and x < size: #check that x squares north/south is within the bounds of the board 
-                if board[x + (-1*direction)][j] != 0: #check if there is a piece on the odd number square north/south... #this is a double check for the first jump, might want to optimize it...
-                    if board[x][j] == 0: #checks for the even number square north/south being empty, if the square before was occupied
-                        #check for capture/suicide in all directions of the jump destination
-                        jumpActions = check_for_capture_and_suicide_all_directions_of_given_piece(size, i, j, x, j, player, board)
-                        if len(jumpActions) != 0:
-                            actionsList.extend(jumpActions)
-                        else:
-                            break #this jump results in capture, which breaks the jump chain
-                    else:
-                        break #jump chain is broken
-                else:
-                    break #jump chain is broken
-            else:
-                break #break if outside of board bounds
-    return actionsList
-
-# checks the squares west or east of a players piece, and acts accordingly
-@jit(nopython=True)
-def check_West_Or_East_From_Player_Piece(size, i, j, direction, player, board):
-    actionsList = []
-    if board[i][j + direction] == 0: #check for WEST/EAST square being empty
-        if (i - 1) >= 0 and (i + 1) < size: #check for whether insta-capture is possible or if we are too close to edge of the board
-            actionsList.extend(check_for_capture_and_suicide_north_or_south_of_given_piece(size, i, j, i, (j+direction), player, board))
-        else:  #if there is no chance for insta capture, create action to empty square
-            actionsList.append((i, j, i, j+direction))
-    else: # if the WEST/EAST square contains a piece (either 1, 2, -1, -2), check for jumps
-        for x in range(j + (2*direction), (convert_to_positive_int((size*direction))), (2*direction)): #Jump-loop
-            if x >= 0 and x < size: #check that x squares WEST/EAST is within the bounds of the board
-                if board[i][(x + (-1*direction))] != 0: #check if there is a piece on the odd number square WEST/EAST... #this is a double check for the first jump, might want to optimize it...
-                    if board[i][x] == 0: #checks for the even number square WEST/EAST being empty, if the square before was occupied
-                        #check for capture/suicide in all directions of the jump destination
-                        jumpActions = check_for_capture_and_suicide_all_directions_of_given_piece(size, i, j, i, x, player, board)
-                        if len(jumpActions) != 0:
-                            actionsList.extend(jumpActions)
-                        else:
-                            break #this jump results in capture, which breaks the jump chain
-                    else:
-                        break #jump chain is broken
-                else:
-                    break #jump chain is broken
-            else:
-                break #break if outside of board bounds
-    return actionsList
-
-@jit(nopython=True)
-def check_for_capture_and_suicide_all_directions_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
-    action_list = []
-    boolWE = check_for_capture_and_suicide_west_or_east_of_given_piece_bool(size, iOrigin, jOrigin, iDest, jDest, player, board) #check for insta-capture WEST/EAST
-    boolNS = check_for_capture_and_suicide_north_or_south_of_given_piece_bool(size, iOrigin, jOrigin, iDest, jDest, player, board) #check for insta-capture NORTH/SOUTH
-
-    if boolWE and boolNS: #checks whether any insta capture was found, false means that an insta-capture exists on this square
-        action_list.append((iOrigin, jOrigin, iDest, jDest)) #if the move is legal, create action
-
-    return action_list #return the actions_list which is empty if no legal move was found.
-
 @jit(nopython=True)
 #returns false if there is an insta-capture and no suicide option, true if there is no insta-capture WE
 def check_for_capture_and_suicide_west_or_east_of_given_piece_bool(size, iOrigin, jOrigin, iDest, jDest, player, board):
@@ -114,36 +37,48 @@ def check_for_capture_and_suicide_north_or_south_of_given_piece_bool(size, iOrig
     return True
 
 @jit(nopython=True)
-def check_for_capture_and_suicide_west_or_east_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
-    enemy_player = -1*player
-    action_list = []
-    if (jDest - 1) >= 0 and (jDest + 1) < size: #check if there is room for a possible insta-capture WEST/EAST
-        if board[iDest][jDest + 1] == enemy_player and board[iDest][jDest - 1] == enemy_player: #check for insta capture
-            if (jDest - 2) >= 0 and board[iDest][jDest - 2] == player and (jDest - 2) != jOrigin: #check for possible suicide action to the west
-                    action_list.append((iOrigin, jOrigin, iDest, jDest))
-            elif (jDest + 2) < size and board[iDest][jDest + 2] == player and (jDest + 2) != jOrigin: #check for possible suicide action to the east
-                    action_list.append((iOrigin, jOrigin, iDest, jDest))
-        else: #if there is no insta capture on this square, create action
-            action_list.append((iOrigin, jOrigin, iDest, jDest))
-    else: #if there is no room for an insta capture on this square, create action
-            action_list.append((iOrigin, jOrigin, iDest, jDest))
-    return action_list
-
-@jit(nopython=True)
-def check_for_capture_and_suicide_north_or_south_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
-    enemy_player = -1*player
-    action_list = []
-    if (iDest - 1) >= 0 and (iDest + 1) < size: #check if there is room for a possible insta-capture NORTH/SOUTH
-        if board[iDest + 1][jDest] == enemy_player and board[iDest - 1][jDest] == enemy_player: #check for insta capture
-            if (iDest - 2) >= 0 and board[iDest - 2][jDest] == player and (iDest - 2) != iOrigin: #check for possible suicide action to the north
-                    action_list.append((iOrigin, jOrigin, iDest, jDest))
-            elif (iDest + 2) < size and board[iDest + 2][jDest] == player and (iDest + 2) != iOrigin: #check for possible suicide action to the south
-                    action_list.append((iOrigin, jOrigin, iDest, jDest))
-        else: #if there is no insta capture on this square, create action
-            action_list.append((iOrigin, jOrigin, iDest, jDest))
-    else: #if there is no room for an insta capture on this square, create action
-        action_list.append((iOrigin, jOrigin, iDest, jDest))
-    return action_list
+def legal_moves(board, player, size):
+    """
+    Returns the legal moves of 'player' as an (n, 4) int8 array, with rows of
+    (source y, source x, dest y, dest x). Removing a captured enemy piece is
+    a move from the square of the piece to itself.
+    """
+    enemy_captured = -2 * player
+    # A piece can move to at most the squares in its row and column.
+    moves = np.empty((size * size * max(2 * (size - 1), 1), 4), dtype=np.int8)
+    n = 0
+    for i in range(size):
+        for j in range(size):
+            if board[i, j] == enemy_captured:
+                moves[n] = (i, j, i, j)
+                n += 1
+                continue
+            if board[i, j] != player:
+                continue
+            for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)): # North, south, west, east.
+                y, x = i + di, j + dj
+                if y < 0 or y >= size or x < 0 or x >= size:
+                    continue
+                if board[y, x] == 0:
+                    # Moving next to two enemy pieces is only legal with a suicide option.
+                    if di != 0:
+                        legal = check_for_capture_and_suicide_west_or_east_of_given_piece_bool(size, i, j, y, x, player, board)
+                    else:
+                        legal = check_for_capture_and_suicide_north_or_south_of_given_piece_bool(size, i, j, y, x, player, board)
+                    if legal:
+                        moves[n] = (i, j, y, x)
+                        n += 1
+                    continue
+                # Jump over pieces, as long as every other square is empty.
+                y, x = y + di, x + dj
+                while 0 <= y < size and 0 <= x < size and board[y - di, x - dj] != 0 and board[y, x] == 0:
+                    if not (check_for_capture_and_suicide_west_or_east_of_given_piece_bool(size, i, j, y, x, player, board)
+                            and check_for_capture_and_suicide_north_or_south_of_given_piece_bool(size, i, j, y, x, player, board)):
+                        break # This jump results in capture, which breaks the jump chain.
+                    moves[n] = (i, j, y, x)
+                    n += 1
+                    y, x = y + 2 * di, x + 2 * dj
+    return moves[:n].copy()
 
 #checks whether moving a piece from its source, causes an enemys piece to be freed
 @jit(nopython=True)
@@ -275,44 +210,41 @@ class Latrunculi(Game):
         super.__doc__
         return state.player
 
-    def actions(self, state):
+    def find_actions(self, state):
         super.__doc__
-        current_player = 0
-        enemy_captured = 0
-        if state.player:
-            current_player = 1 #White
-            enemy_captured = -2
-        else:
-            current_player = -1 #Black
-            enemy_captured = 2
-        actionsList = [] #we might have to add a pass option???
-
-        for i, j in state.pieces:
-            if state.board[i][j] == current_player:
-                if i > 0:
-                    actionsList.extend(check_North_Or_South_From_Player_Piece(self.size, i, j, -1, current_player, state.board)) #check for actions moving north
-                if i+1 < self.size:
-                    actionsList.extend(check_North_Or_South_From_Player_Piece(self.size, i, j, 1, current_player, state.board)) #check for actions moving south
-                if j > 0:
-                    actionsList.extend(check_West_Or_East_From_Player_Piece(self.size, i, j, -1, current_player, state.board)) #check for actions moving west
-                if j+1 < self.size:
-                    actionsList.extend(check_West_Or_East_From_Player_Piece(self.size, i, j, 1, current_player, state.board)) #check for actions moving east
-            elif state.board[i][j] == enemy_captured: # if the current piece, is the opponents captured piece
-                actionsList.append((i, j, i, j)) # action to remove an opponents captured piece
-
-        if actionsList == []:
-            actionsList.append(None)
-        else:
-            actionsList = [Action((x1, y1), (x2, y2)) for x1, y1, x2, y2 in actionsList]
-        return actionsList
+        moves = self.packed_actions(state)
+        if len(moves) == 0:
+            return [None]
+        return [Action((y1, x1), (y2, x2)) for y1, x1, y2, x2 in moves.tolist()]
+
+    def packed_actions(self, state):
+        """
+        Returns the legal moves of the given state as an (n, 4) int8 array (see legal_moves).
+        Found the first time they are requested, and used directly by map_actions.
+        """
+        if state.packed_actions is None:
+            state.packed_actions = legal_moves(state.board, 1 if state.player else -1, self.size)
+        return state.packed_actions
+
+    def action(self, move):
+        """
+        Returns the Action for a packed move (y1, x1, y2, x2), as used by map_actions.
+        """
+        if move is None:
+            return None
+        return Action(move[:2], move[2:])
 
     def result(self, state, action):
         super.__doc__
 
         if action is None:
-            return State(state.board, (not state.player), pieces=[p for p in state.pieces])
-        source = action.source
-        dest = action.dest
+            new_state = State(state.board, (not state.player), pieces=[p for p in state.pieces])
+            self.update_hash(state, new_state)
+            return new_state
+        if type(action) is tuple: # Packed move from map_actions.
+            source, dest = action[:2], action[2:]
+        else:
+            source, dest = action.source, action.dest
         current_player = 0
         enemy_player = 0
         if state.player:
@@ -394,13 +326,14 @@ class Latrunculi(Game):
                 raise Exception("you have attempted to move an opponents captured piece...")
         else: #If none of the above, illegal move...
             raise Exception("you have attempted to move a piece that you do not own...")
+        self.update_hash(state, new_state)
         return new_state
 
-    def terminal_test(self, state):
+    def find_terminal(self, state):
         super.__doc__
         return (state.board == 1).sum() < 2 or (state.board == -1).sum() < 2
 
-    def utility(self, state, player):
+    def find_utility(self, state, player):
         super.__doc__
         return fast_utility(state.board, player)
 
@@ -424,46 +357,37 @@ class Latrunculi(Game):
         """
         Map actions to neural network output policy logits. 
         Set all other logits to 0, since they represent illegal actions.
+        'actions' is a list of Actions, or an array of moves from packed_actions.
+        The mapping is keyed by packed moves (y1, x1, y2, x2), see 'action'.
         """
-        action_map = dict()
-        policy_sum = 0
-        if actions == [None]:
-            action_map[None] = 1
-            return action_map
-        for action in actions:
-            y1, x1 = action.source
-            moves = logits[y1, x1]
-            y2, x2 = action.dest
-            dest = y2 * self.size + x2
-            logit = 0
-            if action.dest == action.source:
-                # Action equals the removal of an enemy piece.
-                logit = moves[-1]
-            else:
-                # Action equals a piece being moved.
-                logit = moves[y2 * self.size + x2]
-            logit = np.exp(logit)
-            action_map[action] = logit
-            policy_sum += logit
-        for action, policy in action_map.items():
-            action_map[action] = policy/policy_sum if policy_sum else 0
-
-        return action_map
+        if isinstance(actions, list):
+            if actions == [None]:
+                return {None: 1}
+            actions = np.array([a.source + a.dest for a in actions], dtype=np.int8)
+        elif len(actions) == 0:
+            return {None: 1}
+        y1, x1, y2, x2 = actions.T.astype(np.int64)
+        # The last logit of a square is the removal of an enemy piece on it.
+        dest = np.where((y1 == y2) & (x1 == x2), self.size * self.size, y2 * self.size + x2)
+        policies = np.exp(logits[y1, x1, dest])
+        policy_sum = policies.sum()
+        policies = policies / policy_sum if policy_sum else np.zeros(len(policies))
+        return dict(zip(map(tuple, actions.tolist()), policies.tolist()))
 
     def map_visits(self, visits):
         """
         Map policy logits, for all states in the game, to
         board positions. This returns policies in the dimensions
         outputted by the neural network.
+        Visits are keyed by Actions, or by packed moves (see map_actions).
         """
         policies = np.zeros((self.size, self.size, (self.size*self.size)+1), dtype="float32")
         for a, p in visits.items():
             if a is None:
                 continue
-            y1, x1 = a.source
+            y1, x1, y2, x2 = a if type(a) is tuple else a.source + a.dest
             moves = policies[y1, x1]
-            y2, x2 = a.dest
-            if a.dest == a.source:
+            if y1 == y2 and x1 == x2:
                 moves[-1] = p
             else:
                 moves[y2 * self.size + x2] = p
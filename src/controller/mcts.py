@@ -4,11 +4,19 @@ mcts - modified: Modified Monte Carlo Tree Search, using network evaluations.
 -----------------------------------------------------------------------------
 """
 import numpy as np
+from numba import jit
 from config import Config
 from controller.game_ai import GameAI
 from view.log import log
 
+# Exploration rate C(s) of the PUCT formula (see MCTS.puct_score).
+EXPLORE_VAL = 1.27
+
 class Node():
+    """
+    Node in the MCTS search tree. The state of a node is None
+    until the node is first selected, see MCTS.node_state.
+    """
     def __init__(self, state, action, prior_prob=0, parent=None):
         self.state = state
         self.action = action
@@ -34,6 +42,191 @@ class Node():
         return ("[Node: turn={}, visits={}, value={},\nchildren=\n    [{}]]").format(
             self.state.player, self.visits, self.value, children.replace("\n", "\n    "))
 
+class ArrayTree():
+    """
+    Structure-of-arrays store for an MCTS search tree.
+    Nodes are integer ids into preallocated NumPy arrays,
+    and the children of a node occupy a contiguous range of ids.
+    Arrays are grown when full and reused between searches.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.size = 0
+        self.visits = np.zeros(capacity, dtype="int32")
+        self.value = np.zeros(capacity, dtype="float64")
+        self.q_value = np.zeros(capacity, dtype="float64")
+        self.prior_prob = np.zeros(capacity, dtype="float64")
+        self.parent = np.full(capacity, -1, dtype="int32")
+        self.first_child = np.zeros(capacity, dtype="int32")
+        self.num_children = np.zeros(capacity, dtype="int32")
+        self.states = [None] * capacity
+        self.actions = [None] * capacity
+
+    def grow(self, min_capacity):
+        """
+        Double the capacity of all arrays until
+        at least 'min_capacity' nodes fit.
+        """
+        new_capacity = self.capacity
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        extra = new_capacity - self.capacity
+        self.visits = np.concatenate((self.visits, np.zeros(extra, dtype="int32")))
+        self.value = np.concatenate((self.value, np.zeros(extra, dtype="float64")))
+        self.q_value = np.concatenate((self.q_value, np.zeros(extra, dtype="float64")))
+        self.prior_prob = np.concatenate((self.prior_prob, np.zeros(extra, dtype="float64")))
+        self.parent = np.concatenate((self.parent, np.full(extra, -1, dtype="int32")))
+        self.first_child = np.concatenate((self.first_child, np.zeros(extra, dtype="int32")))
+        self.num_children = np.concatenate((self.num_children, np.zeros(extra, dtype="int32")))
+        self.states.extend([None] * extra)
+        self.actions.extend([None] * extra)
+        self.capacity = new_capacity
+
+    def reset(self):
+        """
+        Remove all nodes, keeping the allocated arrays.
+        """
+        self.visits[:self.size] = 0
+        self.value[:self.size] = 0
+        self.q_value[:self.size] = 0
+        self.prior_prob[:self.size] = 0
+        self.parent[:self.size] = -1
+        self.num_children[:self.size] = 0
+        self.states[:self.size] = [None] * self.size
+        self.actions[:self.size] = [None] * self.size
+        self.size = 0
+
+    def add_root(self, state):
+        """
+        Clear the tree and add a root node with the given state.
+        Returns the id of the root (always 0).
+        """
+        self.reset()
+        self.states[0] = state
+        self.size = 1
+        return 0
+
+    def add_children(self, node, actions, priors, states=None):
+        """
+        Add a child for each action to 'node', in one contiguous block.
+        If no states are given, they are left as None until materialized.
+        """
+        amount = len(actions)
+        first = self.size
+        if first + amount > self.capacity:
+            self.grow(first + amount)
+        end = first + amount
+        self.prior_prob[first:end] = priors
+        self.parent[first:end] = node
+        self.states[first:end] = states if states is not None else [None] * amount
+        self.actions[first:end] = actions
+        self.first_child[node] = first
+        self.num_children[node] = amount
+        self.size = end
+
+    def copy_subtree(self, other, node):
+        """
+        Clear this tree and fill it with a copy of the subtree below
+        'node' in the ArrayTree 'other'. The copied node becomes the root (id 0).
+        Nodes are copied level by level, so child blocks stay contiguous.
+        """
+        self.reset()
+        old_ids = [node]
+        new_parents = [-1]
+        index = 0
+        while index < len(old_ids):
+            old_id = old_ids[index]
+            amount = other.num_children[old_id]
+            if amount > 0:
+                first = other.first_child[old_id]
+                self.first_child[index] = len(old_ids)
+                self.num_children[index] = amount
+                old_ids.extend(range(first, first + amount))
+                new_parents.extend([index] * amount)
+            index += 1
+            if len(old_ids) > self.capacity:
+                self.grow(len(old_ids))
+        old_ids = np.array(old_ids)
+        size = len(old_ids)
+        self.visits[:size] = other.visits[old_ids]
+        self.value[:size] = other.value[old_ids]
+        self.q_value[:size] = other.q_value[old_ids]
+        self.prior_prob[:size] = other.prior_prob[old_ids]
+        self.parent[:size] = new_parents
+        self.states[:size] = [other.states[i] for i in old_ids]
+        self.actions[:size] = [other.actions[i] for i in old_ids]
+        self.size = size
+        return 0
+
+    def children(self, node):
+        """
+        Returns the range of ids of the children of 'node'.
+        """
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node])
+
+    def is_leaf(self, node):
+        return self.num_children[node] == 0
+
+    def pretty_desc(self, node):
+        return "<Node: a: {}, n: {}, v: {}, q: {}, p: {}>".format(
+            self.actions[node], self.visits[node], self.value[node],
+            "%.3f" % self.q_value[node], "%.3f" % self.prior_prob[node])
+
+class TranspositionTable():
+    """
+    Maps states (see Game.transposition_key) to the result of evaluating them
+    (priors of the legal actions and the value), so that positions reached
+    through different move orders are only evaluated by the network once.
+    When full, the oldest entry is removed.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, key):
+        self.lookups += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, key, priors, value):
+        if len(self.entries) >= self.capacity:
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = (priors, value)
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0
+
+    def clear(self):
+        self.entries = {}
+        self.lookups = 0
+        self.hits = 0
+
+@jit(nopython=True)
+def select_leaf(first_child, num_children, visits, q_value, prior_prob, node, explore_val):
+    """
+    Walk down an ArrayTree from the given node id, choosing the child
+    with the highest PUCT score at every level, and return the id of the leaf.
+    Children of a node are contiguous, so each level is one scan over
+    the slices of the visit, value and prior arrays.
+    """
+    while num_children[node] > 0:
+        parent_sqrt = np.sqrt(visits[node])
+        first = first_child[node]
+        best_node = first
+        best_score = -np.inf
+        for child in range(first, first + num_children[node]):
+            score = q_value[child] + explore_val * prior_prob[child] * parent_sqrt / (1 + visits[child])
+            if score > best_score:
+                best_score = score
+                best_node = child
+        node = best_node
+    return node
+
 def normalize_value(value):
     """
     Normalizes the given value, and returns it
@@ -59,9 +252,14 @@ class MCTS(GameAI):
     Implementation of MCTS. This is implemented in terms
     of the four stages of the algorithm: Selection, Expansion,
     Simulation and Backpropagation.
+    The tree is either made of Node objects, or stored in an ArrayTree,
+    depending on Config.MCTS_TREE. In the latter case, nodes are integer ids.
     """
     cfg = None
     chosen_node = None
+    tree = None
+    transpositions = None
+    path = None # Nodes walked through in the latest 'select'.
 
     def __init__(self, game, playouts=None):
         super().__init__(game)
@@ -69,12 +267,105 @@ class MCTS(GameAI):
             self.ITERATIONS = playouts
         else:
             self.ITERATIONS = Config.MCTS_ITERATIONS
+        self.time_budget = Config.MCTS_TIME_BUDGET
+        self.early_stop = Config.MCTS_EARLY_STOP
+        self.search_budget = self.ITERATIONS # Simulations for the current search.
+        self.full_search = True # Whether the current search is used for training.
+        self.simulations_saved = [] # Simulations saved on each move of the current game.
+        self.set_tree_type(Config.MCTS_TREE)
+        self.set_transpositions(Config.MCTS_TRANSPOSITIONS, Config.TRANSPOSITION_TABLE_SIZE)
 
         log("MCTS is using {} playouts.".format(self.ITERATIONS))
 
     def set_config(self, config):
         GameAI.set_config(self, config)
         self.ITERATIONS = config.MCTS_ITERATIONS
+        self.search_budget = config.MCTS_ITERATIONS
+        self.time_budget = config.MCTS_TIME_BUDGET
+        self.early_stop = config.MCTS_EARLY_STOP
+        self.set_tree_type(config.MCTS_TREE)
+        self.set_transpositions(config.MCTS_TRANSPOSITIONS, config.TRANSPOSITION_TABLE_SIZE)
+
+    def set_transpositions(self, enabled, size):
+        """
+        Enable or disable the transposition table.
+        """
+        if enabled:
+            if self.transpositions is None:
+                self.transpositions = TranspositionTable(size)
+        else:
+            self.transpositions = None
+
+    def new_game(self):
+        """
+        Called before a new game starts. Clears the transposition table,
+        as the network might have changed since the last game.
+        """
+        if self.transpositions is not None:
+            self.transpositions.clear()
+        self.simulations_saved = []
+
+    def search_finished(self, root, simulations, time_spent):
+        """
+        Returns whether the search from 'root' should stop, after running
+        'simulations' simulations in 'time_spent' seconds.
+        The search stops when the simulation budget (see 'prepare_action') or the time budget
+        is spent, or, if early stopping is enabled, when the most visited child
+        of the root can not be overtaken in the remaining simulations.
+        """
+        if simulations >= self.search_budget:
+            return True
+        if simulations == 0:
+            return False # Always run at least one simulation.
+        if self.time_budget and time_spent >= self.time_budget:
+            return True
+        if self.early_stop:
+            visits = self.visit_counts(root)
+            if len(visits) < 2:
+                return True # Only one action to choose from.
+            second, best = np.partition(visits, -2)[-2:]
+            return best - second > self.search_budget - simulations
+        return False
+
+    def record_search(self, simulations):
+        """
+        Record how many simulations were saved, compared to the full
+        budget, for the search that just finished.
+        """
+        self.simulations_saved.append(max(self.ITERATIONS - simulations, 0))
+
+    def set_tree_type(self, tree_type):
+        """
+        Use Node objects ('nodes') or an ArrayTree ('arrays')
+        for storing the search tree.
+        """
+        if tree_type == "arrays":
+            if self.tree is None:
+                self.tree = ArrayTree()
+        else:
+            self.tree = None
+
+    def node_state(self, node):
+        """
+        Returns the state associated with the given node.
+        Child states are not calculated when a node is expanded,
+        so the state is materialized here from the parent the first time it is needed.
+        """
+        if self.tree is not None:
+            state = self.tree.states[node]
+            if state is None:
+                parent_state = self.tree.states[self.tree.parent[node]]
+                state = self.game.result(parent_state, self.tree.actions[node])
+                self.tree.states[node] = state
+            return state
+        if node.state is None:
+            node.state = self.game.result(node.parent.state, node.action)
+        return node.state
+
+    def node_q_value(self, node):
+        if self.tree is not None:
+            return self.tree.q_value[node]
+        return node.q_value
 
     def puct_score(self, node, parent_visits):
         """
@@ -94,9 +385,8 @@ class MCTS(GameAI):
         #e_base = self.cfg.EXPLORE_BASE
         #e_init = self.cfg.EXPLORE_INIT
         #explore_val = np.log((1 + child.visits + e_base) / e_base) + e_init
-        explore_val = 1.27
         val = node.q_value + (
-            explore_val * node.prior_prob
+            EXPLORE_VAL * node.prior_prob
             * parent_visits / (1+node.visits)
         )
         return val
@@ -104,38 +394,127 @@ class MCTS(GameAI):
     def select(self, node):
         """
         Select a node to run simulations from.
-        Nodes are recursively chosen according to how they maximize
-        the PUCT formula, until a leaf is reached, that leaf is then returned.
+        Nodes are chosen according to how they maximize the PUCT formula,
+        walking down from the given node until a leaf is reached,
+        that leaf is then returned. The nodes walked through are recorded
+        in 'self.path' (root first), to be passed on to 'back_propagate'.
         """
-        if node.children == {}: # Node is a leaf.
-            return node
-        parent_sqrt = np.sqrt(node.visits)
-        best_node = max(node.children.values(), key=lambda n: self.puct_score(n, parent_sqrt))
+        if self.tree is not None:
+            return self.select_id(node)
+        path = [node]
+        while node.children != {}:
+            parent_sqrt = np.sqrt(node.visits)
+            node = max(node.children.values(), key=lambda n: self.puct_score(n, parent_sqrt))
+            path.append(node)
+        self.path = path
+        self.node_state(node)
+        return node
 
-        return self.select(best_node)
+    def select_id(self, node):
+        """
+        Selection in the ArrayTree. Walks down from the given
+        node id, until a leaf is reached, and returns its id.
+        The path is not recorded, backpropagation follows parent ids.
+        """
+        tree = self.tree
+        leaf = select_leaf(tree.first_child, tree.num_children, tree.visits,
+                           tree.q_value, tree.prior_prob, node, EXPLORE_VAL)
+        self.path = None
+        self.node_state(leaf)
+        return leaf
 
     def expand(self, node, actions, policies):
         """
         Expand the tree with new nodes, corresponding to
         taking any possible actions from the current node.
+        Only the action and prior is stored, states are
+        materialized when a child is first selected.
+        Returns the mapping of actions to priors.
         """
         logit_map = self.game.map_actions(actions, policies)
-        for a, p in logit_map.items():
-            node.children[a] = Node(self.game.result(node.state, a), a, p, node)
+        self.add_children(node, logit_map)
+        return logit_map
 
-    def back_propagate(self, node, player, value):
+    def add_children(self, node, priors):
+        """
+        Add a child to the given node for each action in the
+        given mapping of actions to prior probabilities.
+        """
+        if self.tree is not None:
+            self.tree.add_children(node, list(priors.keys()), list(priors.values()))
+            return
+        for a, p in priors.items():
+            node.children[a] = Node(None, a, p, node)
+
+    def path_to(self, node):
+        """
+        Returns the list of nodes from the given node up to the root,
+        found by following parents.
+        """
+        path = []
+        while node is not None:
+            path.append(node)
+            node = node.parent
+        return path
+
+    def back_propagate(self, node, player, value, path=None):
         """
         After a full simulation, propagate result up the tree.
         Invert value at every node, to align 'perspective' to
         the current player of that node.
+        'path' is the list of nodes from the root to 'node', as recorded
+        by 'select'. If not given, it is found by following parents.
+        """
+        if self.tree is not None:
+            self.back_propagate_id(node, player, value)
+            return
+        if path is None:
+            path = self.path_to(node)
+        for n in path:
+            n.visits += 1
+            n.value += value if n.state.player == player else -value
+            n.q_value = n.value / n.visits
+
+    def back_propagate_id(self, node, player, value):
+        """
+        Backpropagation in the ArrayTree, following parent ids to the root.
+        """
+        tree = self.tree
+        while node != -1:
+            tree.visits[node] += 1
+            tree.value[node] += value if tree.states[node].player == player else -value
+            tree.q_value[node] = tree.value[node] / tree.visits[node]
+            node = tree.parent[node]
+
+    def add_virtual_loss(self, node, loss=1, path=None):
+        """
+        Count a loss (and a visit) for every node from the given leaf up to the root,
+        so the following selections in the same search avoid the path,
+        while the leaf is waiting for its network evaluation.
         """
-        node.visits += 1
-        node.value += value if node.state.player == player else -value
-        node.q_value = node.value / node.visits
+        self.update_path(node, 1, -loss, path)
 
-        if node.parent is None:
+    def revert_virtual_loss(self, node, loss=1, path=None):
+        """
+        Remove virtual loss added by 'add_virtual_loss', before backpropagation.
+        """
+        self.update_path(node, -1, loss, path)
+
+    def update_path(self, node, visits, value, path=None):
+        if self.tree is not None:
+            tree = self.tree
+            while node != -1:
+                tree.visits[node] += visits
+                tree.value[node] += value
+                tree.q_value[node] = tree.value[node] / tree.visits[node] if tree.visits[node] else 0
+                node = tree.parent[node]
             return
-        self.back_propagate(node.parent, player, value)
+        if path is None:
+            path = self.path_to(node)
+        for n in path:
+            n.visits += visits
+            n.value += value
+            n.q_value = n.value / n.visits if n.visits else 0
 
     def set_evaluation_data(self, node, policy_logits, value):
         """
@@ -143,17 +522,54 @@ class MCTS(GameAI):
         outcome of the game, as well as probability distribution
         of available actions from the current state.
         """
-        state = node.state
-        actions = self.game.actions(state)
+        state = self.node_state(node)
+        actions = self.game.packed_actions(state)
         new_value = value
+        priors = None
         if self.game.terminal_test(state):
             new_value = self.game.utility(state, state.player)
         else:
             # Expand node.
-            self.expand(node, actions, policy_logits)
+            priors = self.expand(node, actions, policy_logits)
 
+        if self.transpositions is not None:
+            self.transpositions.put(self.game.transposition_key(state), priors, new_value)
         return new_value
 
+    def evaluate_transposition(self, node):
+        """
+        Look up the state of the given leaf in the transposition table.
+        If the same position has been evaluated before, the node is expanded
+        with the stored priors, and the stored value is returned.
+        Otherwise None is returned, and the leaf needs a network evaluation.
+        """
+        if self.transpositions is None:
+            return None
+        entry = self.transpositions.get(self.game.transposition_key(self.node_state(node)))
+        if entry is None:
+            return None
+        priors, value = entry
+        if priors is not None and not self.is_expanded(node):
+            self.add_children(node, priors)
+        return value
+
+    def child_nodes(self, node):
+        """
+        Returns a list of the children of the given node.
+        """
+        if self.tree is not None:
+            return list(self.tree.children(node))
+        return [n for n in node.children.values()]
+
+    def visit_counts(self, node):
+        """
+        Returns the visit counts of the children of the given node.
+        """
+        if self.tree is not None:
+            children = self.tree.children(node)
+            return self.tree.visits[children.start:children.stop]
+        return [n.visits for n in node.children.values()]
+
     def choose_action(self, node):
         """
         When MCTS is finished with it's iterations,
@@ -163,52 +579,112 @@ class MCTS(GameAI):
         a probabiliy of visits to that node during MCTS simulation.
         Otherwise, the node with most visits is chosen.
         """
-        child_nodes = [n for n in node.children.values()]
+        child_nodes = self.child_nodes(node)
         if child_nodes == []:
-            return Node(self.game.result(node.state, None), None)
-        visit_counts = [n.visits for n in child_nodes]
+            state = self.node_state(node)
+            if self.tree is not None:
+                self.tree.add_children(node, [None], [1], [self.game.result(state, None)])
+                return self.tree.first_child[node]
+            return Node(self.game.result(state, None), None)
+        visit_counts = self.visit_counts(node)
         if len(self.game.history) < self.cfg.NUM_SAMPLING_MOVES:
             # Perform softmax sampling of available actions,
             # based on visit counts.
             return softmax_sample(child_nodes, visit_counts)
         # Return node with highest visit count.
-        return max(child_nodes, key=lambda n: n.visits)
+        return child_nodes[int(np.argmax(visit_counts))]
 
     def add_exploration_noise(self, node):
         """
         Add Dirichlet noise to prior value of node,
         to encourage exploration of new nodes.
         """
+        frac = self.cfg.NOISE_FRACTION
+        if self.tree is not None:
+            children = self.tree.children(node)
+            noise = np.random.gamma(self.cfg.NOISE_BASE, 1, len(children))
+            self.tree.prior_prob[children.start:children.stop] *= (1 - frac) + noise * frac
+            return
         actions = node.children.keys()
         noise = np.random.gamma(self.cfg.NOISE_BASE, 1, len(actions))
-        frac = self.cfg.NOISE_FRACTION
         for a, n in zip(actions, noise):
             node.children[a].prior_prob *= (1 - frac) + n * frac
 
-    def create_root_node(self, state):
+    def is_expanded(self, node):
+        if self.tree is not None:
+            return not self.tree.is_leaf(node)
+        return node.children != {}
+
+    def create_root_node(self, state, previous=None):
         """
-        Creates a root node...
+        Creates a root node for the given state. If 'previous' is an MCTS
+        agent whose chosen node holds this state (i.e. the opponent who just moved),
+        the subtree below that node is promoted to be the new root and its parent is pruned,
+        so the simulations already spent on it carry over to this search.
         """
-        root_node = Node(state, None)
+        if previous is not None and previous.chosen_node is not None:
+            chosen = previous.chosen_node
+            if self.tree is not None and previous.tree is not None:
+                if previous.tree.states[chosen] is state:
+                    root_node = self.tree.copy_subtree(previous.tree, chosen)
+                    self.chosen_node = root_node
+                    return root_node
+            elif self.tree is None and previous.tree is None and chosen.state is state:
+                chosen.parent = None
+                self.chosen_node = chosen
+                return chosen
+
+        if self.tree is not None:
+            root_node = self.tree.add_root(state)
+        else:
+            root_node = Node(state, None)
         self.chosen_node = root_node
         return root_node
 
     def prepare_action(self, root_node):
         """
-        Adds Exploration noise.
+        Chooses the simulation budget for the coming search, and adds exploration noise.
+        With playout cap randomization, only a random fraction of searches are
+        full searches, used as training targets. The rest are fast searches
+        with a small budget and no exploration noise.
         """
-        if self.cfg.NOISE_BASE != 0:
+        self.full_search = (not self.cfg.PLAYOUT_CAP_RANDOMIZATION or
+                            np.random.random() < self.cfg.FULL_SEARCH_PROB)
+        if self.full_search:
+            self.search_budget = self.ITERATIONS
+        else:
+            self.search_budget = min(self.cfg.FAST_SEARCH_ITERATIONS, self.ITERATIONS)
+        if self.cfg.NOISE_BASE != 0 and self.full_search:
             self.add_exploration_noise(root_node)
 
+    def store_search_statistics(self, node):
+        """
+        Stores visit counts of the children of the given
+        node in the game, to be used as training targets.
+        """
+        if self.tree is None:
+            self.game.store_search_statistics(node, self.full_search)
+            return
+        tree = self.tree
+        visits = {tree.actions[n]: int(tree.visits[n]) for n in tree.children(node)}
+        self.game.store_visit_counts(visits, tree.q_value[node], self.full_search)
+
     def execute_action(self, node):
         super.__doc__
         best_node = self.choose_action(node)
         self.chosen_node = best_node
 
-        log(f"Root: {node}")
-        for n in node.children.values():
-            log(n.pretty_desc())
+        if self.tree is not None:
+            log(f"Root: {self.tree.pretty_desc(node)}")
+            for n in self.tree.children(node):
+                log(self.tree.pretty_desc(n))
+        else:
+            log(f"Root: {node}")
+            for n in node.children.values():
+                log(n.pretty_desc())
 
-        log("MCTS action: {}, q value: {}.".format(best_node.action, best_node.q_value))
-        self.game.store_search_statistics(node)
-        return best_node.state
+        move = self.tree.actions[best_node] if self.tree is not None else best_node.action
+        action = self.game.action(move)
+        log("MCTS action: {}, q value: {}.".format(action, self.node_q_value(best_node)))
+        self.store_search_statistics(node)
+        return self.node_state(best_node)
@@ -3,6 +3,7 @@
 mcts_basic: Monte Carlo Tree Search.
 ------------------------------------
 """
+from time import time
 import numpy as np
 from controller.game_ai import GameAI
 from config import Config
@@ -39,17 +40,41 @@ class MCTS_Basic(GameAI):
     EXPLORE_PARAM = 2 # Used when choosing which node to explore or exploit.
     ITERATIONS = 100 # Number of times to run MCTS, per action taken in game.
     MAX_MOVES = 1000
+    path = None # Nodes walked through in the latest 'select'.
 
     def __init__(self, game, playouts=None):
         super().__init__(game)
         if playouts is not None:
             self.ITERATIONS = Config.MCTS_BASIC_ITERATIONS
+        self.time_budget = Config.MCTS_TIME_BUDGET
+        self.early_stop = Config.MCTS_EARLY_STOP
+        self.simulations_saved = [] # Simulations saved on each move.
 
         log("MCTS is using {} playouts and {} max moves.".format(self.ITERATIONS, self.MAX_MOVES))
 
     def set_config(self, config):
         GameAI.set_config(self, config)
         self.ITERATIONS = config.MCTS_BASIC_ITERATIONS
+        self.time_budget = config.MCTS_TIME_BUDGET
+        self.early_stop = config.MCTS_EARLY_STOP
+
+    def search_finished(self, root, simulations, time_spent):
+        """
+        Returns whether the search should stop, after running 'simulations'
+        simulations in 'time_spent' seconds. See MCTS.search_finished.
+        """
+        if simulations >= self.ITERATIONS:
+            return True
+        if not root.children:
+            return False # Always search until the root is expanded.
+        if self.time_budget and time_spent >= self.time_budget:
+            return True
+        if self.early_stop:
+            visits = sorted(n.visits for n in root.children.values())
+            if len(visits) < 2:
+                return True # Only one action to choose from.
+            return visits[-1] - visits[-2] > self.ITERATIONS - simulations
+        return False
 
     def select(self, node):
         """
@@ -63,27 +88,30 @@ class MCTS_Basic(GameAI):
             - n(i) = times current node was visited.
         This assures a balance between exploring new nodes,
         and exploiting nodes, that are known to result in good outcomes.
+        The nodes walked through are recorded in 'self.path' (root first),
+        to be passed on to 'back_propagate'.
         """
-        if node.children == {}: # Node is a leaf.
-            return node
-
-        parent_log = np.log(node.visits)
-        best_node = None
-        best_value = -1
-        for child in node.children.values():
-            if child.visits == 0:
-                # Node has not been visited. It is chosen immediately.
-                best_node = child
-                break
-            else:
-                # UCB formula.
-                val = child.mean_value + self.EXPLORE_PARAM * (parent_log / child.visits)
-
-                if val > best_value:
-                    best_value = val
+        path = [node]
+        while node.children != {}: # Walk down until a leaf is reached.
+            parent_log = np.log(node.visits)
+            best_node = None
+            best_value = -1
+            for child in node.children.values():
+                if child.visits == 0:
+                    # Node has not been visited. It is chosen immediately.
                     best_node = child
-
-        return self.select(best_node)
+                    break
+                else:
+                    # UCB formula.
+                    val = child.mean_value + self.EXPLORE_PARAM * (parent_log / child.visits)
+
+                    if val > best_value:
+                        best_value = val
+                        best_node = child
+            node = best_node
+            path.append(node)
+        self.path = path
+        return node
 
     def expand(self, node, actions):
         """
@@ -100,19 +128,27 @@ class MCTS_Basic(GameAI):
         chosen_action = actions[int(np.random.uniform(0, len(actions)))] # Chose random action.
         return self.game.result(state, chosen_action)
 
-    def back_propagate(self, node, value):
+    def back_propagate(self, node, value, path=None):
         """
         After a full simulation, propagate result up the tree.
         Invert value at every node, to align 'perspective' to
         the current player of that node.
+        'path' is the list of nodes from the root to 'node', as recorded
+        by 'select'. If not given, it is found by following parents.
         """
-        node.visits += 1
-        node.value += value
-        node.mean_value = node.value / node.visits
-
-        if node.parent is None:
-            return
-        self.back_propagate(node.parent, -value)
+        if path is None:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = node.parent
+            path.reverse()
+        if len(path) % 2 == 0:
+            value = -value # 'value' is from the perspective of the last node.
+        for node in path:
+            node.visits += 1
+            node.value += value
+            node.mean_value = node.value / node.visits
+            value = -value
 
     def rollout(self, og_state, node):
         """
@@ -139,21 +175,28 @@ class MCTS_Basic(GameAI):
         # Perform iterations of selection, simulation, expansion, and back propogation.
         # After the iterations are done, the child of the root node with the highest
         # number of mean value (value/visits) are chosen as the best action.
-        for _ in range(self.ITERATIONS):
+        time_started = time()
+        simulations = 0
+        while not self.search_finished(root_node, simulations, time() - time_started):
+            simulations += 1
             node = self.select(root_node)
+            path = self.path
             if node.visits > 0 and not self.game.terminal_test(node.state):
                 # Expand tree from available actions. Select first expanded node as
                 # new current and simulate an action from this nodes possible actions.
                 actions = self.game.actions(node.state)
                 self.expand(node, actions)
                 node = node.children[actions[0]] # Select first child of expanded Node.
+                path.append(node)
 
             # Perform rollout, simulate till end of game and return outcome.
             value = self.rollout(root_node.state, node)
-            self.back_propagate(node, -value if node.state.player == root_node.state.player else value)
+            self.back_propagate(node, -value if node.state.player == root_node.state.player else value, path)
 
             node = root_node
 
+        self.simulations_saved.append(self.ITERATIONS - simulations)
+        log(f"Simulations saved: {self.ITERATIONS - simulations}")
         for node in root_node.children.values():
             log(node.pretty_desc())
 
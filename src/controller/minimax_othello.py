@@ -53,7 +53,8 @@ class Minimax_Othello(Minimax):
     def eval_moves(self, state):
         moves_max = len(self.game.actions(state))
         state.player = not state.player
-        moves_min = len(self.game.actions(state))
+        # Not cached, as the moves cached on 'state' are for the player to move.
+        moves_min = len(self.game.find_actions(state))
         state.player = not state.player
         return moves_max - moves_min
 
@@ -1,7 +1,10 @@
 import numpy as np
 from numba import jit
-from controller.game import Game
+from controller.game import Game, ZOBRIST_PIECE_OFFSET
+from controller.bitboard import (BitboardState, shift, popcount, bit_indices, shift_tables,
+                                 square_bits, input_planes)
 from model.state import State, Action
+from config import Config
 
 @jit(nopython=True)
 def capture_in_dir(board, player, x, y, i, j, size):
@@ -63,13 +66,62 @@ def utility(board, pieces, player):
     diff = pieces_player - pieces_opp
     return 1 if diff > 0 else -1 if diff else 0
 
+@jit(nopython=True)
+def bitboard_moves(own, opp, amounts, masks, full, size):
+    """
+    Returns the mask of legal moves for the player with pieces 'own'.
+    For each direction, the runs of opponent pieces next to own pieces are
+    grown one square at a time, and the empty squares after them are moves.
+    """
+    empty = ~(own | opp) & full
+    moves = np.uint64(0)
+    for d in range(len(amounts)):
+        run = shift(own, amounts[d], masks[d]) & opp
+        for _ in range(size - 3):
+            run |= shift(run, amounts[d], masks[d]) & opp
+        moves |= shift(run, amounts[d], masks[d]) & empty
+    return moves
+
+@jit(nopython=True)
+def bitboard_flips(own, opp, move, amounts, masks):
+    """
+    Returns the mask of opponent pieces flipped by placing a piece on 'move'.
+    """
+    flipped = np.uint64(0)
+    for d in range(len(amounts)):
+        run = np.uint64(0)
+        square = shift(move, amounts[d], masks[d])
+        while square & opp:
+            run |= square
+            square = shift(square, amounts[d], masks[d])
+        if square & own:
+            flipped |= run
+    return flipped
+
+@jit(nopython=True)
+def bitboard_terminal(own, opp, amounts, masks, full, size):
+    return (bitboard_moves(own, opp, amounts, masks, full, size) == 0 and
+            bitboard_moves(opp, own, amounts, masks, full, size) == 0)
+
 class Othello(Game):
     def __init__(self, size, rand_seed=None):
+        # With Config.OTHELLO_ENGINE = 'bitboard', states are BitboardStates,
+        # and moves are generated from bit masks by the bitboard_ functions above.
+        self.bitboard = Config.OTHELLO_ENGINE == "bitboard"
+        if self.bitboard:
+            self.shift_amounts, self.shift_masks = shift_tables(size, size)
+            self.full_mask = np.uint64((1 << (size * size)) - 1)
+            self.square_bits = square_bits(size * size)
         Game.__init__(self, size)
         self.num_actions = self.size * self.size
 
     def start_state(self):
         super.__doc__
+        if self.bitboard:
+            half = self.size // 2
+            white = (1 << (half * self.size + half-1)) | (1 << ((half-1) * self.size + half))
+            black = (1 << (half * self.size + half)) | (1 << ((half-1) * self.size + half-1))
+            return BitboardState(np.uint64(white), np.uint64(black), True, self.size, self.size)
         board = np.zeros((self.size, self.size), dtype="b")
         half = self.size // 2
         board[half][half-1] = 1
@@ -83,8 +135,15 @@ class Othello(Game):
         super.__doc__
         return state.player
 
-    def actions(self, state):
+    def find_actions(self, state):
         super.__doc__
+        if self.bitboard:
+            own, opp = state.own_pieces()
+            # Compiled functions return masks as Python ints, they are passed on as uint64.
+            moves = np.uint64(bitboard_moves(own, opp, self.shift_amounts, self.shift_masks, self.full_mask, self.size))
+            if not moves:
+                return [None]
+            return [Action(None, divmod(i, self.size)) for i in bit_indices(moves).tolist()]
         action_list = []
         board = state.board
         player_num = 1 if state.player else -1
@@ -97,33 +156,67 @@ class Othello(Game):
 
     def result(self, state, action):
         super.__doc__
+        if self.bitboard:
+            return self.bitboard_result(state, action)
         copy_arr = np.copy(state.board)
         new_state = State(copy_arr, not state.player, [p for p in state.pieces])
+        if action:
+            player_num = 1 if state.player else -1
+            y, x = action.dest
+            result(copy_arr, y, x, self.size, player_num)
+            new_state.pieces.append((y, x))
+        self.update_hash(state, new_state)
+        return new_state
+
+    def bitboard_result(self, state, action):
         if not action:
+            new_state = BitboardState(state.white, state.black, not state.player, self.size, self.size)
+            if state.hash_key is not None:
+                new_state.hash_key = state.hash_key ^ int(self.zobrist_keys()[1])
             return new_state
-        player_num = 1 if state.player else -1
+        own, opp = state.own_pieces()
         y, x = action.dest
-        result(copy_arr, y, x, self.size, player_num)
-        new_state.pieces.append((y, x))
+        move = self.square_bits[y * self.size + x]
+        flipped = np.uint64(bitboard_flips(own, opp, move, self.shift_amounts, self.shift_masks))
+        own, opp = own | move | flipped, opp ^ flipped
+        white, black = (own, opp) if state.player else (opp, own)
+        new_state = BitboardState(white, black, not state.player, self.size, self.size)
+        if state.hash_key is not None:
+            # Update hash incrementally, without building the board: the new piece,
+            # the flipped pieces, and the change of turn.
+            table, player_key = self.zobrist_keys()
+            piece = ZOBRIST_PIECE_OFFSET + (1 if state.player else -1)
+            hash_key = state.hash_key ^ int(table[y * self.size + x, piece] ^ player_key)
+            for i in bit_indices(flipped).tolist():
+                hash_key ^= int(table[i, piece] ^ table[i, 2 * ZOBRIST_PIECE_OFFSET - piece])
+            new_state.hash_key = hash_key
         return new_state
 
-    def terminal_test(self, state):
+    def find_terminal(self, state):
         super.__doc__
-        actions_cp = self.actions(state)
-        if actions_cp == [None]:
-            state.player = not state.player
-            actions_op = self.actions(state)
-            state.player = not state.player
+        if self.bitboard:
+            return bitboard_terminal(state.white, state.black, self.shift_amounts,
+                                     self.shift_masks, self.full_mask, self.size)
+        if self.actions(state) == [None]:
+            # The other player's moves are found on a new state,
+            # as the moves cached on 'state' are for the player to move.
+            actions_op = self.find_actions(State(state.board, not state.player, state.pieces))
             if actions_op == [None]:
                 return True
         return False
 
-    def utility(self, state, player):
+    def find_utility(self, state, player):
         super.__doc__
+        if self.bitboard:
+            diff = popcount(state.white) - popcount(state.black)
+            diff = diff if player else -diff
+            return 1 if diff > 0 else -1 if diff else 0
         return utility(state.board, state.pieces, player)
 
     def structure_data(self, state):
         super.__doc__
+        if self.bitboard:
+            return input_planes(state, self.square_bits)
         pos_pieces = np.where(state.board == 1, state.board, np.zeros((self.size, self.size), dtype="b"))
         neg_pieces = -np.where(state.board == -1, state.board, np.zeros((self.size, self.size), dtype="b"))
 
@@ -17,14 +17,23 @@ def force_quit(gui):
 def is_mcts(ai):
     return type(ai).__name__ == "MCTS"
 
+def get_player(data):
+    """
+    Returns the agent whose turn it is, in the given game data.
+    """
+    game, state, player_1, player_2 = data[:4]
+    return player_1 if game.player(state) else player_2
+
 def getpid():
     return current_process().name
 
-def create_roots(batch_data):
+def create_roots(batch_data, networks=None, reuse=False):
     """
     Create root nodes for use in MCTS simulation. Takes as a parameter a list of tuples,
     containing data for each game. This data consist of: gametype, state, type of player 1
-    and type of player 2
+    and type of player 2.
+    If 'reuse' is True, and both players are MCTS using the same network, the subtree
+    that the opponent chose on its last move is reused as the new root.
     """
     root_nodes = []
     for data in batch_data:
@@ -34,7 +43,12 @@ def create_roots(batch_data):
         player_2 = data[3]
 
         player = player_1 if game.player(state) else player_2
-        root_nodes.append(player.create_root_node(state))
+        opponent = player_2 if game.player(state) else player_1
+        previous = None
+        if (reuse and is_mcts(opponent) and
+                (networks is None or networks[game][True] == networks[game][False])):
+            previous = opponent
+        root_nodes.append(player.create_root_node(state, previous))
     return root_nodes
 
 def prepare_actions(batch_data, roots):
@@ -56,8 +70,10 @@ def prepare_actions(batch_data, roots):
 def select_nodes(batch_data, roots):
     """
     Run 'select' in MCTS on a batch of root nodes.
+    Returns the selected nodes, and the path to each of them.
     """
     nodes = []
+    paths = []
     for i, root in enumerate(roots):
         data = batch_data[i]
         game = data[0]
@@ -69,7 +85,36 @@ def select_nodes(batch_data, roots):
         player = player_1 if game.player(state) else player_2
 
         nodes.append(player.select(root))
-    return nodes
+        paths.append(player.path)
+    return nodes, paths
+
+def select_leaves(batch_data, roots, leaves_per_tree, virtual_loss):
+    """
+    Run 'select' in MCTS several times on each root node in a batch.
+    Virtual loss is added to the path of each selected leaf, so that the
+    following selections in the same tree diverge. A tree stops selecting
+    when it finds a leaf that is already waiting for evaluation.
+    Returns the leaves, the batch data of the game that each leaf belongs to,
+    the path to each leaf, and the amount of leaves selected in each tree.
+    """
+    leaves = []
+    leaf_batch = []
+    paths = []
+    counts = []
+    for data, root in zip(batch_data, roots):
+        player = get_player(data)
+        selected = []
+        for _ in range(leaves_per_tree):
+            leaf = player.select(root)
+            if leaf in selected:
+                break
+            player.add_virtual_loss(leaf, virtual_loss, player.path)
+            selected.append(leaf)
+            paths.append(player.path)
+        leaves.extend(selected)
+        leaf_batch.extend([data] * len(selected))
+        counts.append(len(selected))
+    return leaves, leaf_batch, paths, counts
 
 def expand_nodes(batch_data, nodes, policies, values):
     """
@@ -89,10 +134,11 @@ def expand_nodes(batch_data, nodes, policies, values):
         return_values.append(player.set_evaluation_data(node, policy, values[i]))
     return return_values
 
-def backprop_nodes(batch_data, nodes, values):
+def backprop_nodes(batch_data, nodes, values, paths, virtual_loss=None):
     """
     Backpropagate values from the neural network
-    to update a batch of nodes.
+    to update a batch of nodes, along the paths recorded during selection.
+    If 'virtual_loss' is given, it is first removed from the path of each node.
     """
     for i, node in enumerate(nodes):
         data = batch_data[i]
@@ -104,39 +150,140 @@ def backprop_nodes(batch_data, nodes, values):
 
         player = player_1 if game.player(state) else player_2
 
-        player.back_propagate(node, node.state.player, -value)
+        if virtual_loss is not None:
+            player.revert_virtual_loss(node, virtual_loss, paths[i])
+        player.back_propagate(node, player.node_state(node).player, -value, paths[i])
 
 def pack_data_for_eval(batch_data, networks, nodes):
-    return [(-1 if networks is None else networks[g[0]][g[1].player],
-             g[0].structure_data(n.state)) for (g, n) in zip(batch_data, nodes)]
+    data = []
+    for (game, state, player_1, player_2), node in zip(batch_data, nodes):
+        player = player_1 if game.player(state) else player_2
+        data.append((-1 if networks is None else networks[game][state.player],
+                     game.structure_data(player.node_state(node))))
+    return data
 
-def play_as_mcts(batch_data, networks, config, connection):
+def evaluate_leaves(batch_data, networks, nodes, connection):
     """
-    Play a batch of games as MCTS vs. MCTS.
+    Expand a batch of leaf nodes and return their values. Leaves whose position
+    is in the transposition table of their agent are expanded from there,
+    the rest are evaluated by the network in the main process.
     """
-    roots = create_roots(batch_data)
+    values = [get_player(data).evaluate_transposition(node) for data, node in zip(batch_data, nodes)]
+    missing = [i for i, value in enumerate(values) if value is None]
+    if missing:
+        eval_batch = [batch_data[i] for i in missing]
+        eval_nodes = [nodes[i] for i in missing]
+        connection.send(("evaluate", pack_data_for_eval(eval_batch, networks, eval_nodes)))
+        policies, net_values = connection.recv()
+        for i, value in zip(missing, expand_nodes(eval_batch, eval_nodes, policies, net_values)):
+            values[i] = value
+    return values
 
-    # Get network evaluation from main process.
-    data = pack_data_for_eval(batch_data, networks, roots)
-    connection.send(("evaluate", data))
+def transposition_hits(batch_data):
+    """
+    Returns the total amount of lookups and hits in the
+    transposition tables of the MCTS agents in a batch.
+    """
+    lookups = hits = 0
+    for data in batch_data:
+        for player in data[2:4]:
+            if is_mcts(player) and player.transpositions is not None:
+                lookups += player.transpositions.lookups
+                hits += player.transpositions.hits
+    return lookups, hits
 
-    policies, values = connection.recv()
-    log(f"Root policies:\n{policies}")
-    log(f"OG root values: {values}")
-    values = expand_nodes(batch_data, roots, policies, values)
+def play_as_mcts(batch_data, networks, config, connection):
+    """
+    Play a batch of games as MCTS vs. MCTS.
+    Each tree is searched until its agent's simulation or time budget is spent,
+    or its best action is decided (see MCTS.search_finished). Trees that
+    are done drop out of the following evaluation rounds.
+    """
+    roots = create_roots(batch_data, networks, config.MCTS_REUSE_TREE)
+
+    # Roots reused from the previous move are already expanded,
+    # only the rest need a network evaluation.
+    unexpanded = [i for i, (data, root) in enumerate(zip(batch_data, roots))
+                  if not get_player(data).is_expanded(root)]
+    if unexpanded:
+        # Get network evaluation from main process.
+        eval_batch = [batch_data[i] for i in unexpanded]
+        eval_roots = [roots[i] for i in unexpanded]
+        values = evaluate_leaves(eval_batch, networks, eval_roots, connection)
+        log(f"OG root values: {values}")
     prepare_actions(batch_data, roots)
 
-    for _ in range(config.MCTS_ITERATIONS):
-        selected_nodes = select_nodes(batch_data, roots)
-
-        data = pack_data_for_eval(batch_data, networks, selected_nodes)
-        connection.send(("evaluate", data))
-        policies, values = connection.recv()
-        values = expand_nodes(batch_data, selected_nodes, policies, values)
-        backprop_nodes(batch_data, selected_nodes, values)
+    leaves_per_tree = config.MCTS_LEAVES_PER_ROUND
+    time_started = time()
+    # Simulations run in each tree. Trees that stop selecting early
+    # (see select_leaves) run fewer than 'leaves_per_tree' per round.
+    simulations = [0] * len(batch_data)
+    searching = list(range(len(batch_data))) # Indexes of trees still being searched.
+    while True:
+        time_spent = time() - time_started
+        still_searching = []
+        for i in searching:
+            player = get_player(batch_data[i])
+            if player.search_finished(roots[i], simulations[i], time_spent):
+                player.record_search(simulations[i])
+            else:
+                still_searching.append(i)
+        searching = still_searching
+        if not searching:
+            break
+        active_batch = [batch_data[i] for i in searching]
+        active_roots = [roots[i] for i in searching]
+
+        if leaves_per_tree > 1:
+            # Collect several leaves per tree for each network evaluation, using virtual loss.
+            leaves, leaf_batch, paths, counts = select_leaves(active_batch, active_roots, leaves_per_tree,
+                                                              config.VIRTUAL_LOSS)
+
+            values = evaluate_leaves(leaf_batch, networks, leaves, connection)
+            backprop_nodes(leaf_batch, leaves, values, paths, config.VIRTUAL_LOSS)
+            for i, count in zip(searching, counts):
+                simulations[i] += count
+        else:
+            selected_nodes, paths = select_nodes(active_batch, active_roots)
+
+            values = evaluate_leaves(active_batch, networks, selected_nodes, connection)
+            backprop_nodes(active_batch, selected_nodes, values, paths)
+            for i in searching:
+                simulations[i] += 1
     return roots
 
-def play_games(games, w_players, b_players, config, network_steps=None, gui=None, connection=None):
+def simulations_saved(batch_data):
+    """
+    Returns the total amount of simulations saved, and the amount
+    of moves made, by the MCTS agents in a batch, in the current games.
+    """
+    saved = moves = 0
+    for data in batch_data:
+        for player in data[2:4]:
+            if is_mcts(player):
+                saved += sum(player.simulations_saved)
+                moves += len(player.simulations_saved)
+    return saved, moves
+
+def report_games(games, connection):
+    """
+    Send clones of the given finished games to the main process, and reset them.
+    Returns the reply of the main process, which is the training step to evaluate
+    the model at, or None.
+    """
+    clones = []
+    for game in games:
+        clones.append(game.clone())
+        game.reset() # Reset game history.
+    try:
+        connection.send(("game_over", clones))
+        return connection.recv()
+    except EOFError:
+        print("f{getpid()}: Monitor process has exited... This is probably fine.")
+        exit(0)
+
+def play_games(games, w_players, b_players, config, network_steps=None,
+               gui=None, connection=None, on_game_over=None):
     """
     Play a number of games to the end, with capabilities for playing as any
     type of agent and any type of game.
@@ -153,13 +300,23 @@ def play_games(games, w_players, b_players, config, network_steps=None, gui=None
                         is not active, meaning only one game is played.
         connection    - Pipe object with connection to the main process. Used when requesting
                         network evaluating among other things.
+        on_game_over  - If given, games are played continuously. Each finished game is passed
+                        to 'on_game_over' right away, along with its player 1 agent, and a new
+                        game is started in its place, so the amount of active games stays
+                        the same. At most config.GAME_ITERATIONS games are started
+                        for each slot, after that finished games are not replaced.
     """
     # List of lists. Each containing a game to be played,
     # the current state for that game, the agent playing as player1,
     # and the agent playing as player 2.
     batch_data = [[games[i], games[i].start_state(), w_players[i], b_players[i]] for i in range(len(games))]
     total_games = len(games)
+    games_left = (config.GAME_ITERATIONS - 1) * total_games # New games that can be started.
     counters = [0 for _ in games] # Counting amount of moves for each game.
+    for data in batch_data:
+        for player in data[2:4]:
+            if is_mcts(player):
+                player.new_game()
 
     if gui is not None:
         sleep(1)
@@ -196,18 +353,44 @@ def play_games(games, w_players, b_players, config, network_steps=None, gui=None
                 game.terminal_value = util
                 winner = "White" if util == 1 else "Black" if util == -1 else "Draw"
                 log(f"Game over! Winner: {winner}")
+                log(f"Moves used for training: {len(game.training_indices())}/{counters[i]}")
+                saved, moves = simulations_saved([batch_data[i]])
+                if saved:
+                    log(f"Simulations saved by search budget: {saved} over {moves} moves")
+                lookups, hits = transposition_hits([batch_data[i]])
+                if lookups:
+                    log(f"Network evaluations saved by transpositions: {hits}/{lookups}")
             else:
                 # Append state to game history, unless the state is terminal.
                 game.history.append(state)
 
         turn_took = "{0:.3f}".format((time() - time_turn))
         num_active = len(batch_data)
+        lookups, hits = transposition_hits(batch_data)
+        saved, moves = simulations_saved(batch_data)
         num_moves = len(batch_data[0][0].history)
         name_1, name_2 = type(batch_data[0][2]).__name__, type(batch_data[0][3]).__name__
+        if on_game_over is not None:
+            refilled = []
+            for i in finished_games_indexes:
+                game, _, player_1, player_2 = batch_data[i]
+                on_game_over([game], player_1)
+                if config.GAME_ITERATIONS == -1 or games_left > 0:
+                    # Start a new game in place of the finished one.
+                    games_left -= 1
+                    batch_data[i][1] = game.start_state()
+                    counters[i] = 0
+                    for player in (player_1, player_2):
+                        if is_mcts(player):
+                            player.new_game()
+                    refilled.append(i)
+            finished_games_indexes = [i for i in finished_games_indexes if i not in refilled]
+
         elems_removed = 0
         # Removes games that are finished.
         for i in finished_games_indexes:
             batch_data.pop(i-elems_removed)
+            counters.pop(i-elems_removed)
             elems_removed += 1
 
         num_active -= elems_removed
@@ -215,6 +398,10 @@ def play_games(games, w_players, b_players, config, network_steps=None, gui=None
             # Send logging information to main process if playing as MCTS.
             status = (f"Moves: {num_moves}. Active games: "+
                       f"{num_active}/{total_games}. Turn took {turn_took} s")
+            if lookups:
+                status += f". Transposition hits: {hits/lookups:.1%}"
+            if saved:
+                status += f". Simulations saved per move: {saved/moves:.1f}"
             if name_1 != "MCTS" or name_2 != "MCTS":
                 status += " - Eval vs. {}".format(name_1 if name_2 == "MCTS" else name_2)
             elif network_steps is not None:
@@ -306,8 +493,10 @@ def evaluate_model(game, player, step, config, connection):
     num_games = config.EVAL_GAMES
     num_sample_moves = player.cfg.NUM_SAMPLING_MOVES
     noise_base = player.cfg.NOISE_BASE
+    playout_cap = player.cfg.PLAYOUT_CAP_RANDOMIZATION
     player.cfg.NUM_SAMPLING_MOVES = 0 # Disable softmax sampling during evaluation.
     player.cfg.NOISE_BASE = 0 # Disable noise during evaluation.
+    player.cfg.PLAYOUT_CAP_RANDOMIZATION = False # Always search fully during evaluation.
     connection.send(("log", ["Evaluating against Random", getpid()]))
     rand_ai = get_ai_algorithm("Random", game, ".")
 
@@ -355,6 +544,7 @@ def evaluate_model(game, player, step, config, connection):
 
     player.cfg.NUM_SAMPLING_MOVES = num_sample_moves # Restore softmax sampling.
     player.cfg.NOISE_BASE = noise_base # Restore noise.
+    player.cfg.PLAYOUT_CAP_RANDOMIZATION = playout_cap # Restore playout cap randomization.
 
 def get_game(game_name, size, rand_seed=None, wildcard="."):
     """
@@ -412,49 +602,103 @@ def get_ai_algorithm(algorithm, game, wildcard="."):
         print("Unknown AI algorithm, name must equal name of AI class.")
         return None, "unknown"
 
-def play_loop(games, p1s, p2s, iteration, gui=None, config=None, connection=None):
+class SelfPlayWorker:
     """
-    Run a given number of games with a given AI.
-
-    Parameters:
-        games      - A list of games to play.
-        p1s        - A list of agents playing as player 1.
-        p2s        - A list of agents playing as player 2.
-        iteration  - This method is called recursively, and iteration
-                    indicates how many games have been played.
-        gui        - GUI object used to visualize the games.
-        config     - Config object with a variety of parameters to be used during the games.
-        connection - Pipe object with connection to the main process. Used when requesting
-                     network evaluating among many things.
+    Long-running loop of a self-play process. Plays batches of games, until
+    config.GAME_ITERATIONS batches are played (forever if -1), and sends the
+    finished games to the main process.
+    The lifecycle hooks 'on_start', 'on_batch_finished', 'on_evaluation_requested',
+    and 'on_shutdown' are called as the worker runs, and can be overridden.
     """
-    if iteration == config.GAME_ITERATIONS:
-        print("{} is done with training!".format(getpid()))
-        return
-    try:
-        play_games(games, p1s, p2s, config, gui=gui, connection=connection)
-        clones = []
-
-        for i in range(len(games)):
-            game = games[i]
-            p1 = p1s[i]
-            p2 = p2s[i]
-            clones.append(game.clone())
-            game.reset() # Reset game history.
+    def __init__(self, games, p1s, p2s, gui=None, config=None, connection=None):
+        """
+        Parameters:
+            games      - A list of games to play.
+            p1s        - A list of agents playing as player 1.
+            p2s        - A list of agents playing as player 2.
+            gui        - GUI object used to visualize the games.
+            config     - Config object with a variety of parameters to be used during the games.
+            connection - Pipe object with connection to the main process. Used when requesting
+                         network evaluating among many things.
+        """
+        self.games = games
+        self.p1s = p1s
+        self.p2s = p2s
+        self.gui = gui
+        self.config = config
+        self.connection = connection
+        self.iteration = 0 # Amount of batches played.
+        self.running = False
+
+    def done(self):
+        return (not self.running or
+                self.config.GAME_ITERATIONS != -1 and self.iteration >= self.config.GAME_ITERATIONS)
+
+    def run(self):
+        """
+        Play games until done, or until interrupted.
+        """
+        self.running = True
+        self.on_start()
         try:
-            if connection and not gui:
-                connection.send(("game_over", clones))
-                status = connection.recv()
-                if status is not None:
-                    # Evaluate performance of trained model against other AIs.
-                    evaluate_model(games[0], p1s[0], status, config, connection)
-        except EOFError:
-            print("f{getpid()}: Monitor process has exited... This is probably fine.")
+            if self.config.CONTINUOUS_SELF_PLAY and self.connection and not self.gui:
+                # Games are sent to the main process, and replaced, as they finish.
+                play_games(self.games, self.p1s, self.p2s, self.config,
+                           connection=self.connection, on_game_over=self.on_batch_finished)
+                self.iteration = self.config.GAME_ITERATIONS
+            while not self.done():
+                play_games(self.games, self.p1s, self.p2s, self.config,
+                           gui=self.gui, connection=self.connection)
+                self.on_batch_finished(self.games, self.p1s[0])
+                self.iteration += 1
+        except KeyboardInterrupt:
+            self.running = False
+            self.on_shutdown(True)
             exit(0)
-        play_loop(games, p1s, p2s, iteration+1, gui, config, connection)
-    except KeyboardInterrupt:
-        if gui is not None:
-            gui.close()
-        exit(0)
+        self.running = False
+        self.on_shutdown(False)
+
+    def stop(self):
+        """
+        Stop the worker once the current batch of games is over.
+        """
+        self.running = False
+
+    def on_start(self):
+        """
+        Called before the first game is played.
+        """
+        log(f"{getpid()} started self-play with {len(self.games)} games.")
+
+    def on_batch_finished(self, games, player):
+        """
+        Called with games that are over (the whole batch, or a single game
+        when playing continuously), and the player 1 agent of the first of them.
+        The games are sent to the main process, and reset.
+        """
+        if self.connection and not self.gui:
+            status = report_games(games, self.connection)
+            if status is not None:
+                self.on_evaluation_requested(games[0], player, status)
+        else:
+            for game in games:
+                game.reset() # Reset game history.
+
+    def on_evaluation_requested(self, game, player, step):
+        """
+        Called when the main process asks for the model, at training step 'step',
+        to be evaluated against other AIs.
+        """
+        evaluate_model(game, player, step, self.config, self.connection)
+
+    def on_shutdown(self, interrupted):
+        """
+        Called when the worker stops, either when done or when interrupted.
+        """
+        if not interrupted:
+            print("{} is done with training!".format(getpid()))
+        elif self.gui is not None:
+            self.gui.close()
 
 def copy_games_and_players(game, p1, p2, amount):
     """
@@ -504,4 +748,4 @@ def init_self_play(game, p1, p2, connection, gui=None, config=None):
         if is_mcts(p2):
             player_2_agents[i].set_config(cfg)
 
-    play_loop(games, player_1_agents, player_2_agents, 0, gui, cfg, connection)
+    SelfPlayWorker(games, player_1_agents, player_2_agents, gui, cfg, connection).run()
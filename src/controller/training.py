@@ -6,11 +6,15 @@ train network, predict from network, and plot performance.
 """
 import pickle
 import os
+from queue import Queue, Empty
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.connection import wait
 from glob import glob
 from sys import argv
 from time import time
 import datetime
+import numpy as np
 from numpy import array, concatenate
 from model.neural import NeuralNetwork
 from view.log import FancyLogger
@@ -18,7 +22,11 @@ from view.graph import GraphHandler
 from config import Config
 from util.sqlUtil import SqlUtil
 
-def train_network(network_storage, replay_storage, training_step, game):
+# Entries of the loss index in resources/<game>/misc/loss_index.bin, appended to by
+# save_loss, so the loss history of a run is loaded with one read (see load_losses).
+LOSS_INDEX_DTYPE = np.dtype([("step", np.int32), ("loss", np.float64, (3,))])
+
+def train_network(network_storage, replay_storage, training_step, game, network=None):
     """
     Trains the network by sampling a batch of data
     from the replay buffer. Also plots loss and saves
@@ -31,13 +39,18 @@ def train_network(network_storage, replay_storage, training_step, game):
                           of training data, generated during self-play.
         training_step   - The current step/epoch of training.
         game            - The game currently being played.
+        network         - The network to train. Its weights are published to
+                          'network_storage' at each checkpoint. If None,
+                          the latest network in 'network_storage' is trained in place.
     
     Returns:
         A boolean value indicating whether training is finished.
     """
     game_name = type(game).__name__
-    network = network_storage.latest_network()
-    FancyLogger.set_network_status("Training...") # Get the latest network.
+    published = network is None
+    if published:
+        network = network_storage.latest_network() # Get the latest network.
+    FancyLogger.set_network_status("Training...")
 
     loss = 0
     for i in range(Config.ITERATIONS_PER_TRAINING):
@@ -56,9 +69,12 @@ def train_network(network_storage, replay_storage, training_step, game):
         GraphHandler.plot_data("Value Loss", "Training Loss", training_step+1+i, loss[2])
 
     if not training_step % Config.SAVE_CHECKPOINT:
-        # Create a new neural network with the newly trained model.
-        network = NeuralNetwork(game, network.model)
-        network_storage.save_network(training_step, network)
+        if published:
+            # Create a new neural network with the newly trained model.
+            network = NeuralNetwork(game, network.model)
+            network_storage.save_network(training_step, network)
+        else:
+            network = network_storage.publish_weights(training_step, network)
         if "-s" in argv:
             network_storage.save_network_to_file(training_step, network, game_name)
         if "-ds" in argv:
@@ -68,6 +84,41 @@ def train_network(network_storage, replay_storage, training_step, game):
         return True
     return False
 
+def train_loop(network_storage, replay_storage, training_step, game, requests, results):
+    """
+    Run by the trainer thread. Trains a copy of the latest network once for
+    every request put in the 'requests' queue, and publishes its weights to
+    'network_storage', so evaluation requests can keep being answered in the
+    monitor thread while training. After each training, the new training step,
+    and whether training is finished, is put in the 'results' queue.
+    If training fails, the exception is put in 'results' instead, so the
+    monitor thread can stop. Stops when None is requested.
+    """
+    try:
+        latest = network_storage.latest_network()
+        network = NeuralNetwork(game, latest.copy_model(game))
+        while requests.get() is not None:
+            finished = train_network(network_storage, replay_storage,
+                                     training_step, game, network)
+            training_step += Config.ITERATIONS_PER_TRAINING
+            results.put((training_step, finished))
+            if finished:
+                return
+    except Exception as e:
+        FancyLogger.set_network_status("Training failed: {}".format(repr(e)))
+        results.put(e)
+
+def stop_trainer(requests):
+    """
+    Drop training requests not yet started, and tell the trainer thread to stop.
+    """
+    try:
+        while True:
+            requests.get_nowait()
+    except Empty:
+        pass
+    requests.put(None)
+
 def show_performance_data(ai, index, step, data):
     """
     Show data from an evaluation against a specific AI.
@@ -131,6 +182,19 @@ def game_over(new_games):
         return True
     return False
 
+def batching_status(batch_stats):
+    """
+    Returns a description of the average fill ratio (positions sent to the
+    network compared to Config.EVAL_MAX_BATCH) of evaluation batches, and the
+    average time positions waited in the evaluation queue.
+    """
+    if not batch_stats["batches"]:
+        return ""
+    fill_ratio = batch_stats["evaluated"] / (batch_stats["batches"] * Config.EVAL_MAX_BATCH)
+    delay = batch_stats["delay"] / batch_stats["positions"]
+    return "Eval batches: {}, {:.1%} avg. fill ratio, {:.2f} ms avg. queueing delay.".format(
+        batch_stats["batches"], fill_ratio, delay * 1000)
+
 def evaluate_games(eval_queue, network_storage):
     """
     Evaluate a queue of games using the specified
@@ -143,35 +207,78 @@ def evaluate_games(eval_queue, network_storage):
                           to another dictionary, which maps from pipe objects,
                           of a specific process, to data that needs network evaluation.
         network_storage - NetworkStorage instance storing the different networks.
+
+    Returns:
+        The amount of positions in each batch sent to the network. Positions
+        not in the cache are sent in batches of at most Config.EVAL_MAX_BATCH.
     """
     results = {}
+    batch_sizes = []
+    cache = network_storage.eval_cache
     # Iterate through each network, and associated data, in the queue.
     for n_id, data in eval_queue.items():
+        generation = network_storage.generation(n_id)
+        outputs = {} # Evaluation (policy, value) of each position, for each process.
+        missing = [] # Where to put the evaluation of positions not found in the cache.
+        unique = {} # Maps key of positions not in the cache to their index in the batch.
         joined = []
-        amount = [0] # Keep track of amount of data from each process.
-        # Join data for the current network into one batch.
         for conn, vals in data.items():
-            joined.extend(vals)
-            amount.append(len(vals)+amount[-1])
-        arr = array(joined)
-        policies, values = network_storage.get_network(n_id).evaluate(arr)
+            outputs[conn] = []
+            for eval_data in vals:
+                key = cache.key(generation, eval_data)
+                output = cache.get(key)
+                if output is None:
+                    if key is None or key not in unique:
+                        unique[key] = len(joined)
+                        joined.append(eval_data)
+                    missing.append((conn, len(outputs[conn]), key, unique[key]))
+                outputs[conn].append(output)
+
+        if joined:
+            # Join positions not in the cache into one batch.
+            network = network_storage.get_network(n_id)
+            batches = [joined[i:i+Config.EVAL_MAX_BATCH] for i in range(0, len(joined), Config.EVAL_MAX_BATCH)]
+            with network_storage.lock: # Weights are not published while evaluating.
+                evaluations = [network.evaluate(array(batch)) for batch in batches]
+            policies = concatenate([policy for policy, _ in evaluations])
+            values = concatenate([value for _, value in evaluations])
+            batch_sizes.extend(len(batch) for batch in batches)
+            for conn, index, key, batch_index in missing:
+                policy, value = policies[batch_index], values[batch_index, 0]
+                cache.put(key, policy, value)
+                outputs[conn][index] = (policy, value)
 
         # For each process, sum up all results into one list.
-        for i, conn in enumerate(data):
+        for conn, output in outputs.items():
+            policies = array([policy for policy, _ in output])
+            values = array([value for _, value in output])
             old_data = results.get(conn)
             if old_data is None:
-                results[conn] = (policies[amount[i]:amount[i+1]], values[amount[i]:amount[i+1], 0])
+                results[conn] = (policies, values)
             else:
                 old_policies, old_values = old_data
 
-                old_policies = concatenate((old_policies, policies[amount[i]:amount[i+1]]))
-                old_values = concatenate((old_values, values[amount[i]:amount[i+1], 0]))
+                old_policies = concatenate((old_policies, policies))
+                old_values = concatenate((old_values, values))
 
                 results[conn] = (old_policies, old_values)
 
     # Finally, send the relevant evaluation data to all processes.
     for conn, data in results.items():
         conn.send(data)
+    return batch_sizes
+
+def send_evaluations(eval_queue, network_storage, request_times, batch_stats):
+    """
+    Evaluate the queued requests (see evaluate_games), and add the batches sent
+    to the network, and the time each request waited, to 'batch_stats'.
+    """
+    time_fired = time()
+    batch_sizes = evaluate_games(eval_queue, network_storage)
+    batch_stats["batches"] += len(batch_sizes)
+    batch_stats["evaluated"] += sum(batch_sizes)
+    batch_stats["positions"] += sum(n for _, n in request_times)
+    batch_stats["delay"] += sum((time_fired - t) * n for t, n in request_times)
 
 def load_all_perform_data(game_name):
     perf_rand = load_perform_data("random", None, game_name)
@@ -261,12 +368,7 @@ def initialize_network(game, network_storage, test_mode):
     if load_network:
         training_step = network_storage.curr_step + Config.ITERATIONS_PER_TRAINING
         # Load previously saved network loss + performance data.
-        losses = [[], [], []]
-        for i in range(network_storage.curr_step+1):
-            loss_both, loss_pol, loss_val = load_loss(i, GAME_NAME)
-            losses[0].append(loss_both)
-            losses[1].append(loss_pol)
-            losses[2].append(loss_val)
+        losses = load_losses(network_storage.curr_step, GAME_NAME)
         update_loss([losses[0][-1], losses[1][-1], losses[2][-1]])
         load_all_perform_data(GAME_NAME)
 
@@ -285,8 +387,10 @@ def initialize_network(game, network_storage, test_mode):
 
 def monitor_games(game_conns, game, network_storage, replay_storage, test_mode=False):
     """
-    Listen for updates from self-play processes.
-    These include:
+    Listen for updates from self-play processes, acting as the inference server.
+    Training runs in a separate trainer thread (see 'train_loop'), so evaluation
+    requests are answered with the latest published network while training.
+    Updates include:
         - requests for network evaluation.
         - the result of a terminated game.
         - the result of performance evaluation games.
@@ -319,20 +423,70 @@ def monitor_games(game_conns, game, network_storage, replay_storage, test_mode=F
 
     eval_queue = {}
     new_eval_data = 0
+    new_eval_positions = 0
+    request_times = [] # Time each queued request was received, and its amount of positions.
+    # Batches and positions sent to the network, and positions requested and their total queueing delay.
+    batch_stats = {"batches": 0, "evaluated": 0, "positions": 0, "delay": 0}
     perform_data = [None, None, None, None]
     alert_perform = {game_conns[-1]: False}
     new_games = 0
     new_training_steps = training_step % eval_checkpoint(training_step)
 
+    # At most one training is queued while the trainer is busy, further
+    # requests wait for it to be started (see 'game_over' below).
+    train_requests = Queue(maxsize=1)
+    train_results = Queue()
+    trainer = Thread(target=train_loop, daemon=True,
+                     args=(network_storage, replay_storage, training_step,
+                           game, train_requests, train_results))
+    trainer.start()
+
     try:
         while True:
-            for conn in wait(game_conns):
+            while not train_results.empty():
+                # Trainer has finished a training step.
+                result = train_results.get()
+                if isinstance(result, Exception):
+                    # Trainer has failed, stop self-play.
+                    for c in game_conns:
+                        c.close()
+                    raise result
+                training_step, finished = result
+                new_training_steps += Config.ITERATIONS_PER_TRAINING
+                update_training_step(training_step)
+                if finished:
+                    FancyLogger.set_network_status("Training finished!")
+                    for c in game_conns:
+                        c.close()
+                    return
+                if (Config.EVAL_CHECKPOINT and
+                        new_training_steps >= eval_checkpoint(training_step)):
+                    # Indicate that the processes should run performance evaluation games.
+                    for k in alert_perform:
+                        # Half should play against AI as player 1, half as player 2.
+                        alert_perform[k] = True
+                    new_training_steps = 0
+
+            timeout = 1
+            if new_eval_data:
+                # Wait no longer than the deadline of the queued evaluation requests.
+                timeout = max(request_times[0][0] + Config.EVAL_MAX_DELAY - time(), 0)
+            for conn in wait(game_conns, timeout=timeout):
             # For all connections to self-play processes.
                 status, data = conn.recv()
                 if status == "evaluate":
                     # Process has data that needs evaluation from the network.
+                    if new_eval_data and new_eval_positions + len(data) > Config.EVAL_MAX_BATCH:
+                        # Adding it would overfill the batch, send the queued data first.
+                        send_evaluations(eval_queue, network_storage, request_times, batch_stats)
+                        eval_queue = {}
+                        new_eval_data = 0
+                        new_eval_positions = 0
+                        request_times = []
                     # Add it to the evaluation queue.
                     new_eval_data += 1
+                    new_eval_positions += len(data)
+                    request_times.append((time(), len(data)))
                     for n_id, eval_data in data:
                         if eval_queue.get(n_id) is not None:
                             if eval_queue[n_id].get(conn) is None:
@@ -341,11 +495,6 @@ def monitor_games(game_conns, game, network_storage, replay_storage, test_mode=F
                                 eval_queue[n_id][conn].append(eval_data)
                         else:
                             eval_queue[n_id] = {conn: [eval_data]}
-                    if new_eval_data == Config.GAME_THREADS:
-                        # Enough data is received, send data to evaluation.
-                        evaluate_games(eval_queue, network_storage)
-                        eval_queue = {}
-                        new_eval_data = 0
                 elif status == "game_over":
                     # Game is over, add it to game storage.
                     for game in data:
@@ -358,29 +507,13 @@ def monitor_games(game_conns, game, network_storage, replay_storage, test_mode=F
                             replay_storage.save_game_to_sql(game)
                         new_games += 1
 
-                        should_train = game_over(new_games)
-                        finished = False
-                        if should_train:
-                            # Tell network to train on a batch of data.
-                            new_training_steps += Config.ITERATIONS_PER_TRAINING
-                            new_step = training_step + Config.ITERATIONS_PER_TRAINING
-                            update_training_step(new_step)
-                            finished = train_network(network_storage, replay_storage,
-                                                    training_step, game)
-                            training_step = new_step
+                        if game_over(new_games) and not train_requests.full():
+                            # Tell trainer to train the network on a batch of data.
+                            train_requests.put(True)
                             new_games = 0
-                            if (not finished and Config.EVAL_CHECKPOINT and
-                                    new_training_steps >= eval_checkpoint(training_step)):
-                                # Indicate that the processes should run performance evaluation games.
-                                for k in alert_perform:
-                                    # Half should play against AI as player 1, half as player 2.
-                                    alert_perform[k] = True
-                                new_training_steps = 0
-                        if finished:
-                            FancyLogger.set_network_status("Training finished!")
-                            for c in game_conns:
-                                c.close()
-                            return
+                    # Redraw the evaluation statuses once for all the reported games.
+                    FancyLogger.set_evaluation_statuses(network_storage.eval_cache.status(),
+                                                        batching_status(batch_stats))
                     if alert_perform.get(conn, False):
                         # Tell the process to start running perform eval games.
                         conn.send(training_step)
@@ -414,16 +547,31 @@ def monitor_games(game_conns, game, network_storage, replay_storage, test_mode=F
 
                     perform_data[index] = (total, as_white, as_black)
                     handle_performance_data(training_step, perform_data, game_name)
+            if new_eval_data and (new_eval_data == len(game_conns) or
+                                  new_eval_positions >= Config.EVAL_MAX_BATCH or
+                                  time() >= request_times[0][0] + Config.EVAL_MAX_DELAY):
+                # All processes are waiting, the batch is full, or the deadline has passed.
+                # Send data to evaluation.
+                send_evaluations(eval_queue, network_storage, request_times, batch_stats)
+                eval_queue = {}
+                new_eval_data = 0
+                new_eval_positions = 0
+                request_times = []
     except KeyboardInterrupt:
+        stop_trainer(train_requests)
         for conn in game_conns:
             conn.close()
         print("Exiting...")
         update_active(0)
         return
     except (EOFError, BrokenPipeError) as e:
+        stop_trainer(train_requests)
         print(e)
         update_active(0)
         return
+    finally:
+        # Write the replays still queued by the background writer (with '-s').
+        replay_storage.close()
 
 def save_perform_data(data, ai, step, game_name):
     location = "../resources/" + game_name + "/misc/"
@@ -442,6 +590,15 @@ def save_loss(loss, step, game_name):
         os.makedirs((location))
 
     pickle.dump(loss, open(location + filename, "wb"))
+    append_loss_index({step: loss}, game_name)
+
+def append_loss_index(losses, game_name):
+    """
+    Add the losses of the given training steps to the loss index.
+    """
+    entries = np.array([(step, loss[:3]) for step, loss in losses.items()], dtype=LOSS_INDEX_DTYPE)
+    with open(f"../resources/{game_name}/misc/loss_index.bin", "ab") as index_file:
+        index_file.write(entries.tobytes())
 
 def save_run_report(time_spent, game_name):
     location = "../resources/" + game_name + "/"
@@ -519,13 +676,38 @@ def load_perform_data(ai, step, game_name):
 def load_loss(step, game_name):
     """
     Loads network training loss for given training step.
-    If no such data exists, returns 1.
+    If no such data exists, returns None.
     """
     try:
         loss = pickle.load(open(f"../resources/{game_name}/misc/loss_{step}.bin", "rb"))
         return loss[0], loss[1], loss[2]
     except IOError:
-        return 1, 1, 1
+        return None
+
+def load_losses(last_step, game_name):
+    """
+    Loads network training loss for training steps 0 to 'last_step', from
+    the loss index. Steps missing from the index (saved before there was
+    an index) are loaded from their own files, by a pool of threads, and
+    added to the index. Missing losses are set to 1.
+    Returns a list of total, policy and value losses, each a list over the steps.
+    """
+    index_file = f"../resources/{game_name}/misc/loss_index.bin"
+    losses = {}
+    if os.path.exists(index_file):
+        # Later entries of a step (if training was resumed from an earlier step) replace earlier ones.
+        for entry in np.fromfile(index_file, dtype=LOSS_INDEX_DTYPE):
+            losses[int(entry["step"])] = entry["loss"].tolist()
+    missing = [step for step in range(last_step+1) if step not in losses]
+    if missing:
+        with ThreadPoolExecutor(8) as pool:
+            loaded = pool.map(lambda step: load_loss(step, game_name), missing)
+            found = {step: loss for step, loss in zip(missing, loaded) if loss is not None}
+        if found:
+            append_loss_index(found, game_name)
+            losses.update(found)
+    steps = [losses.get(step, (1, 1, 1)) for step in range(last_step+1)]
+    return [[loss[i] for loss in steps] for i in range(3)]
 
 def start_timing(game_name):
     FancyLogger.start_timing()
@@ -7,11 +7,13 @@ if __name__ == "__main__":
     # This atrocious if statement is needed since these imports would
     # otherwise be run everytime we start a new process (no bueno).
     import os
+    import atexit
     from threading import Thread
     from multiprocessing import Process, Pipe
     from sys import argv
     from controller.latrunculi import Latrunculi
     from controller import self_play
+    from controller.eval_transport import EvaluationSlabs, SharedConnection
     from controller.training import monitor_games, parse_load_step
     from model.storage import ReplayStorage, NetworkStorage
     from view.visualize import Gui
@@ -43,11 +45,19 @@ def initialize(game, p1, p2, **kwargs):
         # Don't use plot/GUI if several games are played.
         gui = None
     pipes = []
+    slabs = [] # Shared memory for network evaluations, if used.
     games, p1s, p2s = self_play.copy_games_and_players(game, p1, p2, Config.GAME_THREADS)
     for i in range(Config.GAME_THREADS):
         child = None
         if self_play.is_mcts(p1) or self_play.is_mcts(p2):
             parent, child = Pipe()
+            if gui is None and Config.EVAL_TRANSPORT == "shared_memory":
+                # Largest evaluation request: every game in the process sends its leaves.
+                capacity = max(Config.ACTORS // 3, Config.EVAL_GAMES) * Config.MCTS_LEAVES_PER_ROUND
+                slabs.append(EvaluationSlabs.for_game(game, capacity))
+                atexit.register(slabs[-1].unlink)
+                parent = SharedConnection(parent, slabs[-1])
+                child = SharedConnection(child, slabs[-1])
             pipes.append(parent)
 
         if gui is None:
@@ -63,7 +73,8 @@ def initialize(game, p1, p2, **kwargs):
     #else if "-ld" option is selected load old replays sql database
     if "-l" in argv or "-lg" in argv and not test_mode:
         step = parse_load_step(argv)
-        replay_storage.load_replay(step, game_name)
+        # Load in the background, self-play processes are already running.
+        replay_storage.load_replay_background(step, game_name)
     elif "-dl" in argv:
         replay_storage.load_games_from_sql()
     if "-s" in argv:
@@ -179,7 +190,10 @@ if __name__ == "__main__":
     REPLAY_STORAGE = None
     if self_play.is_mcts(P_WHITE) or self_play.is_mcts(P_BLACK):
         NETWORK_STORAGE = NetworkStorage()
-        REPLAY_STORAGE = ReplayStorage()
+        replay_folder = None
+        if Config.REPLAY_STORE == "segments":
+            replay_folder = f"../resources/{type(GAME).__name__}/replays/segments/"
+        REPLAY_STORAGE = ReplayStorage(replay_folder)
 
         if gui:
             # If GUI is active, only run with 1 process
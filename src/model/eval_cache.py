@@ -0,0 +1,72 @@
+"""
+eval_cache: Bounded LRU cache of neural network evaluations,
+used by the monitor process to skip evaluating positions seen recently.
+"""
+from collections import OrderedDict
+
+class EvaluationCache:
+    """
+    Maps (network generation, position hash) to the policy and value
+    the network gave the position. When full, the least recently
+    used entry is removed. A capacity of 0 disables the cache.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.nbytes = 0 # Size of the cached policies and values.
+        self.lookups = 0
+        self.hits = 0
+
+    def key(self, generation, eval_data):
+        """
+        Returns the cache key for the given network generation and
+        encoded position (the input to the network), or None if disabled.
+        """
+        if not self.capacity:
+            return None
+        return (generation, hash(eval_data.tobytes()))
+
+    def get(self, key):
+        """
+        Returns the cached (policy, value) for 'key', or None.
+        """
+        if key is None:
+            return None
+        self.lookups += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, policy, value):
+        if key is None or key in self.entries:
+            return
+        if len(self.entries) >= self.capacity:
+            _, (old_policy, old_value) = self.entries.popitem(last=False)
+            self.nbytes -= old_policy.nbytes + old_value.nbytes
+        # Copy, so the cache does not keep the whole batch of policies alive.
+        policy = policy.copy()
+        self.entries[key] = (policy, value)
+        self.nbytes += policy.nbytes + value.nbytes
+
+    def invalidate(self):
+        """
+        Remove all entries. Called when a new network generation is published.
+        """
+        self.entries.clear()
+        self.nbytes = 0
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0
+
+    def memory_usage(self):
+        """
+        Approximate memory used by the cache, in bytes.
+        Includes the keys and the dictionary itself (roughly 100 bytes per entry).
+        """
+        return self.nbytes + len(self.entries) * 100
+
+    def status(self):
+        return "Eval cache: {}/{} entries, {:.1%} hit rate, {:.1f} MB.".format(
+            len(self.entries), self.capacity, self.hit_rate(), self.memory_usage() / (1024 * 1024))
@@ -0,0 +1,297 @@
+"""
+replay_buffer: Fixed-capacity ring buffer of games from self-play, stored as
+encoded training positions, with cumulative-length indexes (Fenwick trees)
+over the positions of each game, so random positions can be sampled
+without going through the whole buffer.
+"""
+import numpy as np
+from numba import jit
+from controller.game import value_target
+
+@jit(nopython=True)
+def fenwick_add(tree, slot, delta):
+    """
+    Add 'delta' to the weight of 'slot' in the Fenwick tree 'tree'.
+    """
+    i = slot + 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+@jit(nopython=True)
+def fenwick_search(tree, targets, slots, offsets):
+    """
+    For each target in 'targets' (in the range 0 to total weight), find the slot
+    whose cumulative weight range contains it, and the offset of the target
+    into that range. Results are written to 'slots' and 'offsets'.
+    """
+    size = len(tree) - 1
+    top_bit = 1
+    while top_bit * 2 <= size:
+        top_bit *= 2
+    for k in range(len(targets)):
+        pos = 0
+        remaining = targets[k]
+        bit = top_bit
+        while bit:
+            nxt = pos + bit
+            if nxt <= size and tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            bit >>= 1
+        slots[k] = pos
+        offsets[k] = remaining
+
+@jit(nopython=True)
+def fenwick_build(tree, weights):
+    """
+    Fill the Fenwick tree 'tree' from 'weights', in O(n).
+    """
+    tree[0] = 0
+    tree[1:] = weights
+    size = len(tree) - 1
+    for i in range(1, size + 1):
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[parent] += tree[i]
+
+class CumulativeIndex:
+    """
+    Weights for a fixed amount of slots, with a running total.
+    Updating a weight and finding the slot of a random unit
+    of weight both take O(log n).
+    """
+    def __init__(self, capacity):
+        self.tree = np.zeros(capacity + 1, dtype=np.int64)
+        self.weights = np.zeros(capacity, dtype=np.int64)
+        self.total = 0
+
+    def set(self, slot, weight):
+        delta = weight - self.weights[slot]
+        if delta:
+            fenwick_add(self.tree, slot, delta)
+            self.weights[slot] = weight
+            self.total += delta
+
+    def set_all(self, weights):
+        self.weights[:] = weights
+        fenwick_build(self.tree, self.weights)
+        self.total = int(self.weights.sum())
+
+    def sample(self, amount):
+        """
+        Returns 'amount' random slots, weighted by their weights, and for each,
+        a uniformly random offset into it (in the range 0 to its weight).
+        """
+        if not amount:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        targets = np.random.randint(0, self.total, amount)
+        slots = np.empty(amount, dtype=np.int64)
+        offsets = np.empty(amount, dtype=np.int64)
+        fenwick_search(self.tree, targets, slots, offsets)
+        return slots, offsets
+
+class EncodedGame:
+    """
+    The positions of a finished game, encoded for training: input planes,
+    dense policy targets, and the 'z' and 'q' values of each position.
+    Only moves used as training targets are encoded, or all moves, if the game
+    was saved before moves were flagged (see Config.PLAYOUT_CAP_RANDOMIZATION).
+    A game where no moves are flagged has no positions.
+    """
+    def __init__(self, game):
+        self.has_targets = game.training_targets is not None
+        indices = game.training_indices()
+        # Input planes are binary, so they are stored as uint8.
+        self.inputs = np.array([game.structure_data(game.history[i]) for i in indices], dtype=np.uint8)
+        self.policies = np.array([game.map_visits(game.visit_counts[i]) for i in indices], dtype=np.float32)
+        self.z_values = np.array([game.z_value(i) for i in indices], dtype=np.float32)
+        self.q_values = np.array([game.q_value_history[i] for i in indices], dtype=np.float32)
+        self.val_type = game.val_type
+
+    def __len__(self):
+        return len(self.inputs)
+
+class ReplayBuffer:
+    """
+    Ring buffer of the latest games from self-play. Games are stored as
+    encoded positions (see EncodedGame), in preallocated arrays that are also
+    used as a ring, so sampling a batch is a matter of indexing those arrays.
+    Adding a game, and evicting the oldest, take O(log n) plus the size of the game.
+    Positions are sampled uniformly, from games with training targets, and from
+    games saved before moves were flagged, where every position is a target.
+    """
+    def __init__(self, capacity, position_capacity=None, store=None):
+        self.capacity = capacity
+        self.start = 0 # Slot of the oldest game.
+        self.size = 0
+        self.slot_rows = np.zeros(capacity, dtype=np.int64) # First position row of each game.
+        self.slot_lengths = np.zeros(capacity, dtype=np.int64)
+        self.target_index = CumulativeIndex(capacity) # Games with training targets.
+        self.move_index = CumulativeIndex(capacity) # Games without.
+        # If given, positions are kept in this on-disk store (see replay_segments.SegmentStore)
+        # instead of in memory.
+        self.store = store
+        # Positions are allocated when the first game is added,
+        # 64 per game by default, and grow when needed.
+        self.position_capacity = position_capacity or capacity * 64
+        self.inputs = None
+        self.policies = None
+        self.z_values = None
+        self.q_values = None
+        self.first_row = 0 # Row of the oldest position.
+        self.rows_used = 0
+        self.val_type = "z" if store is None else store.val_type
+
+    def __len__(self):
+        return self.size
+
+    def append(self, encoded, max_size=None, step=0):
+        """
+        Add an encoded game, evicting the oldest games until there are less than
+        'max_size' (the capacity, by default) before adding it. The buffer
+        grows if 'max_size' is larger than its capacity.
+        'step' is the training step the game is saved at, kept by the on-disk store.
+        """
+        if not len(encoded):
+            return # No moves to train on (only fast searches).
+        self.make_room(max_size)
+        if self.store is None:
+            first_row = self.write_positions(encoded)
+        else:
+            first_row = self.store.append(encoded, step)
+        self.val_type = encoded.val_type
+        self.add_slot(first_row, len(encoded), encoded.has_targets)
+
+    def make_room(self, max_size):
+        max_size = self.capacity if max_size is None else max_size
+        if max_size > self.capacity:
+            self.grow(max_size)
+        while self.size >= max_size:
+            self.evict()
+
+    def write_positions(self, encoded):
+        """
+        Write the positions of an encoded game after the newest
+        position in memory, and return the row of the first of them.
+        """
+        if self.inputs is None:
+            self.allocate_positions(encoded)
+        if self.rows_used + len(encoded) > self.position_capacity:
+            self.grow_positions(max(self.position_capacity * 2, self.rows_used + len(encoded)))
+
+        end_row = (self.first_row + self.rows_used) % self.position_capacity
+        rows = (end_row + np.arange(len(encoded))) % self.position_capacity
+        self.inputs[rows] = encoded.inputs
+        self.policies[rows] = encoded.policies
+        self.z_values[rows] = encoded.z_values
+        self.q_values[rows] = encoded.q_values
+        return end_row
+
+    def add_slot(self, first_row, length, has_targets):
+        slot = (self.start + self.size) % self.capacity
+        self.size += 1
+        self.slot_rows[slot] = first_row
+        self.rows_used += length
+        self.set_slot(slot, length, has_targets)
+
+    def load_store(self, max_size, step=None):
+        """
+        Replace the contents of the buffer with the latest games in the on-disk store,
+        saved at or before training step 'step', if given. Only the index
+        is read, positions are read from disk when sampled.
+        Returns the amount of games loaded.
+        """
+        games = self.store.latest_games(max_size, step)
+        self.__init__(max(self.capacity, max_size), store=self.store)
+        self.size = len(games)
+        self.slot_rows[:self.size] = games["row"]
+        self.slot_lengths[:self.size] = games["length"]
+        self.rows_used = int(games["length"].sum())
+        lengths = self.slot_lengths.copy()
+        has_targets = np.zeros(self.capacity, dtype=np.bool_)
+        has_targets[:self.size] = games["has_targets"]
+        self.target_index.set_all(np.where(has_targets, lengths, 0))
+        self.move_index.set_all(np.where(has_targets, 0, lengths))
+        return self.size
+
+    def evict(self):
+        """
+        Remove the oldest game.
+        """
+        length = self.slot_lengths[self.start]
+        self.first_row = (self.first_row + length) % self.position_capacity
+        self.rows_used -= length
+        self.set_slot(self.start, 0, False)
+        self.start = (self.start + 1) % self.capacity
+        self.size -= 1
+
+    def set_slot(self, slot, length, has_targets):
+        self.slot_lengths[slot] = length
+        self.target_index.set(slot, length if has_targets else 0)
+        self.move_index.set(slot, 0 if has_targets else length)
+
+    def allocate_positions(self, encoded):
+        capacity = self.position_capacity
+        self.inputs = np.zeros((capacity,) + encoded.inputs.shape[1:], dtype=np.uint8)
+        self.policies = np.zeros((capacity,) + encoded.policies.shape[1:], dtype=np.float32)
+        self.z_values = np.zeros(capacity, dtype=np.float32)
+        self.q_values = np.zeros(capacity, dtype=np.float32)
+
+    def grow_positions(self, capacity):
+        """
+        Increase the amount of positions that can be stored,
+        moving the stored positions to the start of the new arrays.
+        """
+        order = (self.first_row + np.arange(self.rows_used)) % self.position_capacity
+        for name in ("inputs", "policies", "z_values", "q_values"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.rows_used] = old[order]
+            setattr(self, name, new)
+        slots = (self.start + np.arange(self.size)) % self.capacity
+        self.slot_rows[slots] = (self.slot_rows[slots] - self.first_row) % self.position_capacity
+        self.first_row = 0
+        self.position_capacity = capacity
+
+    def grow(self, capacity):
+        """
+        Increase the amount of games that can be stored. This takes O(n log n),
+        and only happens when Config.MAX_GAME_GROWTH is used.
+        """
+        slots = (self.start + np.arange(self.size)) % self.capacity
+        slot_rows = self.slot_rows[slots]
+        slot_lengths = self.slot_lengths[slots]
+        has_targets = self.target_index.weights[slots] > 0
+        self.capacity = capacity
+        self.start = 0
+        self.slot_rows = np.zeros(capacity, dtype=np.int64)
+        self.slot_rows[:self.size] = slot_rows
+        self.slot_lengths = np.zeros(capacity, dtype=np.int64)
+        self.target_index = CumulativeIndex(capacity)
+        self.move_index = CumulativeIndex(capacity)
+        for slot in range(self.size):
+            self.set_slot(slot, slot_lengths[slot], has_targets[slot])
+
+    def sample(self, amount, training_step=None):
+        """
+        Returns 'amount' random positions, as a tuple of input planes,
+        policy targets, and value targets (see game.value_target).
+        """
+        # Both indexes only hold training targets (see EncodedGame),
+        # so they are sampled in proportion to their amount of positions.
+        total = self.target_index.total + self.move_index.total
+        from_targets = np.random.binomial(amount, self.target_index.total / total)
+        target_slots, target_offsets = self.target_index.sample(from_targets)
+        move_slots, move_offsets = self.move_index.sample(amount - from_targets)
+        slots = np.concatenate((target_slots, move_slots))
+        offsets = np.concatenate((target_offsets, move_offsets))
+        rows = self.slot_rows[slots] + offsets
+        if self.store is None:
+            rows %= self.position_capacity
+            inputs, policies = self.inputs[rows], self.policies[rows]
+            z_values, q_values = self.z_values[rows], self.q_values[rows]
+        else:
+            inputs, policies, z_values, q_values = self.store.read(rows)
+        values = value_target(self.val_type, z_values, q_values, training_step)
+        return inputs.astype(np.float32), policies, values
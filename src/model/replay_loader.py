@@ -0,0 +1,68 @@
+"""
+replay_loader: Loads saved games (see ReplayStorage.save_replay) back into
+the replay buffer when resuming training. Files are unpickled and encoded
+for the buffer in a pool of processes, in batches, while the caller adds
+the encoded games to the buffer as they arrive.
+"""
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from model.replay_buffer import EncodedGame
+from model.replay_writer import read_chunk, CHUNK_EXTENSION
+
+def encode_replay_files(file_names):
+    """
+    Returns the games in the given game files or chunk files, encoded
+    for the replay buffer. Runs in the processes of load_replay_files.
+    """
+    encoded = []
+    for file_name in file_names:
+        if file_name.endswith(CHUNK_EXTENSION):
+            games = read_chunk(file_name)
+        else:
+            with open(file_name, "rb") as open_file:
+                games = [pickle.load(open_file)]
+        encoded.extend(EncodedGame(game) for game in games)
+    return encoded
+
+def load_replay_files(file_names, max_games, add_game, workers=1, batch_size=32, progress=None):
+    """
+    Encode the games in 'file_names', in order, and call 'add_game' with each
+    encoded game, until 'max_games' games have been added. Files are split in
+    batches of 'batch_size', which are encoded by 'workers' processes.
+    'progress' is called with the amount of games added after each batch.
+    Returns the amount of games added.
+    """
+    batches = [file_names[i:i+batch_size] for i in range(0, len(file_names), batch_size)]
+    added = 0
+    if workers <= 1:
+        for batch in batches:
+            added = add_games(encode_replay_files(batch), max_games, added, add_game, progress)
+            if added >= max_games:
+                break
+        return added
+
+    # Processes are spawned, not forked, as the loading process
+    # may have other threads running (and TensorFlow loaded).
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as pool:
+        # Only a few batches are queued ahead of the one being added,
+        # so no more files than needed are read when 'max_games' is reached.
+        pending = [pool.submit(encode_replay_files, batch) for batch in batches[:workers * 2]]
+        submitted = len(pending)
+        while pending and added < max_games:
+            encoded = pending.pop(0).result()
+            if submitted < len(batches):
+                pending.append(pool.submit(encode_replay_files, batches[submitted]))
+                submitted += 1
+            added = add_games(encoded, max_games, added, add_game, progress)
+        for future in pending:
+            future.cancel()
+    return added
+
+def add_games(encoded, max_games, added, add_game, progress):
+    for encoded_game in encoded[:max_games - added]:
+        add_game(encoded_game)
+        added += 1
+    if progress is not None:
+        progress(added)
+    return added
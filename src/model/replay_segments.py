@@ -0,0 +1,145 @@
+"""
+replay_segments: Append-only on-disk store of encoded training positions.
+Positions are fixed-size records in raw segment files, read through np.memmap,
+with a small index of the games they belong to. Used as the position store
+of a ReplayBuffer, when the buffer should not be limited by memory, and should be
+resumable without unpickling games.
+"""
+import os
+import pickle
+import numpy as np
+
+# One entry per game in the index: first position row, amount of positions,
+# whether the positions are training targets, and the training step the game was saved at.
+INDEX_DTYPE = np.dtype([("row", np.int64), ("length", np.int32),
+                        ("has_targets", np.bool_), ("step", np.int32)])
+
+class SegmentStore:
+    """
+    Positions are numbered by global rows. Row 'r' is record r % segment_size
+    of segment file r // segment_size. Segment files are created at full size,
+    and written to and read from through np.memmap, so only the pages in use
+    are kept in memory.
+    Files in 'folder': meta.bin (record layout), index.bin (INDEX_DTYPE entries)
+    and segment_XXXXXX.bin (records).
+    """
+    def __init__(self, folder, segment_size=100000):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.record_dtype = None
+        self.val_type = "z"
+        self.segments = {} # Segment number -> memmap.
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.new_entries = [] # Index entries added since the index was last combined.
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        if os.path.exists(self.path("meta.bin")):
+            with open(self.path("meta.bin"), "rb") as meta_file:
+                meta = pickle.load(meta_file)
+            self.segment_size = meta["segment_size"]
+            self.val_type = meta["val_type"]
+            self.record_dtype = record_dtype(meta["input_shape"], meta["policy_shape"])
+            self.index = np.fromfile(self.path("index.bin"), dtype=INDEX_DTYPE)
+        last = self.index[-1] if len(self.index) else None
+        self.rows = 0 if last is None else int(last["row"]) + int(last["length"])
+
+    def path(self, file_name):
+        return os.path.join(self.folder, file_name)
+
+    def write_meta(self, encoded):
+        self.record_dtype = record_dtype(encoded.inputs.shape[1:], encoded.policies.shape[1:])
+        self.val_type = encoded.val_type
+        meta = {"segment_size": self.segment_size, "val_type": self.val_type,
+                "input_shape": encoded.inputs.shape[1:], "policy_shape": encoded.policies.shape[1:]}
+        with open(self.path("meta.bin"), "wb") as meta_file:
+            pickle.dump(meta, meta_file)
+
+    def segment(self, number):
+        """
+        Returns the memmap of the given segment, creating its file if needed.
+        """
+        segment = self.segments.get(number)
+        if segment is None:
+            file_name = self.path("segment_{:06d}.bin".format(number))
+            mode = "r+" if os.path.exists(file_name) else "w+"
+            segment = np.memmap(file_name, dtype=self.record_dtype, mode=mode, shape=(self.segment_size,))
+            self.segments[number] = segment
+        return segment
+
+    def append(self, encoded, step=0):
+        """
+        Write the positions of an encoded game (see replay_buffer.EncodedGame)
+        to the end of the store, and add it to the index.
+        Returns the row of its first position.
+        """
+        if self.record_dtype is None:
+            self.write_meta(encoded)
+        first_row = self.rows
+        records = np.zeros(len(encoded), dtype=self.record_dtype)
+        records["inputs"] = encoded.inputs
+        records["policy"] = encoded.policies
+        records["z"] = encoded.z_values
+        records["q"] = encoded.q_values
+        written = 0
+        while written < len(records):
+            number, offset = divmod(self.rows, self.segment_size)
+            amount = min(len(records) - written, self.segment_size - offset)
+            segment = self.segment(number)
+            segment[offset:offset+amount] = records[written:written+amount]
+            segment.flush()
+            written += amount
+            self.rows += amount
+        # The index is written last, so a game is only
+        # in the index once all its positions are on disk.
+        entry = np.array([(first_row, len(encoded), encoded.has_targets, step)], dtype=INDEX_DTYPE)
+        with open(self.path("index.bin"), "ab") as index_file:
+            index_file.write(entry.tobytes())
+        self.new_entries.append(entry)
+        return first_row
+
+    def read(self, rows):
+        """
+        Returns the input planes, policies, z and q values of the given rows.
+        """
+        records = np.empty(len(rows), dtype=self.record_dtype)
+        numbers, offsets = np.divmod(rows, self.segment_size)
+        for number in np.unique(numbers):
+            mask = numbers == number
+            records[mask] = self.segment(number)[offsets[mask]]
+        return records["inputs"], records["policy"], records["z"], records["q"]
+
+    def entries(self):
+        """
+        Returns the index entries of all games in the store.
+        """
+        if self.new_entries:
+            self.index = np.concatenate([self.index] + self.new_entries)
+            self.new_entries = []
+        return self.index
+
+    def latest_games(self, amount, step=None):
+        """
+        Returns the index entries of the latest 'amount' games,
+        saved at or before training step 'step', if given.
+        """
+        index = self.entries()
+        if step is not None:
+            index = index[index["step"] <= step]
+        return index[-amount:] if amount else index[:0]
+
+    def last_step(self):
+        """
+        Returns the training step of the latest game in the store.
+        """
+        index = self.entries()
+        return int(index["step"].max()) if len(index) else 0
+
+    def nbytes(self):
+        """
+        Size of the position records on disk, in bytes.
+        """
+        return self.rows * self.record_dtype.itemsize if self.record_dtype else 0
+
+def record_dtype(input_shape, policy_shape):
+    return np.dtype([("inputs", np.uint8, tuple(input_shape)), ("policy", np.float32, tuple(policy_shape)),
+                     ("z", np.float32), ("q", np.float32)])
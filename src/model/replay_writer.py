@@ -0,0 +1,134 @@
+"""
+replay_writer: Background thread that saves finished games to compressed,
+append-only chunk files, so the thread saving games never waits on disk I/O.
+"""
+import os
+import pickle
+import struct
+import zlib
+from glob import glob
+from queue import Queue, Empty
+from threading import Thread
+from time import time
+
+CHUNK_EXTENSION = ".chunk"
+# Each frame in a chunk file is the length of its data, followed
+# by a zlib compressed, pickled list of games.
+FRAME_HEADER = struct.Struct("<I")
+
+def write_frame(chunk_file, games):
+    data = zlib.compress(pickle.dumps(games), 6)
+    chunk_file.write(FRAME_HEADER.pack(len(data)))
+    chunk_file.write(data)
+
+def read_chunk(file_name):
+    """
+    Returns the games in the given chunk file. A frame cut off
+    at the end of the file (by a crash while writing) is skipped.
+    """
+    games = []
+    with open(file_name, "rb") as chunk_file:
+        while True:
+            header = chunk_file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            length = FRAME_HEADER.unpack(header)[0]
+            data = chunk_file.read(length)
+            if len(data) < length:
+                break
+            games.extend(pickle.loads(zlib.decompress(data)))
+    return games
+
+class ReplayWriter:
+    """
+    Games put in the queue are written by a background thread. Queued games are
+    taken in batches of up to 'batch_size', waiting at most 'max_delay' seconds
+    for a batch to fill, and each batch is written as one frame to the chunk file
+    of the folder of its training step. A new chunk file is started when the
+    current one is larger than 'chunk_size' bytes. Files are fsynced at most
+    every 'fsync_interval' seconds, and when closing.
+    """
+    def __init__(self, folder_name, batch_size, chunk_size, fsync_interval, max_delay=1):
+        self.folder_name = folder_name
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.fsync_interval = fsync_interval
+        self.max_delay = max_delay
+        self.queue = Queue()
+        self.chunks = {} # Folder -> (open chunk file, chunk number).
+        self.last_sync = time()
+        self.games_written = 0
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, game, step, game_type):
+        """
+        Queue a game to be saved under the given training step. Does not block.
+        """
+        self.queue.put((game, step, game_type))
+
+    def close(self):
+        """
+        Write the games still in the queue, sync and close all
+        files, and wait for the writer thread to exit.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time() + self.max_delay
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time(), 0)))
+                except Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            self.write_batch(batch)
+            if not running or time() - self.last_sync >= self.fsync_interval:
+                self.sync()
+        for chunk_file, _ in self.chunks.values():
+            chunk_file.close()
+
+    def write_batch(self, batch):
+        folders = {}
+        for game, step, game_type in batch:
+            folder = "{}{}/replays/NNv{}/".format(self.folder_name, game_type, step)
+            folders.setdefault(folder, []).append(game)
+        for folder, games in folders.items():
+            write_frame(self.chunk_file(folder), games)
+            self.games_written += len(games)
+
+    def chunk_file(self, folder):
+        """
+        Returns the open chunk file of the given folder,
+        starting a new one if there is none, or it is full.
+        """
+        chunk_file, number = self.chunks.get(folder, (None, None))
+        if chunk_file is not None and chunk_file.tell() < self.chunk_size:
+            return chunk_file
+        if chunk_file is None:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            # Only the first time a folder is used, are its files counted.
+            number = len(glob(folder + "*" + CHUNK_EXTENSION))
+        else:
+            self.sync_file(chunk_file)
+            chunk_file.close()
+            number += 1
+        chunk_file = open("{}chunk{:06d}{}".format(folder, number, CHUNK_EXTENSION), "ab")
+        self.chunks[folder] = (chunk_file, number)
+        return chunk_file
+
+    def sync_file(self, chunk_file):
+        chunk_file.flush()
+        os.fsync(chunk_file.fileno())
+
+    def sync(self):
+        for chunk_file, _ in self.chunks.values():
+            self.sync_file(chunk_file)
+        self.last_sync = time()
@@ -2,6 +2,13 @@ class State:
     board = []
     player = True
     pieces = []
+    hash_key = None
+    # Set by Game.actions, Game.terminal_test and Game.utility, the first time they are
+    # requested for the state. States must not be changed after these are set.
+    legal_actions = None
+    terminal = None
+    white_utility = None
+    packed_actions = None # Set by games that override Game.packed_actions.
 
     def __init__(self, board, player, pieces=None):
         self.board = board
@@ -10,6 +17,7 @@ class State:
         self.repetitions = [pieces]
         self.repetition_count = 0
         self.no_progress_count = 0
+        self.hash_key = None
 
     def change_piece(self, y, x, new_y, new_x):
         if new_y is None:
@@ -20,6 +28,16 @@ class State:
                     self.pieces[i] = (new_y, new_x)
                     break
 
+    def __getstate__(self):
+        """
+        Cached actions and results are not pickled with saved games,
+        as they are found again when needed.
+        """
+        state = self.__dict__.copy()
+        for key in ("legal_actions", "terminal", "white_utility", "packed_actions"):
+            state.pop(key, None)
+        return state
+
     def count_pieces(self):
         """
         Debug method for returning number of white
@@ -58,7 +76,7 @@ class Action:
         return self.source == other.source and self.dest == other.dest
 
     def __hash__(self):
-        return hash(str(self))
+        return hash((self.source, self.dest))
 
     def numeric(self):
         """
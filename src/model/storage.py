@@ -5,25 +5,42 @@ training and self-play, as well as replay buffers generated from self-play.
 from glob import glob
 import pickle
 import os
-import numpy as np
+from threading import Lock, RLock, Thread
+from time import time
 from keras.models import save_model, load_model, Model
-from model.neural import set_nn_config
+from model.neural import NeuralNetwork, set_nn_config
+from model.eval_cache import EvaluationCache
+from model.replay_buffer import ReplayBuffer, EncodedGame
+from model.replay_segments import SegmentStore
+from model.replay_writer import ReplayWriter, CHUNK_EXTENSION
+from model.replay_loader import load_replay_files
 from config import Config
 from util.sqlUtil import SqlUtil
 from util.timerUtil import TimerUtil
+from view.log import FancyLogger
 
 class ReplayStorage:
     """
     This class manages the saving/loading of replays from games.
     """
-    def __init__(self):
-        self.buffer = []
+    def __init__(self, folder=None):
+        """
+        If 'folder' is given, positions are stored on disk in that folder
+        (see Config.REPLAY_STORE), instead of in memory.
+        """
+        store = None if folder is None else SegmentStore(folder, Config.REPLAY_SEGMENT_SIZE)
+        self.buffer = ReplayBuffer(Config.MAX_GAME_STORAGE, store=store)
+        self.lock = Lock() # Games are saved and sampled from different threads.
+        self.writer = None # Started by the first call to save_replay.
 
     def save_game(self, game, training_step=0):
+        # Encode the positions of the game once, outside the lock.
+        self.save_encoded(EncodedGame(game), training_step)
+
+    def save_encoded(self, encoded, training_step=0):
         max_step = Config.MAX_GAME_STORAGE + (training_step * Config.MAX_GAME_GROWTH)
-        if len(self.buffer) >= max_step:
-            self.buffer.pop(0) # Remove oldest game.
-        self.buffer.append(game)
+        with self.lock:
+            self.buffer.append(encoded, max_step, training_step) # Removes oldest game, if full.
 
     def sample_batch(self, training_step=None):
         """
@@ -32,60 +49,34 @@ class ReplayStorage:
         the neural network and one with a corresponding list of
         expected outcomes of the game + move probability distribution.
         """
-        # Sum up how many moves were made during all games in the buffer.
-        move_sum = float(sum(len(g.history) for g in self.buffer))
-        # Draw random games, with each game weighed according to the amount
-        # of moves made in that game.
-        batch = np.random.choice(
-            self.buffer,
-            size=Config.BATCH_SIZE,
-            p=[len(g.history)/move_sum for g in self.buffer]
-        )
-        # Draw random state index values from all chosen games.
-        state_indices = [(g, np.random.randint(0, len(g.history))) for g in batch]
-        images = []
-        expected_outputs = [[], []]
-        # Create input/expected output data for neural network training.
-        for game, index in state_indices:
-            images.append(game.structure_data(game.history[index]))
-            target_value, policies = game.make_target(index, training_step)
-            target_policies = game.map_visits(policies)
-
-            expected_outputs[0].append(target_policies)
-            expected_outputs[1].append(target_value)
-
-        expected_outputs = [np.array(arr, dtype="float32") for arr in expected_outputs]
-        return np.array(images, dtype="float32"), expected_outputs
+        with self.lock:
+            # Draw random positions, uniformly from all moves to train on in the buffer
+            # (only moves flagged as training targets, see Config.PLAYOUT_CAP_RANDOMIZATION).
+            images, policies, values = self.buffer.sample(Config.BATCH_SIZE, training_step)
+        return images, [policies, values.astype("float32")]
 
     def full_buffer(self):
         return len(self.buffer) == Config.BATCH_SIZE
 
     def save_replay(self, game, step, game_type):
         """
-        serializes a game, and saves it to a file,
-        under the correct neural network version,
-        given by the step parameter.
+        Queue a game to be saved to disk, under the correct neural
+        network version, given by the step parameter. Games are written
+        in batches, to compressed chunk files, by a background thread
+        (see replay_writer.ReplayWriter), so this never waits on disk I/O.
         """
-        folder_name = "../resources/"
-        data_type = "/replays/"
-        version_nn = str(step)
-        folder_nn = "NNv" + version_nn + "/"
-        file_name = "game"
-        file_extension = ".bin"
-
-        number_of_files = (glob(folder_name + game_type + data_type + folder_nn + "*" + file_extension)).__len__()
-        game_number = number_of_files+1
+        if self.writer is None:
+            self.writer = ReplayWriter("../resources/", Config.REPLAY_WRITE_BATCH,
+                                       Config.REPLAY_CHUNK_SIZE, Config.REPLAY_FSYNC_INTERVAL)
+        self.writer.put(game, step, game_type)
 
-        if not os.path.exists((folder_name + game_type + data_type + folder_nn)):
-            os.makedirs((folder_name + game_type + data_type + folder_nn))
-
-        try:
-            new_file = open((folder_name + game_type + data_type + folder_nn + file_name + str(game_number) + file_extension), "xb")
-            pickle.dump(game, new_file)
-            new_file.close()
-            print("game was saved to file")
-        except IOError:
-            print("something went wrong, when trying to save a replay")
+    def close(self):
+        """
+        Wait for the games queued by save_replay to be written to disk.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
     def load_replay(self, step, game_type):
         """
@@ -94,7 +85,18 @@ class ReplayStorage:
         is less than the constant MAX_GAME_STORAGE,
         it then loads the games directly into the buffer.
         The "step" parameter, defines the newest NN version we are interested in.
+        Games are unpickled and encoded by Config.REPLAY_LOAD_WORKERS processes
+        (see replay_loader.load_replay_files), and progress is shown by FancyLogger.
+        If positions are stored on disk (see Config.REPLAY_STORE), only the index of
+        the latest games is read, instead.
         """
+        if self.buffer.store is not None:
+            current_step = self.buffer.store.last_step() if step is None else step
+            max_games = Config.MAX_GAME_STORAGE + (current_step * Config.MAX_GAME_GROWTH)
+            with self.lock:
+                loaded = self.buffer.load_store(max_games, step)
+            FancyLogger.set_replay_status(f"{loaded} saved games were loaded from replay segments")
+            return
         folder_name = "../resources/"
         data_type = "/replays/"
         folder_nn_no_version = "NNv"
@@ -108,26 +110,35 @@ class ReplayStorage:
             else:
                 current_step = step
 
-            step_counter = current_step
             max_num_files = Config.MAX_GAME_STORAGE + (current_step * Config.MAX_GAME_GROWTH)
-            file_counter = 0
-            while step_counter >= 0 and file_counter < max_num_files:
-                file_list = glob(folders[step_counter] + "/" + "*" + file_extension)
-
-                for f in file_list:
-                    if file_counter < max_num_files:
-                        open_file = open(f, "rb")
-                        game = pickle.load(open_file)
-                        self.buffer.append(game)
-                        file_counter += 1
-                        open_file.close()
-                    else:
-                        break
-                step_counter -= 1
-            print(f"{file_counter} saved games were loaded from files")
+            file_list = []
+            for step_counter in range(current_step, -1, -1):
+                file_list.extend(glob(folders[step_counter] + "/" + "*" + file_extension))
+                # Games saved by replay_writer.ReplayWriter, many to each chunk file.
+                file_list.extend(sorted(glob(folders[step_counter] + "/" + "*" + CHUNK_EXTENSION)))
+
+            time_started = time()
+            def progress(loaded):
+                FancyLogger.set_replay_status(
+                    f"Loading saved games: {loaded}/{max_num_files} ({time() - time_started:.1f} s)")
+            file_counter = load_replay_files(file_list, max_num_files,
+                                             lambda encoded: self.save_encoded(encoded, current_step),
+                                             min(Config.REPLAY_LOAD_WORKERS, os.cpu_count() or 1),
+                                             progress=progress)
+            FancyLogger.set_replay_status(
+                f"{file_counter} saved games were loaded from files in {time() - time_started:.1f} s")
         except IOError:
             print("something went wrong when trying to load games into buffer")
 
+    def load_replay_background(self, step, game_type):
+        """
+        Run load_replay in a separate thread, so self-play and
+        training can start while the buffer is filling.
+        """
+        loader = Thread(target=self.load_replay, args=(step, game_type), daemon=True)
+        loader.start()
+        return loader
+
     def get_replay_count(self, game_type):
         """
         Method for counting the amount of saved games on disk.
@@ -159,13 +170,13 @@ class ReplayStorage:
             game = g[0]
             if game is not None:
                 unpickledGame = pickle.loads(game)
-                self.buffer.append(unpickledGame)
+                self.save_game(unpickledGame)
 
         print("Games selected from sql database table, and inserted into replay_buffer")
 
 
     def __str__(self):
-        return "<ReplayStorage: {} games, total length of games: {}>".format(len(self.buffer), sum(len(g.history) for g in self.buffer))
+        return "<ReplayStorage: {} games, {} positions to train on>".format(len(self.buffer), self.buffer.rows_used)
 
 class NetworkStorage:
     """
@@ -177,13 +188,46 @@ class NetworkStorage:
         self.networks = {}
         self.macro_steps = []
         self.curr_step = 0
+        self.eval_cache = EvaluationCache(Config.EVAL_CACHE_SIZE)
+        # Held while evaluating, and while publishing new networks from the trainer thread.
+        self.lock = RLock()
+        self.inference_model = None # Model that published weights are copied into.
 
     def latest_network(self):
-        return self.networks[self.curr_step]
+        with self.lock:
+            return self.networks[self.curr_step]
+
+    def generation(self, step):
+        """
+        Returns the training step of the network that 'step' refers to
+        (-1 means the latest network).
+        """
+        return step if step != -1 else self.curr_step
 
     def get_network(self, step):
-        network_id = step if step != -1 else self.curr_step
-        return self.networks[network_id]
+        with self.lock:
+            return self.networks[self.generation(step)]
+
+    def publish_weights(self, step, network):
+        """
+        Copy the weights of 'network', trained in the trainer thread, into the
+        model used for evaluation, and save it as the network of the given step.
+        Happens atomically, so no evaluation sees half updated weights.
+        Returns the published network.
+        """
+        weights = network.model.get_weights()
+        with self.lock:
+            if self.inference_model is None:
+                latest = self.latest_network()
+                if self.curr_step in self.macro_steps:
+                    # Macro networks keep their weights, use a copy.
+                    self.inference_model = latest.copy_model(latest.game)
+                else:
+                    self.inference_model = latest.model
+            self.inference_model.set_weights(weights)
+            published = NeuralNetwork(network.game, self.inference_model)
+            self.save_network(step, published)
+        return published
 
     def remove_network(self, step):
         new_dict = dict()
@@ -216,6 +260,8 @@ class NetworkStorage:
             # Copy all networks, but the oldest.
             self.remove_network(lowest_step)
         self.curr_step = step
+        # Evaluations cached from earlier generations are no longer wanted.
+        self.eval_cache.invalidate()
 
     def save_network_to_file(self, step, network, game_type):
         """
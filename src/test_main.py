@@ -23,14 +23,16 @@ MODULES = {"latrunculi": test_latrunculi,
            "misc": test_misc,
            "chess": test_chess}
 
-if len(argv) == 1:
-    for mod in MODULES:
-        print("{}-=-=-=- {} GAME TESTS -=-=-=-{}".format(YELLOW, mod.upper(), RESET))
-        MODULES[mod].run_tests()
-else:
-    MODULES[argv[1]].run_tests()
+# Guarded, as tests that use process pools spawn processes that import this module.
+if __name__ == "__main__":
+    if len(argv) == 1:
+        for mod in MODULES:
+            print("{}-=-=-=- {} GAME TESTS -=-=-=-{}".format(YELLOW, mod.upper(), RESET))
+            MODULES[mod].run_tests()
+    else:
+        MODULES[argv[1]].run_tests()
 
-print("===============================================")
-print("Tests Run: {}".format(assertion.PASSED + assertion.FAILED))
-print("{}Passed: {}".format(GREEN, assertion.PASSED))
-print("{}Failed: {}{}".format(RED, assertion.FAILED, RESET))
+    print("===============================================")
+    print("Tests Run: {}".format(assertion.PASSED + assertion.FAILED))
+    print("{}Passed: {}".format(GREEN, assertion.PASSED))
+    print("{}Failed: {}{}".format(RED, assertion.FAILED, RESET))
@@ -0,0 +1,16 @@
+from sys import argv
+from testing.performance import BENCHMARKS
+
+YELLOW = "\033[0;33;40m"
+RESET = "\033[0;37;40m"
+
+if __name__ == "__main__":
+    # Usage: python test_performance.py [benchmark] [game] [board_size]
+    names = [argv[1]] if len(argv) > 1 else list(BENCHMARKS)
+    args = [argv[2]] if len(argv) > 2 else []
+    if len(argv) > 3:
+        args.append(int(argv[3]))
+
+    for name in names:
+        print("{}-=-=-=- {} BENCHMARK -=-=-=-{}".format(YELLOW, name.upper(), RESET))
+        BENCHMARKS[name](*args)
@@ -0,0 +1,96 @@
+"""
+---------------------------------------------------------------------
+helpers: Small helpers shared by the tests and the benchmarks
+(testing/performance.py). Only depends on NumPy, the games and the model.
+---------------------------------------------------------------------
+"""
+from time import sleep
+import numpy as np
+from controller.chess import actions_fast
+from controller.connect_four import Connect_Four
+from model.state import Action
+
+class FakeConnection:
+    """
+    Stands in for the pipe to the monitor process. Answers
+    'evaluate' requests with random policies and values.
+    """
+    def __init__(self, game, latency=0):
+        self.policy_shape = game.map_visits({}).shape
+        self.latency = latency # Simulated pipe + network delay per round trip.
+        self.last_request = None
+        self.evaluations = 0
+        self.round_trips = 0
+        self.batch_sizes = []
+        self.games_received = 0
+
+    def send(self, data):
+        self.last_request = data
+
+    def recv(self):
+        status, data = self.last_request
+        if status == "game_over":
+            self.games_received += len(data)
+        if status != "evaluate":
+            return None
+        self.round_trips += 1
+        self.evaluations += len(data)
+        self.batch_sizes.append(len(data))
+        if self.latency:
+            sleep(self.latency)
+        policies = np.random.normal(0, 1, (len(data),) + self.policy_shape).astype("float32")
+        values = np.random.uniform(-1, 1, len(data)).astype("float32")
+        return policies, values
+
+def buffer_game(moves, value=None):
+    """
+    A finished 4x4 Connect Four game of 'moves' positions, for replay buffer tests.
+    Every move is a training target, with a policy target on column 'moves' - 1,
+    and a q-value of 'value' (the amount of moves, by default), which identifies
+    the game of a sampled position.
+    """
+    game = Connect_Four(4)
+    game.history = [game.start_state()] * moves
+    game.visit_counts = [{Action(None, (0, moves - 1)): 1}] * moves
+    game.training_targets = [True] * moves
+    game.q_value_history = [moves if value is None else value] * moves
+    game.val_type = "q"
+    return game
+
+def perft(game, state, depth):
+    """
+    Count the positions reached after 'depth' moves (passes included) from 'state'.
+    Games that are over before then count as one position. Each action is
+    counted once, even if 'actions' returns it more than once.
+    """
+    if depth == 0 or game.terminal_test(state):
+        return 1
+    # Actions are told apart by squares, hashing Action objects is slow.
+    actions = {(a.source, a.dest) if a else None: a for a in game.actions(state)}.values()
+    if depth == 1:
+        return len(actions)
+    return sum(perft(game, game.result(state, action), depth - 1) for action in actions)
+
+# Chess positions, and their known perft node counts at different depths.
+# Only depths without en passant captures or under-promotions, which Chess does not
+# support, are listed. Positions are from the Chess Programming Wiki's perft results.
+PERFT_POSITIONS = [
+    ("Start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq -", {1: 48}),
+    ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -", {1: 14, 2: 191}),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", {1: 6}),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890})
+]
+
+def chess_perft(game, state, depth, legal_actions=actions_fast):
+    """
+    Count the positions reached after 'depth' moves from 'state', with moves
+    generated by 'legal_actions'. Positions with no legal moves have no children.
+    """
+    player = 1 if state.player else -1
+    actions = legal_actions(state.pieces, state.board, player, game.size)
+    if depth == 1:
+        return len(actions)
+    return sum(chess_perft(game, game.result(state, Action((y1, x1), (y2, x2))), depth - 1, legal_actions)
+               for y1, x1, y2, x2 in actions)
@@ -0,0 +1,1085 @@
+"""
+---------------------------------------------------------------------
+performance: Benchmarks for comparing implementations of the hot paths
+in self-play. Network evaluations are faked with random policies, so
+these can run without a (trained) neural network.
+---------------------------------------------------------------------
+"""
+import gc
+import os
+import sys
+import pickle
+from glob import glob
+import shutil
+import tempfile
+import tracemalloc
+from multiprocessing import Process, Pipe
+from time import time
+import numpy as np
+from numba import jit
+from config import Config
+from controller import self_play
+from controller.game import Game
+from controller.mcts import MCTS, Node, ArrayTree, select_leaf, EXPLORE_VAL
+from controller.eval_transport import EvaluationSlabs, SharedConnection
+from controller.chess import Chess, calculate_actions, find_piece, actions_fast
+from controller.latrunculi import (Latrunculi, legal_moves, check_for_capture_and_suicide_west_or_east_of_given_piece_bool,
+                                   check_for_capture_and_suicide_north_or_south_of_given_piece_bool)
+from model.state import Action
+from model.replay_buffer import ReplayBuffer, EncodedGame
+from model.replay_segments import SegmentStore
+from model.replay_writer import ReplayWriter
+from model.replay_loader import load_replay_files
+from testing.helpers import FakeConnection, perft, chess_perft, PERFT_POSITIONS
+
+def create_batch(game_name, size, num_games):
+    """
+    Create batch data, as used in self_play.play_games,
+    with 'num_games' games of MCTS vs. MCTS.
+    """
+    game = self_play.get_game(game_name, size, "random")
+    batch_data = []
+    for _ in range(num_games):
+        g = game.clone()
+        p1 = self_play.get_ai_algorithm("MCTS", g)
+        p2 = self_play.get_ai_algorithm("MCTS", g)
+        p1.set_config(Config)
+        p2.set_config(Config)
+        batch_data.append([g, g.start_state(), p1, p2])
+    return game, batch_data
+
+def count_nodes(player, root):
+    """
+    Count the nodes in the tree below (and including) 'root'.
+    """
+    if player.tree is not None:
+        return player.tree.size
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children.values())
+    return count
+
+def mcts_tree(game_name="Othello", size=8, num_games=20, iterations=200):
+    """
+    Compare nodes per second and memory use of the
+    'nodes' and 'arrays' MCTS tree stores (Config.MCTS_TREE).
+    """
+    old_tree, old_iterations = Config.MCTS_TREE, Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    results = {}
+    for tree_type in ("nodes", "arrays"):
+        Config.MCTS_TREE = tree_type
+        game, batch_data = create_batch(game_name, size, num_games)
+        connection = FakeConnection(game)
+        self_play.play_as_mcts(batch_data, None, Config, connection) # Warm up jit.
+
+        tracemalloc.start()
+        time_b = time()
+        roots = self_play.play_as_mcts(batch_data, None, Config, connection)
+        time_taken = time() - time_b
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        nodes = sum(count_nodes(data[2], root) for data, root in zip(batch_data, roots))
+        results[tree_type] = (nodes / time_taken, peak_memory)
+        print("{}: {} nodes in {:.3f} s. {:.0f} nodes/s. Peak memory: {:.2f} MB".format(
+            tree_type, nodes, time_taken, nodes / time_taken, peak_memory / (1024 * 1024)))
+    Config.MCTS_TREE, Config.MCTS_ITERATIONS = old_tree, old_iterations
+    return results
+
+def time_per_call(func, repeats):
+    time_b = time()
+    for _ in range(repeats):
+        func()
+    return (time() - time_b) / repeats
+
+def puct_scores(q_values, prior_probs, visits, parent_sqrt):
+    """
+    PUCT scores (see MCTS.puct_score) for arrays of
+    q-values, priors and visit counts, in one NumPy expression.
+    """
+    return q_values + EXPLORE_VAL * prior_probs * parent_sqrt / (1 + visits)
+
+def puct_selection(game_name="Latrunculi", size=8, repeats=20000):
+    """
+    Micro-benchmark of choosing the child with the highest PUCT score,
+    using the lambda-based 'max' over Node objects, a single NumPy
+    expression over contiguous arrays, and the numba kernel used by ArrayTree.
+    """
+    game = self_play.get_game(game_name, size, "random")
+    mcts = MCTS(game)
+    state = game.start_state()
+    results = {}
+    for num_children in (8, 20, 40, 80):
+        priors = np.random.dirichlet([0.3] * num_children)
+        visits = np.random.randint(0, 20, num_children)
+        q_values = np.random.uniform(-1, 1, num_children)
+        parent_sqrt = np.sqrt(visits.sum())
+
+        root = Node(state, None)
+        for i in range(num_children):
+            child = Node(state, i, priors[i], root)
+            child.visits = int(visits[i])
+            child.q_value = float(q_values[i])
+            root.children[i] = child
+        root.visits = int(visits.sum())
+
+        tree = ArrayTree(num_children + 1)
+        tree.add_root(state)
+        tree.add_children(0, list(range(num_children)), priors, [state] * num_children)
+        tree.visits[0] = visits.sum()
+        tree.visits[1:] = visits
+        tree.q_value[1:] = q_values
+        select_leaf(tree.first_child, tree.num_children, tree.visits,
+                    tree.q_value, tree.prior_prob, 0, EXPLORE_VAL) # Warm up jit.
+
+        time_lambda = time_per_call(
+            lambda: max(root.children.values(), key=lambda n: mcts.puct_score(n, parent_sqrt)), repeats)
+        time_numpy = time_per_call(
+            lambda: np.argmax(puct_scores(q_values, priors, visits, parent_sqrt)), repeats)
+        time_numba = time_per_call(
+            lambda: select_leaf(tree.first_child, tree.num_children, tree.visits,
+                                tree.q_value, tree.prior_prob, 0, EXPLORE_VAL), repeats)
+        results[num_children] = (time_lambda, time_numpy, time_numba)
+        print("{} children: lambda {:.2f} us, numpy {:.2f} us, numba {:.2f} us".format(
+            num_children, time_lambda * 1e6, time_numpy * 1e6, time_numba * 1e6))
+    return results
+
+def virtual_loss(game_name="Othello", size=8, num_games=20, moves=3, latency=0.002):
+    """
+    Compare moves per second in batched self-play for different amounts
+    of leaves selected per tree in each evaluation round (MCTS_LEAVES_PER_ROUND).
+    'latency' simulates the time of one round trip to the monitor process.
+    """
+    old_leaves = Config.MCTS_LEAVES_PER_ROUND
+    results = {}
+    for leaves in (1, 2, 4, 8):
+        Config.MCTS_LEAVES_PER_ROUND = leaves
+        game, batch_data = create_batch(game_name, size, num_games)
+        connection = FakeConnection(game, latency)
+        time_b = time()
+        for _ in range(moves):
+            roots = self_play.play_as_mcts(batch_data, None, Config, connection)
+            for i, data in enumerate(batch_data):
+                data[1] = self_play.get_player(data).execute_action(roots[i])
+        time_taken = time() - time_b
+        moves_per_sec = (num_games * moves) / time_taken
+        avg_batch = connection.evaluations / connection.round_trips
+        results[leaves] = moves_per_sec
+        print("{} leaves per round: {:.2f} moves/s. {} round trips, avg. batch size {:.1f}".format(
+            leaves, moves_per_sec, connection.round_trips, avg_batch))
+    Config.MCTS_LEAVES_PER_ROUND = old_leaves
+    return results
+
+def transpositions(game_name="Connect_Four", size=6, num_games=6, iterations=100):
+    """
+    Compare network evaluations and time per game in self-play
+    with and without the MCTS transposition table (MCTS_TRANSPOSITIONS).
+    """
+    old_transpositions, old_iterations = Config.MCTS_TRANSPOSITIONS, Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    results = {}
+    for enabled in (False, True):
+        Config.MCTS_TRANSPOSITIONS = enabled
+        game, batch_data = create_batch(game_name, size, num_games)
+        connection = FakeConnection(game)
+        games = [data[0] for data in batch_data]
+        time_b = time()
+        self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                             Config, connection=connection)
+        time_taken = time() - time_b
+        lookups, hits = self_play.transposition_hits(batch_data)
+        results[enabled] = (connection.evaluations / num_games, hits / lookups if lookups else 0)
+        print("Transpositions {}: {:.0f} evaluations per game. Hit rate: {:.1%}. {:.3f} s per game".format(
+            "on" if enabled else "off", connection.evaluations / num_games,
+            results[enabled][1], time_taken / num_games))
+    Config.MCTS_TRANSPOSITIONS, Config.MCTS_ITERATIONS = old_transpositions, old_iterations
+    return results
+
+def recursive_select(mcts, node):
+    """
+    Recursive selection, as MCTS did before it walked the tree iteratively.
+    """
+    if node.children == {}:
+        return node
+    parent_sqrt = np.sqrt(node.visits)
+    best_node = max(node.children.values(), key=lambda n: mcts.puct_score(n, parent_sqrt))
+    return recursive_select(mcts, best_node)
+
+def recursive_back_propagate(node, player, value):
+    """
+    Recursive backpropagation, following parent pointers.
+    """
+    node.visits += 1
+    node.value += value if node.state.player == player else -value
+    node.q_value = node.value / node.visits
+    if node.parent is not None:
+        recursive_back_propagate(node.parent, player, value)
+
+def create_deep_tree(game, mcts, depth, branching=2):
+    """
+    Create a tree of Nodes where one line of play reaches
+    the given depth, each node on it having 'branching' children.
+    """
+    state = game.start_state()
+    root = Node(state, None)
+    root.visits = 1
+    node = root
+    for _ in range(depth):
+        for i in range(branching):
+            child = Node(state, i, 1 / branching, node)
+            node.children[i] = child
+        node = node.children[0]
+        # Give the line of play a high value, so selection keeps following it.
+        node.visits = 1
+        node.value = node.q_value = 1e9
+    return root
+
+def tree_depth(game_name="Latrunculi", size=8, repeats=200):
+    """
+    Compare time per simulation (selection + backpropagation) of the
+    recursive and the iterative (path recording) implementations,
+    at different tree depths.
+    """
+    game = self_play.get_game(game_name, size, "random")
+    mcts = MCTS(game)
+    mcts.set_tree_type("nodes")
+    results = {}
+    for depth in (10, 50, 250, 1000, 5000):
+        root = create_deep_tree(game, mcts, depth)
+
+        def recursive():
+            leaf = recursive_select(mcts, root)
+            recursive_back_propagate(leaf, True, 0)
+
+        def iterative():
+            leaf = mcts.select(root)
+            mcts.back_propagate(leaf, True, 0, mcts.path)
+
+        try:
+            time_recursive = time_per_call(recursive, repeats)
+            recursive_str = "{:.1f} us".format(time_recursive * 1e6)
+        except RecursionError:
+            time_recursive = None
+            recursive_str = "recursion limit hit"
+        time_iterative = time_per_call(iterative, repeats)
+        results[depth] = (time_recursive, time_iterative)
+        print("Depth {}: recursive {}, iterative {:.1f} us per simulation".format(
+            depth, recursive_str, time_iterative * 1e6))
+    return results
+
+def search_budget(game_name="Connect_Four", size=6, num_games=6, iterations=200):
+    """
+    Compare simulations and time per move in self-play with a fixed amount
+    of simulations, with early stopping (MCTS_EARLY_STOP), and with a time budget.
+    """
+    old_values = Config.MCTS_EARLY_STOP, Config.MCTS_TIME_BUDGET, Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    results = {}
+    for name, early_stop, time_budget in (("Fixed", False, 0), ("Early stop", True, 0),
+                                          ("Time budget 0.05 s", False, 0.05)):
+        Config.MCTS_EARLY_STOP, Config.MCTS_TIME_BUDGET = early_stop, time_budget
+        game, batch_data = create_batch(game_name, size, num_games)
+        connection = FakeConnection(game)
+        games = [data[0] for data in batch_data]
+        time_b = time()
+        self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                             Config, connection=connection)
+        time_taken = time() - time_b
+        saved, moves = self_play.simulations_saved(batch_data)
+        results[name] = (iterations - saved / moves, time_taken / moves)
+        print("{}: {:.1f} simulations per move, {:.1f} saved. {:.2f} ms per move".format(
+            name, iterations - saved / moves, saved / moves, time_taken / moves * 1000))
+    Config.MCTS_EARLY_STOP, Config.MCTS_TIME_BUDGET, Config.MCTS_ITERATIONS = old_values
+    return results
+
+def continuous_self_play(game_name="Connect_Four", size=6, num_games=12, iterations=30, latency=0.002):
+    """
+    Compare the size of evaluation batches sent by a self-play process that plays
+    its games in rounds, and one that replaces finished games right away
+    (CONTINUOUS_SELF_PLAY). Each process plays two games per slot.
+    """
+    old_values = Config.CONTINUOUS_SELF_PLAY, Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS
+    Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS = 2, iterations
+    results = {}
+    for name, continuous in (("Rounds", False), ("Continuous", True)):
+        Config.CONTINUOUS_SELF_PLAY = continuous
+        game, batch_data = create_batch(game_name, size, num_games)
+        connection = FakeConnection(game, latency)
+        time_b = time()
+        self_play.SelfPlayWorker([data[0] for data in batch_data], [data[2] for data in batch_data],
+                                 [data[3] for data in batch_data], config=Config, connection=connection).run()
+        time_taken = time() - time_b
+        sizes = np.array(connection.batch_sizes)
+        small = np.count_nonzero(sizes < num_games / 2) / len(sizes)
+        results[name] = (sizes.mean(), time_taken / connection.games_received)
+        print("{}: {} games, {} round trips, {:.1f} avg. batch size, {:.1%} under half full. {:.3f} s per game".format(
+            name, connection.games_received, len(sizes), sizes.mean(), small,
+            time_taken / connection.games_received))
+    Config.CONTINUOUS_SELF_PLAY, Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS = old_values
+    return results
+
+def stack_depth():
+    frame = sys._getframe()
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+def recursive_play_loop(games, p1s, p2s, iteration, connection, on_batch):
+    """
+    The recursive self-play loop that SelfPlayWorker replaced, for comparison.
+    Calls 'on_batch' after each batch of games.
+    """
+    if iteration == Config.GAME_ITERATIONS:
+        return
+    self_play.play_games(games, p1s, p2s, Config, connection=connection)
+    clones = []
+    for game in games:
+        clones.append(game.clone())
+        game.reset()
+    connection.send(("game_over", clones))
+    connection.recv()
+    on_batch()
+    recursive_play_loop(games, p1s, p2s, iteration+1, connection, on_batch)
+
+class MeasuredWorker(self_play.SelfPlayWorker):
+    """
+    SelfPlayWorker that calls 'on_batch' after each batch of games.
+    """
+    def __init__(self, games, p1s, p2s, connection, on_batch):
+        super().__init__(games, p1s, p2s, config=Config, connection=connection)
+        self.on_batch = on_batch
+
+    def on_batch_finished(self, games, player):
+        super().on_batch_finished(games, player)
+        self.on_batch()
+
+def worker_memory(game_name="Connect_Four", size=4, num_games=3, batches=400, iterations=5):
+    """
+    Compare memory use and stack depth of the recursive self-play loop
+    and SelfPlayWorker, over many batches of games.
+    The recursive loop fails when the stack reaches the recursion limit.
+    """
+    old_values = Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS, Config.CONTINUOUS_SELF_PLAY
+    Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS, Config.CONTINUOUS_SELF_PLAY = batches, iterations, False
+    results = {}
+    for name in ("Recursive", "Worker"):
+        game, batch_data = create_batch(game_name, size, num_games)
+        games, p1s, p2s = [[data[i] for data in batch_data] for i in (0, 2, 3)]
+        connection = FakeConnection(game)
+        samples = []
+        def on_batch():
+            # Trees of the finished games are reference cycles, count only live memory.
+            gc.collect()
+            connection.batch_sizes.clear() # Not part of the self-play process.
+            samples.append((tracemalloc.get_traced_memory()[0], stack_depth()))
+
+        tracemalloc.start()
+        error = None
+        try:
+            if name == "Recursive":
+                recursive_play_loop(games, p1s, p2s, 0, connection, on_batch)
+            else:
+                MeasuredWorker(games, p1s, p2s, connection, on_batch).run()
+        except RecursionError as e:
+            error = e
+        tracemalloc.stop()
+
+        # Skip the first batches, where caches and trees are still warming up.
+        warm = min(len(samples) // 10, 20)
+        memory = [mem for mem, _ in samples]
+        growth = (memory[-1] - memory[warm]) / (len(samples) - 1 - warm)
+        results[name] = (len(samples), growth, samples[-1][1])
+        print("{}: {} batches{}. Memory after batch {}: {:.1f} KB, at the end: {:.1f} KB ({:.2f} KB per batch). Stack depth: {} -> {}".format(
+            name, len(samples), " (recursion limit reached)" if error else "", warm,
+            memory[warm] / 1024, memory[-1] / 1024, growth / 1024, samples[0][1], samples[-1][1]))
+    Config.GAME_ITERATIONS, Config.MCTS_ITERATIONS, Config.CONTINUOUS_SELF_PLAY = old_values
+    return results
+
+class ReplayGame:
+    """
+    Stands in for a finished game in the replay buffer,
+    with a history of 'moves' states, and tiny encoded positions.
+    """
+    training_targets = None
+    val_type = "z"
+
+    def __init__(self, moves):
+        self.history = [None] * moves
+        self.visit_counts = [{}] * moves
+        self.q_value_history = [0] * moves
+
+    def training_indices(self):
+        return list(range(len(self.history)))
+
+    def structure_data(self, state):
+        return np.zeros((1, 2, 2))
+
+    def map_visits(self, visits):
+        return np.zeros(4)
+
+    def z_value(self, state_index):
+        return 0
+
+def list_save_game(buffer, game, max_games):
+    """
+    How ReplayStorage saved games before ReplayBuffer, for comparison.
+    """
+    if len(buffer) >= max_games:
+        buffer.pop(0)
+    buffer.append(game)
+
+def list_sample(buffer, batch_size):
+    """
+    How ReplayStorage sampled moves before ReplayBuffer, for comparison.
+    """
+    indices = [g.training_indices() for g in buffer]
+    move_sum = float(sum(len(i) for i in indices))
+    batch = np.random.choice(len(buffer), size=batch_size, p=[len(i)/move_sum for i in indices])
+    return [(buffer[b], indices[b][np.random.randint(0, len(indices[b]))]) for b in batch]
+
+def replay_sampling(sizes=(1000, 10000, 100000), batch_size=512, repeats=20):
+    """
+    Compare the time to save a game in, and sample a batch of moves from,
+    a full replay buffer, as a Python list and as a ReplayBuffer.
+    """
+    results = {}
+    for size in sizes:
+        games = [ReplayGame(np.random.randint(10, 60)) for _ in range(size)]
+        list_buffer = list(games)
+        ring_buffer = ReplayBuffer(size)
+        for game in games:
+            ring_buffer.append(EncodedGame(game))
+        ring_buffer.sample(batch_size) # Compile.
+        encoded = EncodedGame(games[0])
+
+        time_list_save = time_per_call(lambda: list_save_game(list_buffer, games[0], size), repeats)
+        time_ring_save = time_per_call(lambda: ring_buffer.append(encoded), repeats)
+        time_list_sample = time_per_call(lambda: list_sample(list_buffer, batch_size), repeats)
+        time_ring_sample = time_per_call(lambda: ring_buffer.sample(batch_size), repeats)
+        results[size] = (time_list_save, time_ring_save, time_list_sample, time_ring_sample)
+        print("{} games: save list {:.1f} us, ring {:.1f} us. Sample {} moves: list {:.2f} ms, ring {:.2f} ms".format(
+            size, time_list_save * 1e6, time_ring_save * 1e6, batch_size,
+            time_list_sample * 1000, time_ring_sample * 1000))
+    return results
+
+def decode_batch(buffer, batch_size, training_step):
+    """
+    How ReplayStorage built a training batch from Game objects
+    before positions were encoded when saved, for comparison.
+    """
+    images = []
+    expected_outputs = [[], []]
+    for game, index in list_sample(buffer, batch_size):
+        images.append(game.structure_data(game.history[index]))
+        target_value, policies = game.make_target(index, training_step)
+        expected_outputs[0].append(game.map_visits(policies))
+        expected_outputs[1].append(target_value)
+    expected_outputs = [np.array(arr, dtype="float32") for arr in expected_outputs]
+    return np.array(images, dtype="float32"), expected_outputs
+
+def replay_encoding(game_name="Othello", size=8, num_games=12, iterations=10, batch_size=512, repeats=20):
+    """
+    Compare the time to build a training batch from the Game objects in the
+    replay buffer, and from positions encoded when the games were saved.
+    """
+    old_iterations = Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    game, batch_data = create_batch(game_name, size, num_games)
+    games = [data[0] for data in batch_data]
+    self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                         Config, connection=FakeConnection(game))
+    Config.MCTS_ITERATIONS = old_iterations
+    for g in games:
+        g.val_type = Config.TARGET_VAL
+
+    time_encode = time_per_call(lambda: [EncodedGame(g) for g in games], 1) / num_games
+    ring_buffer = ReplayBuffer(num_games)
+    for g in games:
+        ring_buffer.append(EncodedGame(g))
+    ring_buffer.sample(batch_size) # Compile.
+
+    time_decode = time_per_call(lambda: decode_batch(games, batch_size, 10), repeats)
+    time_sample = time_per_call(lambda: ring_buffer.sample(batch_size, 10), repeats)
+    print("{} positions in {} games. Encoding when saved: {:.2f} ms per game".format(
+        ring_buffer.rows_used, num_games, time_encode * 1000))
+    print("Batch of {}: from Game objects {:.2f} ms, from encoded positions {:.3f} ms".format(
+        batch_size, time_decode * 1000, time_sample * 1000))
+    return time_encode, time_decode, time_sample
+
+def random_encoded_game(moves, input_shape, policy_shape):
+    """
+    Returns an EncodedGame with 'moves' random positions.
+    """
+    encoded = EncodedGame.__new__(EncodedGame)
+    encoded.has_targets = True
+    encoded.inputs = np.random.randint(0, 2, (moves,) + input_shape).astype(np.uint8)
+    encoded.policies = np.random.random((moves,) + policy_shape).astype(np.float32)
+    encoded.z_values = np.random.choice([-1, 0, 1], moves).astype(np.float32)
+    encoded.q_values = np.random.uniform(-1, 1, moves).astype(np.float32)
+    encoded.val_type = "avg"
+    return encoded
+
+def replay_segments(positions=1000000, game_length=30, input_shape=(2, 6, 6), policy_shape=(36,),
+                    batch_size=512, repeats=20):
+    """
+    Write 'positions' random positions to a replay buffer in memory, and to one
+    stored in segment files, and compare memory use, sampling time, and the
+    time to resume the on-disk buffer after a restart.
+    """
+    num_games = positions // game_length
+    games = [random_encoded_game(game_length, input_shape, policy_shape) for _ in range(100)]
+    folder = tempfile.mkdtemp()
+    try:
+        memory_buffer = ReplayBuffer(num_games)
+        time_b = time()
+        for i in range(num_games):
+            memory_buffer.append(games[i % 100])
+        time_memory = (time() - time_b) / num_games
+        memory_bytes = sum(arr.nbytes for arr in (memory_buffer.inputs, memory_buffer.policies,
+                                                  memory_buffer.z_values, memory_buffer.q_values))
+        del memory_buffer
+
+        disk_buffer = ReplayBuffer(num_games, store=SegmentStore(folder))
+        time_b = time()
+        for i in range(num_games):
+            disk_buffer.append(games[i % 100])
+        time_disk = (time() - time_b) / num_games
+        print("Saving a game: memory {:.1f} us, segments {:.1f} us".format(time_memory * 1e6, time_disk * 1e6))
+        disk_buffer.sample(batch_size)
+
+        # Resume from disk, as after a restart.
+        ReplayBuffer(1, store=SegmentStore(folder)).load_store(1) # Compile.
+        time_b = time()
+        resumed = ReplayBuffer(num_games, store=SegmentStore(folder))
+        resumed.load_store(num_games)
+        time_resume = time() - time_b
+        del resumed
+        tracemalloc.start()
+        resumed = ReplayBuffer(num_games, store=SegmentStore(folder))
+        resumed.load_store(num_games)
+        resumed_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        time_sample = time_per_call(lambda: resumed.sample(batch_size), repeats)
+
+        print("{} positions in {} games. Position arrays in memory: {:.1f} MB, on disk: {:.1f} MB".format(
+            resumed.rows_used, len(resumed), memory_bytes / 1e6, resumed.store.nbytes() / 1e6))
+        print("Resuming from segments: {:.1f} ms, {:.2f} MB of memory. Sampling {} positions: {:.2f} ms".format(
+            time_resume * 1000, resumed_bytes / 1e6, batch_size, time_sample * 1000))
+        return time_resume, resumed_bytes, time_sample
+    finally:
+        shutil.rmtree(folder)
+
+def save_game_file(folder, game):
+    """
+    Save a game the way ReplayStorage.save_replay used to, numbering a new
+    file by the amount of files already in the folder, and pickling the game to it.
+    """
+    game_number = len(glob(folder + "*.bin")) + 1
+    with open(folder + "game" + str(game_number) + ".bin", "xb") as new_file:
+        pickle.dump(game, new_file)
+
+def replay_persistence(game_name="Othello", size=8, num_games=6, iterations=10, saves=3000):
+    """
+    Compare the time the monitor spends saving each finished game to disk ('-s'),
+    with one pickle file per game, and with the background ReplayWriter.
+    """
+    old_iterations = Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    game, batch_data = create_batch(game_name, size, num_games)
+    games = [data[0] for data in batch_data]
+    self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                         Config, connection=FakeConnection(game))
+    Config.MCTS_ITERATIONS = old_iterations
+
+    folder = tempfile.mkdtemp() + "/"
+    try:
+        step_folder = folder + game_name + "/replays/NNv0/"
+        os.makedirs(step_folder)
+        time_b = time()
+        for i in range(saves):
+            save_game_file(step_folder, games[i % num_games])
+        time_files = (time() - time_b) / saves
+        file_bytes = sum(os.path.getsize(f) for f in glob(step_folder + "*"))
+        print("One file per game: {:.1f} us per game on the monitor, {} files, {:.1f} MB".format(
+            time_files * 1e6, saves, file_bytes / 1e6))
+        shutil.rmtree(step_folder)
+
+        writer = ReplayWriter(folder, Config.REPLAY_WRITE_BATCH, Config.REPLAY_CHUNK_SIZE,
+                              Config.REPLAY_FSYNC_INTERVAL)
+        time_b = time()
+        for i in range(saves):
+            writer.put(games[i % num_games], 0, game_name)
+        time_put = (time() - time_b) / saves
+        writer.close()
+        time_total = (time() - time_b) / saves
+        chunks = glob(step_folder + "*")
+        chunk_bytes = sum(os.path.getsize(f) for f in chunks)
+        print("Background writer: {:.1f} us per game on the monitor ({:.1f} us until on disk), {} files, {:.1f} MB".format(
+            time_put * 1e6, time_total * 1e6, len(chunks), chunk_bytes / 1e6))
+        return time_files, time_put, time_total
+    finally:
+        shutil.rmtree(folder)
+
+def replay_loading(game_name="Othello", size=8, num_games=6, iterations=10, files=2000):
+    """
+    Compare the time to load saved games into the replay buffer when resuming,
+    one file after the other (as load_replay used to), and with load_replay_files,
+    using one and Config.REPLAY_LOAD_WORKERS processes.
+    """
+    old_iterations = Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    game, batch_data = create_batch(game_name, size, num_games)
+    games = [data[0] for data in batch_data]
+    self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                         Config, connection=FakeConnection(game))
+    Config.MCTS_ITERATIONS = old_iterations
+
+    folder = tempfile.mkdtemp() + "/"
+    try:
+        for i in range(files):
+            save_game_file(folder, games[i % num_games])
+        file_names = glob(folder + "*.bin")
+        buffer = ReplayBuffer(files)
+        time_b = time()
+        for file_name in file_names:
+            with open(file_name, "rb") as open_file:
+                buffer.append(EncodedGame(pickle.load(open_file)))
+        time_sequential = time() - time_b
+        results = {"sequential": time_sequential}
+        print("{} files, one after the other: {:.2f} s".format(files, time_sequential))
+        for workers in sorted({1, Config.REPLAY_LOAD_WORKERS}):
+            buffer = ReplayBuffer(files)
+            time_b = time()
+            load_replay_files(file_names, files, buffer.append, workers)
+            results[workers] = time() - time_b
+            print("{} files, {} worker process(es): {:.2f} s".format(files, workers, results[workers]))
+        return results
+    finally:
+        shutil.rmtree(folder)
+
+def engine_perft(game_name, size, depth, engine_option):
+    """
+    Compare perft (move generation, making moves, and terminal tests) with the
+    array and the bitboard engines of a game, selected with the config option 'engine_option'.
+    """
+    old_engine = getattr(Config, engine_option)
+    results = {}
+    for engine in ("array", "bitboard"):
+        setattr(Config, engine_option, engine)
+        game = self_play.get_game(game_name, size)
+        perft(game, game.start_state(), 2) # Compile.
+        time_b = time()
+        nodes = perft(game, game.start_state(), depth)
+        time_taken = time() - time_b
+        results[engine] = nodes, time_taken
+        print("{}: perft({}) = {} in {:.2f} s ({:.0f} positions/s)".format(
+            engine, depth, nodes, time_taken, nodes / time_taken))
+    setattr(Config, engine_option, old_engine)
+    return results
+
+def othello_perft(game_name="Othello", size=8, depth=8):
+    return engine_perft(game_name, size, depth, "OTHELLO_ENGINE")
+
+def connect_four_perft(game_name="Connect_Four", size=7, depth=7):
+    return engine_perft(game_name, size, depth, "CONNECT_FOUR_ENGINE")
+
+def connect_four_self_play(game_name="Connect_Four", size=7, playouts=2000, num_games=12, iterations=30):
+    """
+    Compare the array and the bitboard Connect Four engines (Config.CONNECT_FOUR_ENGINE)
+    in random playouts, and in self-play with MCTS, where terminal tests and
+    utilities are run for every expanded node.
+    """
+    old_values = Config.CONNECT_FOUR_ENGINE, Config.MCTS_ITERATIONS
+    Config.MCTS_ITERATIONS = iterations
+    results = {}
+    for engine in ("array", "bitboard"):
+        Config.CONNECT_FOUR_ENGINE = engine
+        game = self_play.get_game(game_name, size)
+        moves = 0
+        time_b = time()
+        for _ in range(playouts):
+            state = game.start_state()
+            while not game.terminal_test(state):
+                actions = game.actions(state)
+                state = game.result(state, actions[np.random.randint(len(actions))])
+                moves += 1
+            game.utility(state, True)
+        time_playouts = time() - time_b
+
+        game, batch_data = create_batch(game_name, size, num_games)
+        games = [data[0] for data in batch_data]
+        time_b = time()
+        self_play.play_games(games, [data[2] for data in batch_data], [data[3] for data in batch_data],
+                             Config, connection=FakeConnection(game))
+        time_self_play = time() - time_b
+        self_play_moves = sum(len(g.history) - 1 for g in games)
+        results[engine] = playouts / time_playouts, self_play_moves / time_self_play
+        print("{}: {:.0f} random playouts/s ({:.0f} moves/s). Self-play: {:.1f} moves/s".format(
+            engine, playouts / time_playouts, moves / time_playouts, self_play_moves / time_self_play))
+    Config.CONNECT_FOUR_ENGINE, Config.MCTS_ITERATIONS = old_values
+    return results
+
+@jit(nopython=True)
+def simulated_legal_actions(pieces, board, player, size):
+    """
+    Legal chess moves, found the way chess.actions_fast used to: making each
+    move on a copy of the board, and generating all moves of the other player
+    there to see if any of them captures the king.
+    """
+    actions = calculate_actions(pieces, board, player, size)
+    legal = []
+    for (y1, x1, y2, x2) in actions:
+        copy_b = np.copy(board)
+        copy_b[y2, x2] = copy_b[y1, x1]
+        copy_b[y1, x1] = 0
+        copy_p = [pos for pos in pieces if pos != (y2, x2)]
+        for i in range(len(copy_p)):
+            if copy_p[i] == (y1, x1):
+                copy_p[i] = (y2, x2)
+        king_y, king_x = find_piece(copy_p, copy_b, player * 2)
+        checked = False
+        for (_, _, y_opp, x_opp) in calculate_actions(copy_p, copy_b, -player, size):
+            if (y_opp, x_opp) == (king_y, king_x):
+                checked = True
+        if not checked:
+            legal.append((y1, x1, y2, x2))
+    return legal
+
+def chess_legal_moves(max_depth=3):
+    """
+    Compare perft on PERFT_POSITIONS, up to 'max_depth', with legal moves found by
+    simulating each move and generating the other player's moves (as chess.actions_fast
+    used to), and from attack maps, pins, and checks (chess.actions_fast).
+    """
+    game = Chess(8)
+    results = {}
+    for name, legal_actions in (("Simulated", simulated_legal_actions), ("Attack maps", actions_fast)):
+        chess_perft(game, game.start_state(), 2, legal_actions) # Compile.
+        nodes = 0
+        time_b = time()
+        for position, fen, counts in PERFT_POSITIONS:
+            for depth, count in counts.items():
+                if depth <= max_depth:
+                    found = chess_perft(game, game.state_from_fen(fen), depth, legal_actions)
+                    if found != count:
+                        print("{}: perft({}) of {} is {}, expected {}".format(name, depth, position, found, count))
+                    nodes += found
+        time_taken = time() - time_b
+        results[name] = time_taken
+        print("{}: {} positions in {:.2f} s ({:.0f} positions/s)".format(name, nodes, time_taken, nodes / time_taken))
+    return results
+
+def state_caches(game_name="Othello", size=8, num_games=6, iterations=50):
+    """
+    Compare self-play with legal actions, terminal tests and utilities cached on
+    states (see Game.actions), and found again every time they are requested.
+    Counts the calls to find_actions (move generations) per game. For games that
+    override Game.packed_actions (which caches moves itself), the moves packed are counted.
+    The same games are played in both runs, from the same random seed.
+    """
+    old_iterations = Config.MCTS_ITERATIONS
+    game_class = type(self_play.get_game(game_name, size, "random"))
+    counted_name = "packed_actions" if "packed_actions" in game_class.__dict__ else "find_actions"
+    find_actions = game_class.__dict__[counted_name]
+    cached = {name: Game.__dict__[name] for name in ("actions", "terminal_test", "utility")}
+    uncached = {"actions": lambda self, state: self.find_actions(state),
+                "terminal_test": lambda self, state: self.find_terminal(state),
+                "utility": lambda self, state, player: self.find_utility(state, player)}
+    calls = [0]
+    def counted_find_actions(self, state):
+        if counted_name == "find_actions" or state.packed_actions is None:
+            calls[0] += 1
+        return find_actions(self, state)
+
+    results = {}
+    try:
+        setattr(game_class, counted_name, counted_find_actions)
+        for name, methods, games_played in (("Warm up", cached, 1), ("Uncached", uncached, num_games),
+                                            ("Cached", cached, num_games)):
+            for method_name, method in methods.items():
+                setattr(Game, method_name, method)
+            Config.MCTS_ITERATIONS = iterations if games_played > 1 else 2
+            np.random.seed(0)
+            game, batch_data = create_batch(game_name, size, games_played)
+            calls[0] = 0
+            time_b = time()
+            self_play.play_games([data[0] for data in batch_data], [data[2] for data in batch_data],
+                                 [data[3] for data in batch_data], Config, connection=FakeConnection(game))
+            time_taken = time() - time_b
+            if games_played > 1:
+                results[name] = (calls[0] / games_played, time_taken / games_played)
+                print("{}: {:.0f} move generations per game. {:.2f} s per game".format(
+                    name, calls[0] / games_played, time_taken / games_played))
+    finally:
+        setattr(game_class, counted_name, find_actions)
+        for method_name, method in cached.items():
+            setattr(Game, method_name, method)
+        Config.MCTS_ITERATIONS = old_iterations
+    print("Move generations saved per game: {:.0f}".format(results["Uncached"][0] - results["Cached"][0]))
+    return results
+
+# Latrunculi's move generation, as it was before legal_moves. Kept for latrunculi_moves.
+#i needed this quick, but there might be a library method for this, just could not find it
+#this method helps construct a stop value for the range used in jump calculations, it makes any negative integer into -1
+#which should let the range run to 0 inclusive, which is what we want, because the stop value is exclusive
+@jit(nopython=True)
+def convert_to_positive_int(x):
+    if x < 0:
+        return -1
+    else:
+        return x
+
+# checks the squares north or south of a players piece, and acts accordingly
+@jit(nopython=True)
+def check_North_Or_South_From_Player_Piece(size, i, j, direction, player, board): #perhaps just pass along the board????
+    actionsList = []
+    if board[i + direction][j] == 0: #check for NORTH/SOUTH square being empty
+        if (j - 1) >= 0 and (j + 1) < size: #check for whether insta-capture is possible or if we are too close to edge of the board
+            actionsList.extend(check_for_capture_and_suicide_west_or_east_of_given_piece(size, i, j, (i+direction), j, player, board))
+        else:  #if there is no chance for insta capture, create action to empty square
+            actionsList.append((i, j, i+direction, j))
+    else: # if the north/south square contains a piece (either 1, 2, -1, -2), check for jumps
+        for x in range(i + (2*direction), (convert_to_positive_int(size * direction)), 2*direction): #Jump-loop
+            if x >= 0 and x < size: #check that x squares north/south is within the bounds of the board 
+                if board[x + (-1*direction)][j] != 0: #check if there is a piece on the odd number square north/south... #this is a double check for the first jump, might want to optimize it...
+                    if board[x][j] == 0: #checks for the even number square north/south being empty, if the square before was occupied
+                        #check for capture/suicide in all directions of the jump destination
+                        jumpActions = check_for_capture_and_suicide_all_directions_of_given_piece(size, i, j, x, j, player, board)
+                        if len(jumpActions) != 0:
+                            actionsList.extend(jumpActions)
+                        else:
+                            break #this jump results in capture, which breaks the jump chain
+                    else:
+                        break #jump chain is broken
+                else:
+                    break #jump chain is broken
+            else:
+                break #break if outside of board bounds
+    return actionsList
+
+# checks the squares west or east of a players piece, and acts accordingly
+@jit(nopython=True)
+def check_West_Or_East_From_Player_Piece(size, i, j, direction, player, board):
+    actionsList = []
+    if board[i][j + direction] == 0: #check for WEST/EAST square being empty
+        if (i - 1) >= 0 and (i + 1) < size: #check for whether insta-capture is possible or if we are too close to edge of the board
+            actionsList.extend(check_for_capture_and_suicide_north_or_south_of_given_piece(size, i, j, i, (j+direction), player, board))
+        else:  #if there is no chance for insta capture, create action to empty square
+            actionsList.append((i, j, i, j+direction))
+    else: # if the WEST/EAST square contains a piece (either 1, 2, -1, -2), check for jumps
+        for x in range(j + (2*direction), (convert_to_positive_int((size*direction))), (2*direction)): #Jump-loop
+            if x >= 0 and x < size: #check that x squares WEST/EAST is within the bounds of the board
+                if board[i][(x + (-1*direction))] != 0: #check if there is a piece on the odd number square WEST/EAST... #this is a double check for the first jump, might want to optimize it...
+                    if board[i][x] == 0: #checks for the even number square WEST/EAST being empty, if the square before was occupied
+                        #check for capture/suicide in all directions of the jump destination
+                        jumpActions = check_for_capture_and_suicide_all_directions_of_given_piece(size, i, j, i, x, player, board)
+                        if len(jumpActions) != 0:
+                            actionsList.extend(jumpActions)
+                        else:
+                            break #this jump results in capture, which breaks the jump chain
+                    else:
+                        break #jump chain is broken
+                else:
+                    break #jump chain is broken
+            else:
+                break #break if outside of board bounds
+    return actionsList
+
+@jit(nopython=True)
+def check_for_capture_and_suicide_all_directions_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
+    action_list = []
+    boolWE = check_for_capture_and_suicide_west_or_east_of_given_piece_bool(size, iOrigin, jOrigin, iDest, jDest, player, board) #check for insta-capture WEST/EAST
+    boolNS = check_for_capture_and_suicide_north_or_south_of_given_piece_bool(size, iOrigin, jOrigin, iDest, jDest, player, board) #check for insta-capture NORTH/SOUTH
+
+    if boolWE and boolNS: #checks whether any insta capture was found, false means that an insta-capture exists on this square
+        action_list.append((iOrigin, jOrigin, iDest, jDest)) #if the move is legal, create action
+
+    return action_list #return the actions_list which is empty if no legal move was found.
+
+@jit(nopython=True)
+def check_for_capture_and_suicide_west_or_east_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
+    enemy_player = -1*player
+    action_list = []
+    if (jDest - 1) >= 0 and (jDest + 1) < size: #check if there is room for a possible insta-capture WEST/EAST
+        if board[iDest][jDest + 1] == enemy_player and board[iDest][jDest - 1] == enemy_player: #check for insta capture
+            if (jDest - 2) >= 0 and board[iDest][jDest - 2] == player and (jDest - 2) != jOrigin: #check for possible suicide action to the west
+                    action_list.append((iOrigin, jOrigin, iDest, jDest))
+            elif (jDest + 2) < size and board[iDest][jDest + 2] == player and (jDest + 2) != jOrigin: #check for possible suicide action to the east
+                    action_list.append((iOrigin, jOrigin, iDest, jDest))
+        else: #if there is no insta capture on this square, create action
+            action_list.append((iOrigin, jOrigin, iDest, jDest))
+    else: #if there is no room for an insta capture on this square, create action
+            action_list.append((iOrigin, jOrigin, iDest, jDest))
+    return action_list
+
+@jit(nopython=True)
+def check_for_capture_and_suicide_north_or_south_of_given_piece(size, iOrigin, jOrigin, iDest, jDest, player, board):
+    enemy_player = -1*player
+    action_list = []
+    if (iDest - 1) >= 0 and (iDest + 1) < size: #check if there is room for a possible insta-capture NORTH/SOUTH
+        if board[iDest + 1][jDest] == enemy_player and board[iDest - 1][jDest] == enemy_player: #check for insta capture
+            if (iDest - 2) >= 0 and board[iDest - 2][jDest] == player and (iDest - 2) != iOrigin: #check for possible suicide action to the north
+                    action_list.append((iOrigin, jOrigin, iDest, jDest))
+            elif (iDest + 2) < size and board[iDest + 2][jDest] == player and (iDest + 2) != iOrigin: #check for possible suicide action to the south
+                    action_list.append((iOrigin, jOrigin, iDest, jDest))
+        else: #if there is no insta capture on this square, create action
+            action_list.append((iOrigin, jOrigin, iDest, jDest))
+    else: #if there is no room for an insta capture on this square, create action
+        action_list.append((iOrigin, jOrigin, iDest, jDest))
+    return action_list
+
+def listed_latrunculi_actions(state, size):
+    """
+    Returns the legal Actions of the given state, found with the functions above,
+    which return a list of tuples per piece and direction.
+    """
+    current_player = 1 if state.player else -1
+    enemy_captured = -2 * current_player
+    actions_list = []
+    for i, j in state.pieces:
+        if state.board[i][j] == current_player:
+            if i > 0:
+                actions_list.extend(check_North_Or_South_From_Player_Piece(size, i, j, -1, current_player, state.board))
+            if i+1 < size:
+                actions_list.extend(check_North_Or_South_From_Player_Piece(size, i, j, 1, current_player, state.board))
+            if j > 0:
+                actions_list.extend(check_West_Or_East_From_Player_Piece(size, i, j, -1, current_player, state.board))
+            if j+1 < size:
+                actions_list.extend(check_West_Or_East_From_Player_Piece(size, i, j, 1, current_player, state.board))
+        elif state.board[i][j] == enemy_captured:
+            actions_list.append((i, j, i, j))
+    if actions_list == []:
+        return [None]
+    return [Action((y1, x1), (y2, x2)) for y1, x1, y2, x2 in actions_list]
+
+def listed_map_actions(actions, logits, size):
+    """
+    Latrunculi.map_actions as it was, with a loop over Actions.
+    """
+    action_map = dict()
+    policy_sum = 0
+    if actions == [None]:
+        action_map[None] = 1
+        return action_map
+    for action in actions:
+        y1, x1 = action.source
+        y2, x2 = action.dest
+        logit = logits[y1, x1, -1] if action.dest == action.source else logits[y1, x1, y2 * size + x2]
+        logit = np.exp(logit)
+        action_map[action] = logit
+        policy_sum += logit
+    for action, policy in action_map.items():
+        action_map[action] = policy/policy_sum if policy_sum else 0
+    return action_map
+
+def latrunculi_moves(game_name="Latrunculi", size=8, num_games=20, max_moves=200):
+    """
+    Compare move generation, and mapping of moves to network policies (as in
+    MCTS.expand), between per-piece functions returning lists of tuples, and
+    legal_moves returning an array of moves. Positions are from random games.
+    """
+    game = Latrunculi(size, "random")
+    positions = []
+    for _ in range(num_games):
+        state = game.start_state()
+        for _ in range(max_moves):
+            positions.append(state)
+            if game.terminal_test(state):
+                break
+            actions = game.actions(state)
+            state = game.result(state, actions[np.random.randint(len(actions))])
+    logits = np.random.normal(0, 1, game.map_visits({}).shape).astype("float32")
+    for state in positions:
+        packed_policies = game.map_actions(game.packed_actions(state), logits)
+        if set(listed_latrunculi_actions(state, size)) != set(map(game.action, packed_policies)):
+            print("Moves differ in position:\n{}".format(state.board))
+            break
+
+    # Packed moves are found without caching them on the states, so each run finds them again.
+    find_packed = lambda state: legal_moves(state.board, 1 if state.player else -1, size)
+    implementations = (
+        ("Lists of tuples", lambda state: listed_latrunculi_actions(state, size),
+         lambda moves: listed_map_actions(moves, logits, size)),
+        ("Packed array", find_packed, lambda moves: game.map_actions(moves, logits)))
+    results = {}
+    for name, find_moves, map_moves in implementations:
+        map_moves(find_moves(positions[0])) # Compile.
+        time_b = time()
+        moves = sum(len(find_moves(state)) for state in positions)
+        time_moves = (time() - time_b) / len(positions)
+        time_b = time()
+        for state in positions:
+            map_moves(find_moves(state))
+        time_expand = (time() - time_b) / len(positions)
+        results[name] = (time_moves, time_expand)
+        print("{}: {} moves in {} positions. {:.1f} us per position to find moves, {:.1f} us with policies".format(
+            name, moves, len(positions), time_moves * 1e6, time_expand * 1e6))
+    return results
+
+def echo_monitor(connection, policy_shape):
+    """
+    Stands in for the monitor process. Joins evaluation requests into one
+    array, like evaluate_games, and answers them with zeroed policies and values.
+    """
+    while True:
+        status, data = connection.recv()
+        if status != "evaluate":
+            return
+        joined = np.array([eval_data for _, eval_data in data])
+        connection.send((np.zeros((len(joined),) + policy_shape, dtype="float32"),
+                         np.zeros(len(joined), dtype="float32")))
+
+def eval_transport(game_name="Othello", size=8, round_trips=2000):
+    """
+    Compare round trips per second of network evaluation requests between
+    a self-play process and the monitor process, over a pipe and through
+    shared memory (Config.EVAL_TRANSPORT). Each request holds a leaf for every
+    game in a process, as with the default Config.ACTORS.
+    """
+    game = self_play.get_game(game_name, size, "random")
+    batch_size = (Config.ACTORS // 3) * Config.MCTS_LEAVES_PER_ROUND
+    state = game.start_state()
+    policy_shape = game.map_visits({}).shape
+    results = {}
+    for transport in ("pipe", "shared_memory"):
+        parent, child = Pipe()
+        slabs = None
+        if transport == "shared_memory":
+            slabs = EvaluationSlabs.for_game(game, batch_size)
+            parent = SharedConnection(parent, slabs)
+            child = SharedConnection(child, slabs)
+        monitor = Process(target=echo_monitor, args=(parent, policy_shape))
+        monitor.start()
+
+        time_b = time()
+        for _ in range(round_trips):
+            data = [(-1, game.structure_data(state)) for _ in range(batch_size)]
+            child.send(("evaluate", data))
+            policies, values = child.recv()
+        time_taken = time() - time_b
+        child.send(("stop", None))
+        monitor.join()
+        if slabs is not None:
+            slabs.unlink()
+
+        results[transport] = round_trips / time_taken
+        print("{}: {:.0f} round trips/s ({:.0f} states/s) with {} states per request".format(
+            transport, round_trips / time_taken, round_trips * batch_size / time_taken, batch_size))
+    return results
+
+BENCHMARKS = {"mcts_tree": mcts_tree, "puct_selection": puct_selection,
+              "virtual_loss": virtual_loss, "transpositions": transpositions,
+              "tree_depth": tree_depth, "search_budget": search_budget,
+              "eval_transport": eval_transport, "continuous_self_play": continuous_self_play,
+              "worker_memory": worker_memory, "replay_sampling": replay_sampling,
+              "replay_encoding": replay_encoding, "replay_segments": replay_segments,
+              "replay_persistence": replay_persistence, "replay_loading": replay_loading,
+              "othello_perft": othello_perft, "connect_four_perft": connect_four_perft,
+              "connect_four_self_play": connect_four_self_play, "chess_legal_moves": chess_legal_moves,
+              "state_caches": state_caches, "latrunculi_moves": latrunculi_moves}
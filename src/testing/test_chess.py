@@ -6,6 +6,7 @@ from model.state import Action, State
 from util.excelUtil import ExcelUtil
 from util.sqlUtil import SqlUtil
 from numpy.random import uniform
+from testing.helpers import chess_perft, PERFT_POSITIONS
 
 def run_tests():
     # Test check.
@@ -21,6 +22,27 @@ def run_tests():
 
     actions = game.actions(state)
 
+    # ==========================
+    # Test legal moves when in check, and of pinned pieces.
+    state = game.state_from_fen("4k3/8/8/8/1b6/8/3P4/4K2R w K - 0 1")
+    dests = [a.dest for a in game.actions(state) if a.source == (6, 3)]
+
+    assertion.assert_equal([], dests, "pinned pawn can not move")
+
+    state = game.state_from_fen("4k3/8/8/8/8/8/3P4/r3K2R w K - 0 1")
+    actions = game.actions(state)
+
+    assertion.assert_true(all(a.source == (7, 4) for a in actions), "only king moves when checked by rook")
+    assertion.assert_true(Action((7, 4), (7, 6)) not in actions, "no castling out of check")
+
+    # ==========================
+    # Test perft node counts.
+    for position, fen, counts in PERFT_POSITIONS:
+        for depth, count in counts.items():
+            if depth <= 3:
+                assertion.assert_equal(count, chess_perft(game, game.state_from_fen(fen), depth),
+                                       "perft({}) of {}".format(depth, position))
+
     # ==========================
     # Terminal test
     state = game.start_state()
@@ -1,11 +1,14 @@
 from testing import assertion
 from controller.connect_four import Connect_Four
+from controller.bitboard import BitboardState
 from model.state import Action
 from time import time
 from util.excelUtil import ExcelUtil
 from util.sqlUtil import SqlUtil
 from numpy.random import uniform
 import numpy as np
+from testing.helpers import perft
+from config import Config
 
 def run_tests():
     # Test possible initial actions.
@@ -65,6 +68,33 @@ def run_tests():
     state = game.start_state()
     mapping = game.map_actions(game.actions(state), logits)
 
+    # =================================
+    # Test bitboard engine against known perft counts, and win detection.
+    old_engine = Config.CONNECT_FOUR_ENGINE
+    Config.CONNECT_FOUR_ENGINE = "bitboard"
+    game = Connect_Four(test_size)
+    nodes = [perft(game, game.start_state(), depth) for depth in range(1, 9)]
+
+    assertion.assert_equal([6, 36, 216, 1296, 7776, 46656, 279930, 1654020], nodes, "bitboard perft")
+
+    state = game.start_state()
+    for x in (0, 1, 0, 1, 0, 1):
+        state = game.result(state, [a for a in game.actions(state) if a.dest[1] == x][0])
+
+    assertion.assert_true(not game.terminal_test(state), "bitboard no win yet")
+
+    state = game.result(state, Action(None, (test_size-4, 0)))
+
+    assertion.assert_true(game.terminal_test(state), "bitboard terminal test vertical")
+    assertion.assert_equal(1, game.utility(state, True), "bitboard utility white")
+    assertion.assert_equal(-1, game.utility(state, False), "bitboard utility black")
+    assertion.assert_equal(-1, state.board[test_size-1, 1], "bitboard board")
+
+    board_state = BitboardState(state.white, state.black, state.player, test_size, test_size)
+
+    assertion.assert_true(game.terminal_test(board_state), "bitboard terminal test without last move")
+    Config.CONNECT_FOUR_ENGINE = old_engine
+
 
 def run_iteration_timing_test(log_type=None):
     # TEST STUFF
@@ -306,6 +306,30 @@ def run_tests():
 
     print(game.structure_data(state))
 
+    # =================================
+    # Test packed moves, and mapping them to policies.
+    game = Latrunculi(8, 42)
+    state = game.start_state()
+    state = game.result(state, game.actions(state)[0])
+    packed = game.packed_actions(state)
+    logits = np.random.normal(0, 1, (8, 8, 65))
+    list_policies = game.map_actions(game.actions(state), logits)
+    packed_policies = game.map_actions(packed, logits)
+
+    assertion.assert_equal((len(game.actions(state)), 4), packed.shape, "packed moves shape")
+    assertion.assert_equal(list_policies.keys(), packed_policies.keys(), "packed moves equal actions")
+    assertion.assert_true(all(np.isclose(list_policies[a], packed_policies[a]) for a in list_policies),
+                          "packed moves policies")
+
+    move = next(iter(packed_policies))
+    action = game.action(move)
+
+    assertion.assert_equal(game.actions(state)[0], action, "packed move action")
+    assertion.assert_true((game.result(state, action).board == game.result(state, move).board).all(),
+                          "packed move result")
+    assertion.assert_true((game.map_visits({action: 1}) == game.map_visits({move: 1})).all(),
+                          "packed move visits")
+
 def run_iteration_timing_test(log_type=None):
     # TEST STUFF
     print("run iteration timing test Latrunculi")
@@ -1,10 +1,254 @@
 from time import time
 from testing import assertion
-from controller.mcts import MCTS, Node, softmax_sample
+import numpy as np
+from controller.mcts import MCTS, Node, ArrayTree, softmax_sample
+from controller.mcts_basic import MCTS_Basic, Node as BasicNode
 from controller.latrunculi import Latrunculi
 from controller.othello import Othello
+from controller.connect_four import Connect_Four
+from controller.chess import Chess
+from controller.game import zobrist_hash
+from config import Config
+from controller.self_play import select_leaves
+
+def run_array_tree_tests():
+    # Test ArrayTree expansion.
+    game = Othello(8)
+    mcts = MCTS(game)
+    mcts.set_tree_type("arrays")
+    state = game.start_state()
+    root = mcts.create_root_node(state)
+    actions = game.actions(state)
+    mcts.expand(root, actions, np.zeros(game.size * game.size))
+
+    assertion.assert_equal(4, len(mcts.child_nodes(root)), "array tree expansion correct num of children")
+    parent_is_root = all(mcts.tree.parent[n] == root for n in mcts.child_nodes(root))
+    assertion.assert_true(parent_is_root, "array tree expansion correct parent")
+
+    # =================================
+    # Test ArrayTree growing beyond its capacity.
+    tree = ArrayTree(2)
+    tree.add_root(state)
+    tree.add_children(0, actions, [0.25] * 4, [state] * 4)
+
+    assertion.assert_equal(5, tree.size, "array tree grows")
+    assertion.assert_equal(range(1, 5), tree.children(0), "array tree children range")
+
+    # =================================
+    # Test ArrayTree selection and backpropagation.
+    children = mcts.child_nodes(root)
+    mcts.tree.prior_prob[children[2]] = 0.9
+    mcts.back_propagate(root, True, 1)
+    node = mcts.select(root)
+
+    assertion.assert_equal(children[2], node, "array tree prior selection")
+
+    mcts.back_propagate(node, mcts.node_state(node).player, -1)
+
+    assertion.assert_equal(2, mcts.tree.visits[root], "array tree backprop root visits")
+    assertion.assert_equal(-1, mcts.tree.q_value[node], "array tree backprop perspective")
+
+    # =================================
+    # Test subtree reuse in the ArrayTree.
+    opponent = MCTS(game)
+    opponent.set_tree_type("arrays")
+    chosen = children[2]
+    opponent.tree = mcts.tree
+    opponent.chosen_node = chosen
+    mcts.expand(chosen, game.actions(mcts.node_state(chosen)), np.zeros(game.size * game.size))
+    player = MCTS(game)
+    player.set_tree_type("arrays")
+    new_root = player.create_root_node(mcts.node_state(chosen), opponent)
+
+    assertion.assert_equal(mcts.tree.visits[chosen], player.tree.visits[new_root], "array tree reuse keeps visits")
+    assertion.assert_equal(len(mcts.child_nodes(chosen)), len(player.child_nodes(new_root)),
+                           "array tree reuse keeps children")
+    assertion.assert_equal(-1, player.tree.parent[new_root], "array tree reuse prunes parent")
+
+def run_reuse_tests():
+    # Test subtree reuse with Node objects.
+    game = Othello(8)
+    state = game.start_state()
+    opponent = MCTS(game)
+    root = opponent.create_root_node(state)
+    opponent.expand(root, game.actions(state), np.zeros(game.size * game.size))
+    chosen = list(root.children.values())[0]
+    chosen.visits = 5
+    opponent.chosen_node = chosen
+    player = MCTS(game)
+    new_root = player.create_root_node(chosen.state, opponent)
+
+    assertion.assert_true(new_root is chosen, "reuse chosen subtree as root")
+    assertion.assert_true(new_root.parent is None, "reuse prunes parent")
+
+    new_root = player.create_root_node(game.start_state(), opponent)
+
+    assertion.assert_equal(0, new_root.visits, "no reuse for other state")
+
+def run_virtual_loss_tests():
+    # Test virtual loss is added to the path and reverted.
+    for tree_type in ("nodes", "arrays"):
+        game = Othello(8)
+        mcts = MCTS(game)
+        mcts.set_tree_type(tree_type)
+        state = game.start_state()
+        root = mcts.create_root_node(state)
+        mcts.expand(root, game.actions(state), np.zeros(game.size * game.size))
+        mcts.back_propagate(root, True, 0)
+        first = mcts.select(root)
+        mcts.add_virtual_loss(first)
+        second = mcts.select(root)
+
+        assertion.assert_true(first != second, f"virtual loss diverts selection ({tree_type})")
+
+        mcts.revert_virtual_loss(first)
+
+        assertion.assert_equal(first, mcts.select(root), f"virtual loss reverted ({tree_type})")
+
+    # =================================
+    # Test that the leaves selected in each tree are counted, when a tree stops early.
+    game = Othello(8)
+    state = game.start_state()
+    expanded, unexpanded = MCTS(game), MCTS(game)
+    roots = [expanded.create_root_node(state), unexpanded.create_root_node(state)]
+    expanded.expand(roots[0], game.actions(state), np.zeros(game.size * game.size))
+    expanded.back_propagate(roots[0], True, 0)
+    batch_data = [[game, state, expanded, expanded], [game, state, unexpanded, unexpanded]]
+    leaves, _, _, counts = select_leaves(batch_data, roots, 3, 1)
+
+    assertion.assert_equal([3, 1], counts, "select leaves counts per tree")
+    assertion.assert_equal(4, len(leaves), "select leaves stops at pending leaf")
+
+def run_transposition_tests():
+    # Test Zobrist hashes of positions reached by different move orders.
+    game = Connect_Four(5)
+    state = game.start_state()
+    game.state_hash(state)
+    a_1, a_2, a_3 = game.actions(state)[:3]
+    state_1 = game.result(game.result(game.result(state, a_1), a_2), a_3)
+    state_2 = game.result(game.result(game.result(state, a_3), a_2), a_1)
+
+    assertion.assert_equal(game.state_hash(state_1), game.state_hash(state_2), "transposition equal hashes")
+
+    state_1.hash_key = None
+    assertion.assert_equal(state_2.hash_key, game.state_hash(state_1), "incremental hash equals full hash")
+
+    # =================================
+    # Test that a transposed leaf is expanded from the table.
+    for tree_type in ("nodes", "arrays"):
+        mcts = MCTS(game)
+        mcts.set_tree_type(tree_type)
+        mcts.set_transpositions(True, 100)
+        root = mcts.create_root_node(state_1)
+
+        assertion.assert_equal(None, mcts.evaluate_transposition(root), f"transposition miss ({tree_type})")
+
+        mcts.set_evaluation_data(root, np.zeros(game.size * game.size), 0.5)
+        other = mcts.create_root_node(state_2)
+
+        assertion.assert_equal(0.5, mcts.evaluate_transposition(other), f"transposition hit value ({tree_type})")
+        assertion.assert_equal(len(game.actions(state_2)), len(mcts.child_nodes(other)),
+                               f"transposition hit expands ({tree_type})")
+        assertion.assert_equal(0.5, mcts.transpositions.hit_rate(), f"transposition hit rate ({tree_type})")
+
+    # =================================
+    # Test incremental hashes of Othello (both engines) and Latrunculi along random games.
+    engine = Config.OTHELLO_ENGINE
+    for name, game_type, engine_option in (("Othello", Othello, "array"), ("Othello bitboard", Othello, "bitboard"),
+                                           ("Latrunculi", Latrunculi, "array")):
+        Config.OTHELLO_ENGINE = engine_option
+        game = game_type(6)
+        state = game.start_state()
+        game.state_hash(state)
+        equal = True
+        for _ in range(30):
+            if game.terminal_test(state):
+                break
+            actions = game.actions(state)
+            state = game.result(state, actions[np.random.randint(len(actions))])
+            table, player_key = game.zobrist_keys()
+            equal = equal and state.hash_key == int(zobrist_hash(state.board, state.player, table, player_key))
+
+        assertion.assert_true(equal, f"incremental hash equals full hash ({name})")
+    Config.OTHELLO_ENGINE = engine
+
+    # =================================
+    # Test that states with the same board, but different draw counters, have different keys.
+    chess = Chess(8)
+    counted = chess.start_state()
+    counted.no_progress_count = 30
+
+    assertion.assert_true(chess.transposition_key(chess.start_state()) != chess.transposition_key(counted),
+                          "transposition key includes draw counters")
+
+def run_path_tests():
+    # Test that selection records the path from the root to the leaf.
+    game = Othello(8)
+    mcts = MCTS(game)
+    mcts.set_tree_type("nodes")
+    state = game.start_state()
+    root = mcts.create_root_node(state)
+    mcts.expand(root, game.actions(state), np.zeros(game.size * game.size))
+    mcts.back_propagate(root, True, 0)
+    child = mcts.select(root)
+    mcts.expand(child, game.actions(child.state), np.zeros(game.size * game.size))
+    leaf = mcts.select(root)
+
+    assertion.assert_equal([root, child, leaf], mcts.path, "select records path")
+
+    # =================================
+    # Test backpropagation along a recorded path.
+    mcts.back_propagate(leaf, leaf.state.player, 1, mcts.path)
+
+    assertion.assert_equal(2, root.visits, "path backprop root visits")
+    assertion.assert_equal((1, -1, 1), (leaf.q_value, child.q_value, root.q_value / 0.5),
+                           "path backprop perspective")
+
+    # =================================
+    # Test MCTS_Basic backpropagation with and without the path.
+    basic = MCTS_Basic(game)
+    root = BasicNode(state, None)
+    child = BasicNode(state, 0, root)
+    leaf = BasicNode(state, 1, child)
+    basic.back_propagate(leaf, 1, [root, child, leaf])
+    basic.back_propagate(leaf, 1)
+
+    assertion.assert_equal((2, -2, 2), (leaf.value, child.value, root.value), "basic path backprop")
+
+def run_search_budget_tests():
+    # Test early stopping when the best action is decided.
+    game = Othello(8)
+    mcts = MCTS(game)
+    mcts.set_tree_type("nodes")
+    mcts.search_budget = 20
+    mcts.time_budget = 0
+    mcts.early_stop = True
+    state = game.start_state()
+    root = mcts.create_root_node(state)
+    mcts.expand(root, game.actions(state), np.zeros(game.size * game.size))
+    for child, visits in zip(root.children.values(), [10, 2, 0, 0]):
+        child.visits = visits
+
+    assertion.assert_true(not mcts.search_finished(root, 12, 0), "early stop, best can be overtaken")
+    assertion.assert_true(mcts.search_finished(root, 13, 0), "early stop, best can not be overtaken")
+
+    # =================================
+    # Test time budget.
+    mcts.early_stop = False
+    mcts.time_budget = 0.5
+
+    assertion.assert_true(not mcts.search_finished(root, 1, 0.1), "time budget not spent")
+    assertion.assert_true(mcts.search_finished(root, 1, 0.6), "time budget spent")
+    assertion.assert_true(mcts.search_finished(root, 20, 0.1), "simulation budget spent")
 
 def run_tests():
+    run_search_budget_tests()
+    run_path_tests()
+    run_array_tree_tests()
+    run_reuse_tests()
+    run_virtual_loss_tests()
+    run_transposition_tests()
+
     # Test softmax sampling.
     game = Othello(8)
 
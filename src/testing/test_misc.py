@@ -1,12 +1,24 @@
+import shutil
+from glob import glob
+import tempfile
 from threading import Thread
+from multiprocessing import Pipe
+import numpy as np
 from time import sleep
 from testing import assertion
 from model.state import Action, State
 from model.storage import ReplayStorage
+from model.eval_cache import EvaluationCache
+from model.replay_buffer import ReplayBuffer, EncodedGame
+from model.replay_segments import SegmentStore
+from model.replay_writer import ReplayWriter, read_chunk
+from model.replay_loader import load_replay_files
+from controller.eval_transport import EvaluationSlabs, SharedConnection
 from controller.latrunculi import Latrunculi
 from controller.connect_four import Connect_Four
 from view.graph import Graph
-from controller.self_play import evaluate_against_ai, get_ai_algorithm
+from controller.self_play import evaluate_against_ai, get_ai_algorithm, play_games, report_games, SelfPlayWorker
+from testing.helpers import FakeConnection, buffer_game
 from config import Config
 
 def run_tests():
@@ -33,3 +45,206 @@ def run_tests():
     as_black = evaluate_against_ai(game, get_ai_algorithm("Random", game), get_ai_algorithm("Random", game), False, 5, Config, None)
     print(as_white)
     print(as_black)
+
+    # =================================
+    # Test network evaluation cache.
+    cache = EvaluationCache(2)
+    position_1 = np.zeros((2, 4, 4), dtype="float32")
+    position_2 = np.ones((2, 4, 4), dtype="float32")
+    key_1 = cache.key(0, position_1)
+    cache.put(key_1, np.ones(16), np.float32(0.5))
+
+    assertion.assert_equal(0.5, cache.get(cache.key(0, position_1))[1], "eval cache hit")
+    assertion.assert_equal(None, cache.get(cache.key(1, position_1)), "eval cache miss for other generation")
+
+    cache.put(cache.key(0, position_2), np.ones(16), np.float32(0.1))
+    cache.get(key_1)
+    cache.put(cache.key(1, position_2), np.ones(16), np.float32(0.2))
+
+    assertion.assert_true(key_1 in cache.entries, "eval cache keeps recently used")
+    assertion.assert_equal(2, len(cache.entries), "eval cache bounded")
+
+    cache.invalidate()
+
+    assertion.assert_equal(0, cache.memory_usage(), "eval cache invalidated")
+
+    # =================================
+    # Test that only moves flagged as training targets are sampled.
+    game = Connect_Four(5)
+    state = game.start_state()
+    for i, action in enumerate(game.actions(state)[:3]):
+        game.store_visit_counts({action: 1}, 0, i == 1)
+        state = game.result(state, action)
+        game.history.append(state)
+    game.history.pop()
+    replay_storage = ReplayStorage()
+    replay_storage.save_game(game.clone())
+    batch_size = Config.BATCH_SIZE
+    Config.BATCH_SIZE = 8
+    images, _ = replay_storage.sample_batch()
+    Config.BATCH_SIZE = batch_size
+
+    assertion.assert_equal([1], game.training_indices(), "training indices")
+    assertion.assert_true(all((image == game.structure_data(game.history[1])).all() for image in images),
+                          "sample batch only samples training targets")
+
+    # =================================
+    # Test evaluation requests and results through shared memory.
+    game = Connect_Four(5)
+    slabs = EvaluationSlabs.for_game(game, 4)
+    parent, child = Pipe()
+    monitor_conn, worker_conn = SharedConnection(parent, slabs), SharedConnection(child, slabs)
+    eval_data = game.structure_data(game.start_state())
+    worker_conn.send(("evaluate", [(-1, eval_data), (3, eval_data)]))
+    status, data = monitor_conn.recv()
+
+    assertion.assert_equal([-1, 3], [n_id for n_id, _ in data], "shared memory request network ids")
+    assertion.assert_true((data[1][1] == eval_data).all(), "shared memory request data")
+
+    monitor_conn.send((np.ones((2,) + slabs.policy_shape), np.array([0.5, -0.5])))
+    policies, values = worker_conn.recv()
+
+    assertion.assert_equal([0.5, -0.5], list(values), "shared memory result values")
+    assertion.assert_equal((2,) + slabs.policy_shape, policies.shape, "shared memory result policies")
+
+    monitor_conn.send(None)
+
+    assertion.assert_equal(None, worker_conn.recv(), "shared memory other messages")
+    slabs.unlink()
+
+    # =================================
+    # Test that finished games are sent and replaced right away in continuous self-play.
+    game = Connect_Four(4)
+    games = [game.clone() for _ in range(3)]
+    connection = FakeConnection(game)
+    game_iterations = Config.GAME_ITERATIONS
+    Config.GAME_ITERATIONS = 2
+    play_games(games, [get_ai_algorithm("Random", g) for g in games],
+               [get_ai_algorithm("Random", g) for g in games], Config,
+               connection=connection, on_game_over=lambda games, _: report_games(games, connection))
+    Config.GAME_ITERATIONS = game_iterations
+
+    assertion.assert_equal(6, connection.games_received, "continuous self-play games played")
+    assertion.assert_true(all(len(g.history) == 1 for g in games), "continuous self-play games reset")
+
+    # =================================
+    # Test that the self-play worker plays GAME_ITERATIONS batches, and can be stopped.
+    games = [game.clone() for _ in range(2)]
+    connection = FakeConnection(game)
+    game_iterations = Config.GAME_ITERATIONS
+    Config.GAME_ITERATIONS = 3
+    worker = SelfPlayWorker(games, [get_ai_algorithm("Random", g) for g in games],
+                            [get_ai_algorithm("Random", g) for g in games], config=Config, connection=connection)
+    worker.run()
+
+    assertion.assert_equal(3, worker.iteration, "self-play worker batches played")
+    assertion.assert_equal(6, connection.games_received, "self-play worker games sent")
+
+    Config.GAME_ITERATIONS = -1
+    worker.on_start = worker.stop
+    worker.run()
+    Config.GAME_ITERATIONS = game_iterations
+
+    assertion.assert_equal(3, worker.iteration, "self-play worker stopped")
+
+    # =================================
+    # Test that the replay buffer evicts the oldest games, and samples their moves uniformly.
+    replay_buffer = ReplayBuffer(3, 8)
+    for moves in range(1, 6):
+        replay_buffer.append(EncodedGame(buffer_game(moves)))
+
+    assertion.assert_equal(3, len(replay_buffer), "replay buffer evicts oldest")
+    assertion.assert_equal(12, replay_buffer.rows_used, "replay buffer position total")
+
+    images, policies, values = replay_buffer.sample(1200)
+    counts = [np.count_nonzero(values == moves) for moves in range(1, 6)]
+
+    assertion.assert_equal([0, 0], counts[:2], "replay buffer samples only stored games")
+    assertion.assert_true(240 < counts[2] < 360 and 440 < counts[4] < 560, "replay buffer samples uniformly over moves")
+    assertion.assert_true(all(policies[i, int(v) - 1] == 1 for i, v in enumerate(values)), "replay buffer sampled policies")
+    assertion.assert_equal(images.shape[1:], Connect_Four(4).structure_data(Connect_Four(4).start_state()).shape,
+                           "replay buffer sampled input planes")
+
+    # =================================
+    # Test that games with only fast searches add no positions, and that games saved
+    # before moves were flagged are sampled along with games with training targets.
+    fast_game = buffer_game(3, 0)
+    fast_game.training_targets = [False] * 3
+    replay_buffer.append(EncodedGame(fast_game))
+
+    assertion.assert_equal(3, len(replay_buffer), "replay buffer skips games with only fast searches")
+
+    legacy_game = buffer_game(4, 6)
+    legacy_game.training_targets = None # Saved before moves were flagged.
+    fast_game.training_targets = [True] * 3
+    replay_buffer = ReplayBuffer(2)
+    replay_buffer.append(EncodedGame(legacy_game))
+    replay_buffer.append(EncodedGame(fast_game))
+    _, _, values = replay_buffer.sample(700)
+
+    assertion.assert_true(350 < np.count_nonzero(values == 6) < 450, "replay buffer samples games without flags")
+
+    # =================================
+    # Test that replay positions stored in segment files are sampled and resumed.
+    folder = tempfile.mkdtemp()
+    replay_buffer = ReplayBuffer(3, store=SegmentStore(folder, 4))
+    for moves in range(1, 6):
+        replay_buffer.append(EncodedGame(buffer_game(moves)), step=moves)
+    resumed = ReplayBuffer(3, store=SegmentStore(folder))
+
+    assertion.assert_equal(3, resumed.load_store(3), "replay segments resumed games")
+    assertion.assert_equal(12, resumed.rows_used, "replay segments resumed positions")
+
+    _, policies, values = resumed.sample(300)
+
+    assertion.assert_equal({3.0, 4.0, 5.0}, set(values), "replay segments samples latest games")
+    assertion.assert_true(all(policies[i, int(v) - 1] == 1 for i, v in enumerate(values)), "replay segments sampled policies")
+
+    resumed.load_store(3, step=2)
+    _, _, values = resumed.sample(100)
+
+    assertion.assert_equal({1.0, 2.0}, set(values), "replay segments resumed at step")
+    shutil.rmtree(folder)
+
+    # =================================
+    # Test that the background replay writer batches games into chunk files.
+    folder = tempfile.mkdtemp() + "/"
+    writer = ReplayWriter(folder, 4, 30, 0, max_delay=0.05)
+    for moves in range(10):
+        writer.put(moves, moves % 2, "Connect_Four")
+    writer.close()
+    chunks = sorted(glob(folder + "Connect_Four/replays/NNv0/*.chunk"))
+    saved = [game for chunk in chunks for game in read_chunk(chunk)]
+
+    assertion.assert_equal([0, 2, 4, 6, 8], saved, "replay writer saves games in order")
+    assertion.assert_equal(10, writer.games_written, "replay writer writes all queued games")
+
+    with open(chunks[-1], "ab") as chunk_file:
+        chunk_file.write(b"\x40\x00\x00\x00cut off")
+
+    assertion.assert_equal(saved[-1], read_chunk(chunks[-1])[-1], "replay writer skips cut off frames")
+
+    writer = ReplayWriter(folder, 4, 30, 0)
+    writer.put(10, 0, "Connect_Four")
+    writer.close()
+    chunks = sorted(glob(folder + "Connect_Four/replays/NNv0/*.chunk"))
+
+    assertion.assert_equal(10, read_chunk(chunks[-1])[-1], "replay writer appends after existing chunks")
+    shutil.rmtree(folder)
+
+    # =================================
+    # Test that saved games are loaded in order, by a pool of processes, up to the max amount of games.
+    folder = tempfile.mkdtemp() + "/"
+    writer = ReplayWriter(folder, 2, 10**6, 0)
+    for moves in range(1, 6):
+        writer.put(buffer_game(moves), 0, "Connect_Four")
+    writer.close()
+    chunks = glob(folder + "Connect_Four/replays/NNv0/*.chunk") * 3
+    lengths = []
+    progress = []
+    loaded = load_replay_files(chunks, 7, lambda encoded: lengths.append(len(encoded)), 2, 1, progress.append)
+
+    assertion.assert_equal(7, loaded, "replay loader stops at max games")
+    assertion.assert_equal([1, 2, 3, 4, 5, 1, 2], lengths, "replay loader keeps file order")
+    assertion.assert_equal([5, 7], progress, "replay loader reports progress")
+    shutil.rmtree(folder)
@@ -1,6 +1,16 @@
+import numpy as np
 from testing import assertion
+from testing.helpers import perft
 from controller.othello import Othello
+from controller.bitboard import BitboardState
 from model.state import Action
+from config import Config
+
+def bitboard_state(board, player):
+    bits = np.uint64(1) << np.arange(board.size, dtype=np.uint64)
+    white = np.bitwise_or.reduce(bits[board.ravel() == 1], initial=np.uint64(0))
+    black = np.bitwise_or.reduce(bits[board.ravel() == -1], initial=np.uint64(0))
+    return BitboardState(white, black, player, board.shape[0], board.shape[1])
 
 def run_tests():
     # Test terminal state cases.
@@ -76,3 +86,47 @@ def run_tests():
     assertion.assert_equal([None], actions_b, "Actions - no moves black")
     assertion.assert_equal([None], game.actions(result), "Actions - no moves white")
     assertion.assert_true(result.player, "Actions - pass switches turn")
+
+    # =================================
+    # Test bitboard engine against known perft counts.
+    old_engine = Config.OTHELLO_ENGINE
+    Config.OTHELLO_ENGINE = "bitboard"
+    game = Othello(8)
+    nodes = [perft(game, game.start_state(), depth) for depth in range(1, 6)]
+
+    assertion.assert_equal([4, 12, 56, 244, 1396], nodes, "Bitboard - perft")
+
+    # =================================
+    # Test bitboard terminal states and flips.
+    game = Othello(6)
+    board = np.zeros((6, 6), dtype="b")
+    board[:4] = 1
+    board[4:] = -1
+    state = bitboard_state(board, True)
+
+    assertion.assert_true(game.terminal_test(state), "Bitboard - terminal test - white wins")
+    assertion.assert_equal(1, game.utility(state, True), "Bitboard - utility - white wins")
+    assertion.assert_equal(-1, game.utility(state, False), "Bitboard - utility - black loses")
+
+    state = game.start_state()
+    result = game.result(state, Action(None, (1, 2)))
+
+    assertion.assert_true(Action(None, (1, 2)) in game.actions(state), "Bitboard - start move")
+    assertion.assert_equal(4, (result.board == 1).sum(), "Bitboard - move flips pieces")
+    assertion.assert_equal(1, result.board[2, 2], "Bitboard - flipped piece")
+
+    # =================================
+    # Test bitboard pass move.
+    board = game.start_state().board.copy()
+    board[3, 2:4] = 0
+    state = bitboard_state(board, True)
+    actions_w = game.actions(state)
+    result = game.result(state, actions_w[0])
+    actions_b = game.actions(result)
+    result = game.result(result, actions_b[0])
+
+    assertion.assert_equal([Action(None, (2, 1))], actions_w, "Bitboard - actions - one move")
+    assertion.assert_equal([None], actions_b, "Bitboard - actions - no moves black")
+    assertion.assert_true(result.player, "Bitboard - pass switches turn")
+    assertion.assert_true(game.terminal_test(result), "Bitboard - terminal test - no moves")
+    Config.OTHELLO_ENGINE = old_engine
@@ -24,6 +24,9 @@ class FancyLogger:
     game_name = ""
     board_size = 4
     network_status = ""
+    eval_cache_status = ""
+    batching_status = ""
+    replay_status = ""
     thread_statuses = dict()
     train_step = 0
     train_ratio = 0
@@ -49,6 +52,17 @@ class FancyLogger:
         FancyLogger.network_status = status
         FancyLogger.pp()
 
+    @staticmethod
+    def set_evaluation_statuses(eval_cache_status, batching_status):
+        FancyLogger.eval_cache_status = eval_cache_status
+        FancyLogger.batching_status = batching_status
+        FancyLogger.pp()
+
+    @staticmethod
+    def set_replay_status(status):
+        FancyLogger.replay_status = status
+        FancyLogger.pp()
+
     @staticmethod
     def set_training_step(step):
         FancyLogger.train_step = step
@@ -93,6 +107,12 @@ class FancyLogger:
             network_string += f"and is targeting '{Config.TARGET_VAL}' value."
             print(network_string)
             print(FancyLogger.network_status)
+            if FancyLogger.eval_cache_status:
+                print(FancyLogger.eval_cache_status)
+            if FancyLogger.batching_status:
+                print(FancyLogger.batching_status)
+            if FancyLogger.replay_status:
+                print(FancyLogger.replay_status)
 
             num_symbols = int(20 * FancyLogger.train_ratio)
             progress_str = "▓" * num_symbols